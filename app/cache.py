@@ -0,0 +1,83 @@
+# app/cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuración de la caché de usuarios autenticados (principals)
+PRINCIPAL_CACHE_MAXSIZE = int(os.getenv("PRINCIPAL_CACHE_MAXSIZE", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+
+class TTLCache:
+    """
+    Caché en memoria acotada, con expiración por tiempo (TTL) y desalojo LRU.
+    Es segura entre hilos, ya que las rutas síncronas de FastAPI se ejecutan
+    en el threadpool. Lleva contadores de aciertos y fallos.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Devuelve el valor cacheado o None si no existe o ha expirado."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Guarda un valor, desalojando el menos usado si se supera maxsize."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Invalida una entrada (no falla si no existe)."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Contadores de uso de la caché."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+            }
+
+
+# Caché username -> schemas.UserPrincipal usada por dependencies.get_current_user.
+# Se invalida desde crud cuando un usuario se modifica o se desactiva.
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_MAXSIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
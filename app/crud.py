@@ -1,17 +1,22 @@
 # app/crud.py
 
+import re
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from sqlalchemy import case, delete, func, insert, or_, select, update
+from sqlalchemy.dialects.mysql import match as mysql_match
 from sqlalchemy.orm import Session
-from . import models, schemas
-from passlib.context import CryptContext
+from . import database, hashing, models, replicas, schemas, security
+from .cache import principal_cache
 
 # --- Hashing de Contraseñas ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
+# El trabajo de bcrypt se hace en el pool de procesos de app/hashing.py
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return hashing.verify_password(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return hashing.hash_password(password)
 
 # --- Funciones CRUD para Tareas (ya existentes) ---
 def get_task(db: Session, task_id: int):
@@ -20,46 +25,721 @@ def get_task(db: Session, task_id: int):
 def get_tasks(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Task).offset(skip).limit(limit).all()
 
+# Stopwords por defecto de InnoDB: no están en el índice FULLTEXT, así que una
+# palabra obligatoria de esta lista haría que la búsqueda no encontrase nada
+MYSQL_FT_STOPWORDS = frozenset(
+    "a about an are as at be by com de en for from how i in is it la of on or "
+    "that the this to was what when where who will with und www".split()
+)
+
+def _full_text_terms(search: str) -> str:
+    """
+    Convierte el texto de búsqueda en una expresión FULLTEXT de MySQL en modo
+    booleano: todas las palabras obligatorias y por prefijo ("+pal* +otra*").
+    Se descartan los operadores que pudiera traer el texto del usuario.
+    Devuelve "" (se usa LIKE) si alguna palabra no está en el índice: más
+    corta que MYSQL_FT_MIN_TOKEN_SIZE o stopword.
+    """
+    palabras = re.findall(r"\w+", search)
+    if any(len(p) < database.MYSQL_FT_MIN_TOKEN_SIZE or p.lower() in MYSQL_FT_STOPWORDS for p in palabras):
+        return ""
+    return " ".join(f"+{palabra}*" for palabra in palabras)
+
+def _filter_tasks(query, owner_id: int, completed: Optional[bool], search: Optional[str], dialect_name: str):
+    """Aplica a un SELECT sobre tasks el filtro de propietario, estado y búsqueda."""
+    query = query.where(models.Task.owner_id == owner_id)
+    if completed is not None:
+        query = query.where(models.Task.completed == completed)
+    if search:
+        if dialect_name == "mysql" and _full_text_terms(search):
+            query = query.where(
+                mysql_match(models.Task.title, models.Task.description, against=_full_text_terms(search)).in_boolean_mode()
+            )
+        else:
+            query = query.where(or_(
+                models.Task.title.contains(search, autoescape=True),
+                models.Task.description.contains(search, autoescape=True),
+            ))
+    return query
+
+# Columnas de schemas.Task: las lecturas que no necesitan objetos ORM las
+# seleccionan como tuplas y las serializan con app/serialization.py
+TASK_ROW_COLUMNS = (models.Task.id, models.Task.title, models.Task.description, models.Task.completed)
+
+def tasks_by_owner_query(
+    owner_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+    dialect_name: str = "mysql",
+    columns: Optional[tuple] = None,
+):
+    """
+    Construye el SELECT de tareas de un usuario con filtros, orden y paginación.
+    Con `columns` se seleccionan esas columnas (tuplas) en lugar de objetos Task.
+    Se comparte entre crud y crud_async. Índices que lo respaldan:
+    - (owner_id, id) y (owner_id, completed, id): filtro por propietario/estado y orden.
+    - FULLTEXT (title, description) en MySQL para `search`; en otros motores
+      se usa LIKE '%texto%' sobre título y descripción.
+    """
+    query = _filter_tasks(select(*columns) if columns else select(models.Task), owner_id, completed, search, dialect_name)
+
+    descendente = sort == schemas.TaskSort.id_desc
+    query = query.order_by(models.Task.id.desc() if descendente else models.Task.id)
+    if after_id is not None:
+        query = query.where(models.Task.id < after_id if descendente else models.Task.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def get_tasks_by_owner(
+    db: Session,
+    owner_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+):
+    """
+    Obtiene las tareas de un usuario, filtradas y ordenadas en SQL.
+    Si se indica after_id se usa paginación por cursor (keyset): la consulta
+    salta directamente a la posición en el índice (owner_id, id) y su coste no
+    depende de la profundidad de la página. Si no, se usa offset/limit.
+    """
+    query = tasks_by_owner_query(
+        owner_id, skip=skip, limit=limit, after_id=after_id,
+        completed=completed, search=search, sort=sort,
+        dialect_name=db.get_bind().dialect.name,
+    )
+    return db.scalars(query).all()
+
+def get_task_rows_by_owner(
+    db: Session,
+    owner_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+):
+    """
+    Igual que get_tasks_by_owner, pero devuelve tuplas (id, title, description,
+    completed) en lugar de objetos ORM (sin identity map ni validación).
+    """
+    query = tasks_by_owner_query(
+        owner_id, skip=skip, limit=limit, after_id=after_id,
+        completed=completed, search=search, sort=sort,
+        dialect_name=db.get_bind().dialect.name, columns=TASK_ROW_COLUMNS,
+    )
+    return db.execute(query).all()
+
+def task_row_query(task_id: int, owner_id: int):
+    """SELECT de las columnas de una tarea, solo si pertenece al usuario."""
+    return select(*TASK_ROW_COLUMNS).where(models.Task.id == task_id, models.Task.owner_id == owner_id)
+
+def get_task_row(db: Session, task_id: int, owner_id: int):
+    """Tupla (id, title, description, completed) de la tarea del usuario, o None."""
+    return db.execute(task_row_query(task_id, owner_id)).first()
+
+def task_rows_stream_query(owner_id: int, completed: Optional[bool], search: Optional[str], dialect_name: str, batch_size: int):
+    """Todas las tareas filtradas del usuario por id, para leerlas por lotes con un cursor de servidor."""
+    return _filter_tasks(
+        select(*TASK_ROW_COLUMNS), owner_id, completed, search, dialect_name,
+    ).order_by(models.Task.id).execution_options(stream_results=True, yield_per=batch_size)
+
+def iter_task_rows(
+    db: Session,
+    owner_id: int,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    batch_size: int = 1000,
+):
+    """
+    Recorre todas las tareas de un usuario (ordenadas por id) en lotes de
+    `batch_size` filas, usando un cursor de servidor (stream_results): la
+    memoria usada no depende del número total de tareas.
+    Devuelve tuplas (id, title, description, completed), sin objetos ORM.
+    """
+    query = task_rows_stream_query(owner_id, completed, search, db.get_bind().dialect.name, batch_size)
+    result = db.execute(query)
+    for lote in result.partitions():
+        yield lote
+
+# --- Versión y contadores de las tareas de cada usuario (ETag y estadísticas) ---
+# users.tasks_version se incrementa en la misma transacción que cualquier
+# cambio en las tareas del usuario, y en el mismo UPDATE se ajustan los
+# contadores users.tasks_total y users.tasks_completed. Leerlos es una consulta
+# por clave primaria, mucho más barata que cargar las tareas o un COUNT(*).
+# Si los contadores se desvían (ej. tareas modificadas fuera de la API), se
+# recalculan con reconcile_task_stats.py.
+
+def tasks_version_bump_stmt(owner_id: int, total: int = 0, completed: int = 0):
+    """
+    UPDATE que incrementa la versión de las tareas del usuario y ajusta sus
+    contadores (`total` y `completed` son incrementos, pueden ser negativos).
+    Lo usan las versiones sync y async.
+    """
+    valores = {"tasks_version": models.User.tasks_version + 1}
+    if total:
+        valores["tasks_total"] = models.User.tasks_total + total
+    if completed:
+        valores["tasks_completed"] = models.User.tasks_completed + completed
+    return (
+        update(models.User)
+        .where(models.User.id == owner_id)
+        .values(**valores)
+        .execution_options(synchronize_session=False)
+    )
+
+def supports_returning(dialect, kind: str) -> bool:
+    """Si el motor admite RETURNING en UPDATE (kind="update") o DELETE (kind="delete")."""
+    return bool(getattr(dialect, f"{kind}_returning", False))
+
+def update_task_stmt(task_id: int, owner_id: int, values: dict):
+    """UPDATE de los campos `values` de la tarea, acotado por owner_id."""
+    return (
+        update(models.Task)
+        .where(models.Task.id == task_id, models.Task.owner_id == owner_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+def complete_task_stmt(task_id: int, owner_id: int):
+    """
+    UPDATE que marca la tarea como completada solo si no lo estaba: su rowcount
+    (0 o 1) es el incremento de tasks_completed, correcto aunque dos peticiones
+    completen la misma tarea a la vez.
+    """
+    return update_task_stmt(task_id, owner_id, {"completed": True}).where(models.Task.completed.isnot(True))
+
+def delete_task_stmt(task_id: int, owner_id: int, completed: Optional[bool] = None):
+    """DELETE de la tarea acotado por owner_id; con `completed`, solo si está en ese estado."""
+    stmt = delete(models.Task).where(models.Task.id == task_id, models.Task.owner_id == owner_id)
+    if completed is not None:
+        stmt = stmt.where(models.Task.completed.is_(True) if completed else models.Task.completed.isnot(True))
+    return stmt.execution_options(synchronize_session=False)
+
+def tasks_version_query(owner_id: int):
+    return select(models.User.tasks_version).where(models.User.id == owner_id)
+
+def tasks_stats_query(owner_id: int):
+    return select(
+        models.User.tasks_total, models.User.tasks_completed, models.User.tasks_version
+    ).where(models.User.id == owner_id)
+
+def bump_tasks_version(db: Session, owner_id: int, total: int = 0, completed: int = 0) -> None:
+    """
+    Incrementa la versión y ajusta los contadores; debe llamarse antes del
+    commit de la modificación, para que ambos cambios sean atómicos.
+    Además fija las lecturas del usuario al primario durante unos segundos
+    (lectura tras escritura con réplicas, ver app/replicas.py).
+    """
+    db.execute(tasks_version_bump_stmt(owner_id, total=total, completed=completed))
+    replicas.pin_to_primary(owner_id)
+
+def get_tasks_version(db: Session, owner_id: int) -> int:
+    """Versión actual de las tareas del usuario (0 si nunca han cambiado)."""
+    return db.scalar(tasks_version_query(owner_id)) or 0
+
+def get_tasks_stats(db: Session, owner_id: int):
+    """Contadores (tasks_total, tasks_completed, tasks_version) del usuario, o None."""
+    return db.execute(tasks_stats_query(owner_id)).first()
+
 # MODIFICACIÓN CLAVE AQUÍ: Aceptar owner_id
 def create_task(db: Session, task: schemas.TaskCreate, owner_id: int): # <--- ¡Añadimos owner_id!
     """
     Crea una nueva tarea en la base de datos, asignándola al usuario especificado.
     """
     # Asignamos el owner_id al modelo de tarea
-    db_task = models.Task(title=task.title, description=task.description, owner_id=owner_id) # <--- ¡Asignamos owner_id!
+    db_task = models.Task(id=new_task_ids(1)[0], title=task.title, description=task.description, owner_id=owner_id) # <--- ¡Asignamos owner_id!
     db.add(db_task)
+    bump_tasks_version(db, owner_id, total=1)
     db.commit()
     db.refresh(db_task)
     return db_task
 
-def update_task(db: Session, task_id: int, task: schemas.TaskCreate):
-    db_task = get_task(db, task_id)
-    if db_task:
-        db_task.title = task.title
-        db_task.description = task.description
+# --- Modificaciones de una tarea, acotadas por owner_id ---
+# Cada una es una sola sentencia sobre tasks (UPDATE/DELETE ... WHERE id AND
+# owner_id) más el ajuste de contadores, con un único commit. El número de
+# filas afectadas (o la fila devuelta con RETURNING, si el motor lo admite)
+# distingue "no existe o no es del usuario" (404) del éxito, sin un SELECT
+# previo. MySQL no admite RETURNING: ahí se usa el rowcount (SQLAlchemy activa
+# CLIENT_FOUND_ROWS, así que cuenta las filas encontradas aunque no cambien).
+
+def update_task(db: Session, task_id: int, owner_id: int, values: dict):
+    """
+    Actualiza los campos `values` (title, description) de la tarea del usuario.
+    Devuelve la fila (id, title, description, completed) o None si no existe.
+    """
+    if not values:
+        return get_task_row(db, task_id, owner_id)
+    stmt = update_task_stmt(task_id, owner_id, values)
+    if supports_returning(db.get_bind().dialect, "update"):
+        fila = db.execute(stmt.returning(*TASK_ROW_COLUMNS)).first()
+    else:
+        fila = get_task_row(db, task_id, owner_id) if db.execute(stmt).rowcount else None
+    if fila is None:
+        db.rollback()
+        return None
+    bump_tasks_version(db, owner_id)
+    db.commit()
+    return fila
+
+def complete_task(db: Session, task_id: int, owner_id: int):
+    """
+    Marca como completada la tarea del usuario. Devuelve (fila, cambiada), o
+    (None, False) si no existe. Si ya estaba completada no se escribe nada.
+    """
+    stmt = complete_task_stmt(task_id, owner_id)
+    if supports_returning(db.get_bind().dialect, "update"):
+        fila = db.execute(stmt.returning(*TASK_ROW_COLUMNS)).first()
+        cambiada = fila is not None
+    else:
+        cambiada = bool(db.execute(stmt).rowcount)
+        fila = None
+    if fila is None:
+        # Sin RETURNING, ya completada o inexistente: se lee la fila
+        fila = get_task_row(db, task_id, owner_id)
+        if fila is None:
+            db.rollback()
+            return None, False
+    if cambiada:
+        bump_tasks_version(db, owner_id, completed=1)
         db.commit()
-        db.refresh(db_task)
-    return db_task
+    return fila, cambiada
+
+def delete_task(db: Session, task_id: int, owner_id: int) -> bool:
+    """Elimina la tarea del usuario. Devuelve False si no existe o no es suya."""
+    if supports_returning(db.get_bind().dialect, "delete"):
+        fila = db.execute(delete_task_stmt(task_id, owner_id).returning(models.Task.completed)).first()
+        if fila is None:
+            db.rollback()
+            return False
+        completada = bool(fila.completed)
+    elif db.execute(delete_task_stmt(task_id, owner_id, completed=False)).rowcount:
+        # Sin RETURNING, el estado (para los contadores) se deduce de qué DELETE borra la fila
+        completada = False
+    elif db.execute(delete_task_stmt(task_id, owner_id, completed=True)).rowcount:
+        completada = True
+    else:
+        db.rollback()
+        return False
+    bump_tasks_version(db, owner_id, total=-1, completed=-int(completada))
+    db.commit()
+    return True
 
-def delete_task(db: Session, task_id: int):
-    db_task = get_task(db, task_id)
-    if db_task:
-        db.delete(db_task)
+
+# --- Operaciones masivas (bulk), en una sola transacción ---
+
+def create_tasks_bulk(db: Session, tasks: List[schemas.TaskCreate], owner_id: int):
+    """
+    Crea varias tareas del usuario en una única transacción.
+    SQLAlchemy agrupa los INSERT (insertmanyvalues) y no hace falta un
+    refresh por fila: los valores se leen tras el flush, antes del commit.
+    """
+    db_tasks = [
+        models.Task(id=task_id, title=t.title, description=t.description, completed=False, owner_id=owner_id)
+        for task_id, t in zip(new_task_ids(len(tasks)), tasks)
+    ]
+    db.add_all(db_tasks)
+    bump_tasks_version(db, owner_id, total=len(db_tasks))
+    db.flush()
+    resultado = [schemas.Task.model_validate(t) for t in db_tasks]
+    db.commit()
+    return resultado
+
+def owned_task_ids_query(task_ids: List[int], owner_id: int):
+    return select(models.Task.id).where(models.Task.owner_id == owner_id, models.Task.id.in_(task_ids))
+
+def bulk_complete_stmt(task_ids, owner_id: int):
+    # Solo las que no estaban completadas: el rowcount es el incremento del contador
+    return (
+        update(models.Task)
+        .where(
+            models.Task.owner_id == owner_id,
+            models.Task.id.in_(task_ids),
+            models.Task.completed.isnot(True),
+        )
+        .values(completed=True)
+        .execution_options(synchronize_session=False)
+    )
+
+def bulk_completed_count_query(task_ids, owner_id: int):
+    return (
+        select(func.count())
+        .select_from(models.Task)
+        .where(
+            models.Task.owner_id == owner_id,
+            models.Task.id.in_(task_ids),
+            models.Task.completed.is_(True),
+        )
+    )
+
+def bulk_delete_stmt(task_ids, owner_id: int):
+    return (
+        delete(models.Task)
+        .where(models.Task.owner_id == owner_id, models.Task.id.in_(task_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+def _owned_task_ids(db: Session, task_ids: List[int], owner_id: int) -> set:
+    """Devuelve cuáles de los IDs indicados existen y pertenecen al usuario."""
+    return set(db.scalars(owned_task_ids_query(task_ids, owner_id)))
+
+def _bulk_results(task_ids: List[int], encontrados: set, status_ok: str):
+    """Resultado por elemento, en el orden pedido y sin IDs repetidos."""
+    return [
+        schemas.BulkItemResult(id=task_id, status=status_ok if task_id in encontrados else "not_found")
+        for task_id in dict.fromkeys(task_ids)
+    ]
+
+def complete_tasks_bulk(db: Session, task_ids: List[int], owner_id: int):
+    """
+    Marca como completadas varias tareas del usuario con un único UPDATE
+    acotado por owner_id, en una sola transacción.
+    """
+    encontrados = _owned_task_ids(db, task_ids, owner_id)
+    if encontrados:
+        completadas = db.execute(bulk_complete_stmt(encontrados, owner_id)).rowcount
+        bump_tasks_version(db, owner_id, completed=completadas)
+    db.commit()
+    return _bulk_results(task_ids, encontrados, "completed")
+
+def delete_tasks_bulk(db: Session, task_ids: List[int], owner_id: int):
+    """
+    Elimina varias tareas del usuario con un único DELETE acotado por
+    owner_id, en una sola transacción.
+    """
+    encontrados = _owned_task_ids(db, task_ids, owner_id)
+    if encontrados:
+        completadas = db.scalar(bulk_completed_count_query(encontrados, owner_id))
+        db.execute(bulk_delete_stmt(encontrados, owner_id))
+        bump_tasks_version(db, owner_id, total=-len(encontrados), completed=-completadas)
+    db.commit()
+    return _bulk_results(task_ids, encontrados, "deleted")
+
+
+def task_insert_rows(rows: List[dict], owner_id: int, ids: Optional[list]) -> List[dict]:
+    """Parámetros del INSERT de un lote: owner_id y, con varios shards, el ID asignado."""
+    filas = [dict(row, owner_id=owner_id) for row in rows]
+    for fila, task_id in zip(filas, ids or ()):
+        if task_id is not None:
+            fila["id"] = task_id
+    return filas
+
+def insert_tasks_batch(db: Session, rows: List[dict], owner_id: int) -> int:
+    """
+    Inserta un lote de tareas ya validadas con un único executemany y confirma
+    el lote (commit por lote). No carga objetos ORM ni hace refresh.
+    Cada fila es un dict con title, description y completed; si trae id (copia
+    entre shards) se conserva.
+    """
+    if not rows:
+        return 0
+    ids = None if "id" in rows[0] else new_task_ids(len(rows))
+    db.execute(insert(models.Task), task_insert_rows(rows, owner_id, ids))
+    bump_tasks_version(
+        db, owner_id, total=len(rows), completed=sum(1 for row in rows if row.get("completed"))
+    )
+    db.commit()
+    return len(rows)
+
+
+def reconcile_task_stats(db: Session, batch_size: int = 1000, owns: Optional[Callable[[int], bool]] = None) -> dict:
+    """
+    Recalcula users.tasks_total y users.tasks_completed a partir de la tabla
+    tasks, por lotes de `batch_size` usuarios y con un commit por lote.
+    Las filas de los usuarios del lote se bloquean (SELECT ... FOR UPDATE)
+    antes de contar: un cambio concurrente en sus tareas espera a que termine
+    el lote en su UPDATE de users y aplica su incremento sobre el valor ya
+    corregido. Si corrige un usuario, incrementa su tasks_version (ETag).
+    Con `owns`, solo se revisan los usuarios para los que devuelve True (con
+    shards, los que viven en el shard de `db`: de los demás, el shard 0 guarda
+    la fila de users y otro shard puede guardar la copia que dejó un
+    movimiento, pero sus contadores válidos están en su shard actual).
+    Devuelve cuántos usuarios se han revisado y cuántos se han corregido.
+    """
+    revisados = corregidos = 0
+    ultimo_id = 0
+    while True:
+        usuarios = db.execute(
+            select(
+                models.User.id, models.User.tasks_total,
+                models.User.tasks_completed, models.User.tasks_version,
+            )
+            .where(models.User.id > ultimo_id)
+            .order_by(models.User.id)
+            .limit(batch_size)
+            .with_for_update()
+        ).all()
+        if not usuarios:
+            break
+        ultimo_id = usuarios[-1].id
+        if owns is not None:
+            usuarios = [u for u in usuarios if owns(u.id)]
+            if not usuarios:
+                db.commit()
+                continue
+        conteos = {
+            fila.owner_id: fila
+            for fila in db.execute(
+                select(
+                    models.Task.owner_id,
+                    func.count().label("total"),
+                    func.sum(case((models.Task.completed.is_(True), 1), else_=0)).label("completed"),
+                )
+                .where(models.Task.owner_id.in_([u.id for u in usuarios]))
+                .group_by(models.Task.owner_id)
+            )
+        }
+        cambios = []
+        for u in usuarios:
+            fila = conteos.get(u.id)
+            total, completadas = (fila.total, int(fila.completed or 0)) if fila else (0, 0)
+            if (u.tasks_total, u.tasks_completed) != (total, completadas):
+                cambios.append({
+                    "id": u.id,
+                    "tasks_total": total,
+                    "tasks_completed": completadas,
+                    "tasks_version": u.tasks_version + 1,
+                })
+        if cambios:
+            # UPDATE por clave primaria de todas las filas del lote (executemany)
+            db.execute(update(models.User), cambios)
         db.commit()
-        return True
-    return False
+        revisados += len(usuarios)
+        corregidos += len(cambios)
+    return {"users_checked": revisados, "users_fixed": corregidos}
+
+
+# --- Claves de idempotencia (ver app/idempotency.py) ---
+# La fila se inserta desde idempotency en la misma transacción que la
+# modificación; aquí solo se lee, se completa con la respuesta y se purga.
+
+def idempotency_key_query(owner_id: int, key: str):
+    return select(models.IdempotencyKey).where(
+        models.IdempotencyKey.owner_id == owner_id, models.IdempotencyKey.key == key
+    )
+
+def idempotency_response_stmt(owner_id: int, key: str, status_code: int, media_type: Optional[str], body: bytes):
+    return (
+        update(models.IdempotencyKey)
+        .where(models.IdempotencyKey.owner_id == owner_id, models.IdempotencyKey.key == key)
+        .values(status_code=status_code, media_type=media_type, response_body=body)
+        .execution_options(synchronize_session=False)
+    )
+
+def idempotency_key_delete_stmt(owner_id: int, key: str):
+    return (
+        delete(models.IdempotencyKey)
+        .where(models.IdempotencyKey.owner_id == owner_id, models.IdempotencyKey.key == key)
+        .execution_options(synchronize_session=False)
+    )
 
-def complete_task(db: Session, task_id: int):
-    db_task = get_task(db, task_id)
-    if db_task:
-        db_task.completed = True
+def get_idempotency_key(db: Session, owner_id: int, key: str):
+    """Fila de la clave del usuario, o None."""
+    return db.scalars(idempotency_key_query(owner_id, key)).first()
+
+def save_idempotency_response(db: Session, owner_id: int, key: str, status_code: int, media_type: Optional[str], body: bytes) -> None:
+    """Guarda la respuesta de la petición que usó la clave."""
+    db.execute(idempotency_response_stmt(owner_id, key, status_code, media_type, body))
+    db.commit()
+
+def delete_idempotency_key(db: Session, owner_id: int, key: str) -> None:
+    """Borra una clave caducada para que pueda volver a usarse."""
+    db.execute(idempotency_key_delete_stmt(owner_id, key))
+    db.commit()
+
+def purge_idempotency_keys(db: Session, before: datetime, batch_size: int = 1000) -> int:
+    """
+    Borra las claves creadas antes de `before`, por lotes de `batch_size`
+    (un commit por lote, para no bloquear la tabla). Devuelve cuántas borra.
+    """
+    borradas = 0
+    while True:
+        ids = db.scalars(
+            select(models.IdempotencyKey.id)
+            .where(models.IdempotencyKey.created_at < before)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            return borradas
+        db.execute(
+            delete(models.IdempotencyKey)
+            .where(models.IdempotencyKey.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
         db.commit()
-        db.refresh(db_task)
-    return db_task
+        borradas += len(ids)
+
+
+# --- Shards (ver app/sharding.py y rebalance_shards.py) ---
+# Cada función recibe la sesión del shard que corresponde; las de user_shards
+# e id_sequences, la del shard 0.
+
+def new_task_ids(count: int) -> list:
+    """
+    IDs para `count` tareas nuevas, únicos entre shards (database.task_ids).
+    Con un solo shard devuelve None en cada posición: autoincremento.
+    """
+    if database.task_ids is None:
+        return [None] * count
+    return database.task_ids.take(count)
+
+def reserve_ids(db: Session, name: str, count: int) -> int:
+    """
+    Reserva `count` IDs consecutivos de la secuencia `name` y devuelve el
+    primero. El UPDATE bloquea la fila hasta el commit, así que dos procesos
+    nunca reciben el mismo bloque.
+    """
+    resultado = db.execute(
+        update(models.IdSequence)
+        .where(models.IdSequence.name == name)
+        .values(next_id=models.IdSequence.next_id + count)
+    )
+    if resultado.rowcount == 0:
+        db.rollback()
+        raise RuntimeError(f"No existe la secuencia de IDs {name!r}: ejecuta create_db_tables.py")
+    siguiente = db.scalar(select(models.IdSequence.next_id).where(models.IdSequence.name == name))
+    db.commit()
+    return siguiente - count
+
+def init_id_sequence(db: Session, name: str, start: int) -> bool:
+    """Crea la secuencia `name` empezando en `start`. False si ya existía."""
+    if db.get(models.IdSequence, name) is not None:
+        return False
+    db.add(models.IdSequence(name=name, next_id=start))
+    db.commit()
+    return True
+
+def get_user_shards(db: Session):
+    """Usuarios movidos de shard como tuplas (owner_id, shard, moving)."""
+    return [
+        tuple(fila) for fila in db.execute(
+            select(models.UserShard.owner_id, models.UserShard.shard, models.UserShard.moving)
+        )
+    ]
+
+def set_user_shard(db: Session, owner_id: int, shard: int, moving: bool) -> None:
+    fila = db.get(models.UserShard, owner_id)
+    if fila is None:
+        db.add(models.UserShard(owner_id=owner_id, shard=shard, moving=moving))
+    else:
+        fila.shard, fila.moving = shard, moving
+    db.commit()
+
+def delete_user_shard(db: Session, owner_id: int) -> None:
+    """El usuario vuelve al shard que indica la estrategia."""
+    db.execute(delete(models.UserShard).where(models.UserShard.owner_id == owner_id))
+    db.commit()
+
+def create_shard_user(db: Session, user_id: int, username: str) -> None:
+    """
+    Copia mínima del usuario en un shard distinto del 0 (sin contraseña): es
+    el destino de la clave foránea de sus tareas y guarda sus contadores.
+    No hace nada si ya existe.
+    """
+    if db.get(models.User, user_id) is None:
+        db.add(models.User(id=user_id, username=username, hashed_password=""))
+        db.commit()
+
+def delete_user_tasks(db: Session, owner_id: int, batch_size: int = 1000) -> int:
+    """
+    Borra las tareas y las claves de idempotencia del usuario en este shard,
+    por lotes de `batch_size` (un commit por lote), y pone sus contadores a
+    cero. Devuelve cuántas tareas borra.
+    """
+    borradas = 0
+    while True:
+        ids = db.scalars(
+            select(models.Task.id).where(models.Task.owner_id == owner_id).limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        db.execute(
+            delete(models.Task).where(models.Task.id.in_(ids)).execution_options(synchronize_session=False)
+        )
+        db.commit()
+        borradas += len(ids)
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.owner_id == owner_id))
+    db.execute(
+        update(models.User)
+        .where(models.User.id == owner_id)
+        .values(tasks_total=0, tasks_completed=0, tasks_version=models.User.tasks_version + 1)
+    )
+    db.commit()
+    return borradas
+
+def copy_user_tasks(source_db: Session, target_db: Session, owner_id: int, batch_size: int = 1000) -> int:
+    """
+    Copia las tareas del usuario de un shard a otro por lotes (un INSERT
+    executemany y un commit por lote, como la importación), con sus mismos IDs
+    (únicos entre shards). La versión del destino queda igual que la del
+    origen, así que los ETag que tenga el cliente siguen valiendo.
+    El usuario debe existir en el destino (create_shard_user) sin tareas.
+    """
+    version = source_db.scalar(tasks_version_query(owner_id)) or 0
+    copiadas = 0
+    for lote in iter_task_rows(source_db, owner_id, batch_size=batch_size):
+        copiadas += insert_tasks_batch(
+            target_db,
+            [
+                {"id": f.id, "title": f.title, "description": f.description, "completed": bool(f.completed)}
+                for f in lote
+            ],
+            owner_id,
+        )
+    # insert_tasks_batch sube la versión en cada lote: queda la del origen. El
+    # usuario no ha escrito desde que se marcó como moving, así que la misma
+    # versión corresponde al mismo contenido
+    target_db.execute(update(models.User).where(models.User.id == owner_id).values(tasks_version=version))
+    target_db.commit()
+    return copiadas
+
+def copy_user_idempotency_keys(source_db: Session, target_db: Session, owner_id: int, batch_size: int = 1000) -> int:
+    """
+    Copia las claves de idempotencia del usuario de un shard a otro por lotes
+    (un commit por lote), para que un reintento tras el movimiento reciba la
+    respuesta guardada. Devuelve cuántas copia.
+    """
+    columnas = [
+        models.IdempotencyKey.owner_id, models.IdempotencyKey.key, models.IdempotencyKey.request_hash,
+        models.IdempotencyKey.status_code, models.IdempotencyKey.media_type,
+        models.IdempotencyKey.response_body, models.IdempotencyKey.created_at,
+    ]
+    copiadas = 0
+    ultimo_id = 0
+    while True:
+        filas = source_db.execute(
+            select(models.IdempotencyKey.id, *columnas)
+            .where(models.IdempotencyKey.owner_id == owner_id, models.IdempotencyKey.id > ultimo_id)
+            .order_by(models.IdempotencyKey.id)
+            .limit(batch_size)
+        ).all()
+        if not filas:
+            break
+        ultimo_id = filas[-1].id
+        target_db.execute(
+            insert(models.IdempotencyKey),
+            [{columna.key: getattr(fila, columna.key) for columna in columnas} for fila in filas],
+        )
+        target_db.commit()
+        copiadas += len(filas)
+    return copiadas
 
 
 # --- NUEVO: Funciones CRUD para Usuarios ---
 
+def get_user(db: Session, user_id: int):
+    """Obtiene un usuario por su ID."""
+    return db.get(models.User, user_id)
+
 def get_user_by_username(db: Session, username: str):
     """Obtiene un usuario por su nombre de usuario."""
     return db.query(models.User).filter(models.User.username == username).first()
@@ -71,4 +751,50 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return db_user
+
+def update_user_password_hash(db: Session, user: models.User, hashed_password: str):
+    """Sustituye el hash de la contraseña (ej. al subir el coste de bcrypt)."""
+    user.hashed_password = hashed_password
+    db.commit()
+    return user
+
+def token_revocation_delete_stmt(user_id: int):
+    """Borra la revocación del usuario (al reactivarlo, o antes de insertar la nueva)."""
+    return delete(models.TokenRevocation).where(models.TokenRevocation.user_id == user_id)
+
+def token_revocation_row(user_id: int) -> models.TokenRevocation:
+    return models.TokenRevocation(user_id=user_id, revoked_at=datetime.now(timezone.utc).replace(tzinfo=None))
+
+def get_token_revocations(db: Session, since: datetime):
+    """Revocaciones posteriores a `since` como tuplas (user_id, epoch), para security.revoked_users."""
+    filas = db.execute(
+        select(models.TokenRevocation.user_id, models.TokenRevocation.revoked_at)
+        .where(models.TokenRevocation.revoked_at > since.astimezone(timezone.utc).replace(tzinfo=None))
+    )
+    return [(user_id, revoked_at.replace(tzinfo=timezone.utc).timestamp()) for user_id, revoked_at in filas]
+
+def _apply_user_active(user: models.User, revocacion: Optional[models.TokenRevocation]) -> None:
+    """Efectos en este proceso tras confirmar el cambio (el resto de workers recargan la tabla)."""
+    principal_cache.delete(user.username)
+    if revocacion is None:
+        security.revoked_users.restore(user.id)
+    else:
+        security.revoked_users.revoke(user.id, revocacion.revoked_at.replace(tzinfo=timezone.utc).timestamp())
+
+def update_user_active(db: Session, user: models.User, is_active: bool):
+    """
+    Activa o desactiva un usuario e invalida su entrada en la caché de
+    usuarios autenticados, para que el cambio se aplique en la siguiente petición.
+    Al desactivarlo se revocan, en todos los workers, los tokens que ya tenía
+    (llevan act=true): la revocación se guarda en la misma transacción.
+    """
+    user.is_active = is_active
+    db.execute(token_revocation_delete_stmt(user.id))
+    revocacion = None if is_active else token_revocation_row(user.id)
+    if revocacion is not None:
+        db.add(revocacion)
+    db.commit()
+    _apply_user_active(user, revocacion)
+    db.refresh(user)
+    return user
@@ -0,0 +1,291 @@
+# app/crud_async.py
+# Versiones asíncronas (AsyncSession) de las funciones de app/crud.py.
+# Se usan cuando DATABASE_URL apunta a un driver asíncrono (ver database.IS_ASYNC).
+#
+# Cubren todas las rutas de tareas. Siguen siendo solo síncronas, a propósito:
+# - Registro, login y refresh (app/routers/auth.py): su coste es bcrypt, que se
+#   ejecuta en el pool de procesos de app/hashing.py y ocupa un hilo mientras
+#   espera, con sesión síncrona o asíncrona.
+# - Shards, reconciliación de contadores y purga de claves de idempotencia:
+#   solo las usan los scripts de mantenimiento.
+
+import asyncio
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models, replicas, schemas
+from .crud import (
+    TASK_ROW_COLUMNS,
+    _apply_user_active,
+    _bulk_results,
+    bulk_complete_stmt,
+    bulk_completed_count_query,
+    bulk_delete_stmt,
+    complete_task_stmt,
+    delete_task_stmt,
+    get_password_hash,
+    idempotency_key_delete_stmt,
+    idempotency_key_query,
+    idempotency_response_stmt,
+    owned_task_ids_query,
+    tasks_by_owner_query,
+    supports_returning,
+    task_insert_rows,
+    task_row_query,
+    task_rows_stream_query,
+    tasks_stats_query,
+    tasks_version_bump_stmt,
+    tasks_version_query,
+    token_revocation_delete_stmt,
+    token_revocation_row,
+    update_task_stmt,
+)
+
+# --- Funciones CRUD para Tareas ---
+async def get_task(db: AsyncSession, task_id: int):
+    return await db.get(models.Task, task_id)
+
+async def get_tasks(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.Task).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def get_task_by_owner(db: AsyncSession, task_id: int, owner_id: int):
+    """Obtiene una tarea solo si pertenece al usuario indicado."""
+    result = await db.execute(
+        select(models.Task).where(models.Task.id == task_id, models.Task.owner_id == owner_id)
+    )
+    return result.scalars().first()
+
+async def get_tasks_by_owner(
+    db: AsyncSession,
+    owner_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+):
+    """Equivalente asíncrono de crud.get_tasks_by_owner (filtros, orden, offset o cursor)."""
+    query = tasks_by_owner_query(
+        owner_id, skip=skip, limit=limit, after_id=after_id,
+        completed=completed, search=search, sort=sort,
+        dialect_name=db.bind.dialect.name,
+    )
+    result = await db.execute(query)
+    return result.scalars().all()
+
+async def get_task_rows_by_owner(
+    db: AsyncSession,
+    owner_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+):
+    """Equivalente asíncrono de crud.get_task_rows_by_owner (tuplas, sin objetos ORM)."""
+    query = tasks_by_owner_query(
+        owner_id, skip=skip, limit=limit, after_id=after_id,
+        completed=completed, search=search, sort=sort,
+        dialect_name=db.bind.dialect.name, columns=TASK_ROW_COLUMNS,
+    )
+    result = await db.execute(query)
+    return result.all()
+
+async def get_task_row(db: AsyncSession, task_id: int, owner_id: int):
+    """Equivalente asíncrono de crud.get_task_row."""
+    result = await db.execute(task_row_query(task_id, owner_id))
+    return result.first()
+
+async def bump_tasks_version(db: AsyncSession, owner_id: int, total: int = 0, completed: int = 0) -> None:
+    """Equivalente asíncrono de crud.bump_tasks_version (versión y contadores)."""
+    await db.execute(tasks_version_bump_stmt(owner_id, total=total, completed=completed))
+    replicas.pin_to_primary(owner_id)
+
+async def get_tasks_version(db: AsyncSession, owner_id: int) -> int:
+    """Equivalente asíncrono de crud.get_tasks_version."""
+    return (await db.scalar(tasks_version_query(owner_id))) or 0
+
+async def get_tasks_stats(db: AsyncSession, owner_id: int):
+    """Equivalente asíncrono de crud.get_tasks_stats."""
+    return (await db.execute(tasks_stats_query(owner_id))).first()
+
+async def new_task_ids(count: int) -> list:
+    """Equivalente asíncrono de crud.new_task_ids (reserva los bloques en el threadpool)."""
+    if database.task_ids is None:
+        return [None] * count
+    return await database.task_ids.take_async(count)
+
+async def create_task(db: AsyncSession, task: schemas.TaskCreate, owner_id: int):
+    """
+    Crea una nueva tarea en la base de datos, asignándola al usuario especificado.
+    """
+    db_task = models.Task(id=(await new_task_ids(1))[0], title=task.title, description=task.description, owner_id=owner_id)
+    db.add(db_task)
+    await bump_tasks_version(db, owner_id, total=1)
+    await db.commit()
+    await db.refresh(db_task)
+    return db_task
+
+async def iter_task_rows(
+    db: AsyncSession,
+    owner_id: int,
+    completed: Optional[bool] = None,
+    search: Optional[str] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[list]:
+    """Equivalente asíncrono de crud.iter_task_rows (cursor de servidor, lotes de tuplas)."""
+    result = await db.stream(task_rows_stream_query(owner_id, completed, search, db.bind.dialect.name, batch_size))
+    async for lote in result.partitions():
+        yield lote
+
+async def insert_tasks_batch(db: AsyncSession, rows: List[dict], owner_id: int) -> int:
+    """Equivalente asíncrono de crud.insert_tasks_batch (un executemany y un commit por lote)."""
+    if not rows:
+        return 0
+    ids = None if "id" in rows[0] else await new_task_ids(len(rows))
+    await db.execute(insert(models.Task), task_insert_rows(rows, owner_id, ids))
+    await bump_tasks_version(
+        db, owner_id, total=len(rows), completed=sum(1 for row in rows if row.get("completed"))
+    )
+    await db.commit()
+    return len(rows)
+
+# --- Operaciones masivas (bulk), en una sola transacción (ver crud.create_tasks_bulk) ---
+async def create_tasks_bulk(db: AsyncSession, tasks: List[schemas.TaskCreate], owner_id: int):
+    """Equivalente asíncrono de crud.create_tasks_bulk."""
+    db_tasks = [
+        models.Task(id=task_id, title=t.title, description=t.description, completed=False, owner_id=owner_id)
+        for task_id, t in zip(await new_task_ids(len(tasks)), tasks)
+    ]
+    db.add_all(db_tasks)
+    await bump_tasks_version(db, owner_id, total=len(db_tasks))
+    await db.flush()
+    resultado = [schemas.Task.model_validate(t) for t in db_tasks]
+    await db.commit()
+    return resultado
+
+async def _owned_task_ids(db: AsyncSession, task_ids: List[int], owner_id: int) -> set:
+    return set(await db.scalars(owned_task_ids_query(task_ids, owner_id)))
+
+async def complete_tasks_bulk(db: AsyncSession, task_ids: List[int], owner_id: int):
+    """Equivalente asíncrono de crud.complete_tasks_bulk (un único UPDATE)."""
+    encontrados = await _owned_task_ids(db, task_ids, owner_id)
+    if encontrados:
+        completadas = (await db.execute(bulk_complete_stmt(encontrados, owner_id))).rowcount
+        await bump_tasks_version(db, owner_id, completed=completadas)
+    await db.commit()
+    return _bulk_results(task_ids, encontrados, "completed")
+
+async def delete_tasks_bulk(db: AsyncSession, task_ids: List[int], owner_id: int):
+    """Equivalente asíncrono de crud.delete_tasks_bulk (un único DELETE)."""
+    encontrados = await _owned_task_ids(db, task_ids, owner_id)
+    if encontrados:
+        completadas = await db.scalar(bulk_completed_count_query(encontrados, owner_id))
+        await db.execute(bulk_delete_stmt(encontrados, owner_id))
+        await bump_tasks_version(db, owner_id, total=-len(encontrados), completed=-completadas)
+    await db.commit()
+    return _bulk_results(task_ids, encontrados, "deleted")
+
+# --- Modificaciones de una tarea, acotadas por owner_id (ver crud.update_task) ---
+async def update_task(db: AsyncSession, task_id: int, owner_id: int, values: dict):
+    """Equivalente asíncrono de crud.update_task (un UPDATE y un commit)."""
+    if not values:
+        return await get_task_row(db, task_id, owner_id)
+    stmt = update_task_stmt(task_id, owner_id, values)
+    if supports_returning(db.bind.dialect, "update"):
+        fila = (await db.execute(stmt.returning(*TASK_ROW_COLUMNS))).first()
+    else:
+        fila = await get_task_row(db, task_id, owner_id) if (await db.execute(stmt)).rowcount else None
+    if fila is None:
+        await db.rollback()
+        return None
+    await bump_tasks_version(db, owner_id)
+    await db.commit()
+    return fila
+
+async def complete_task(db: AsyncSession, task_id: int, owner_id: int):
+    """Equivalente asíncrono de crud.complete_task: devuelve (fila, cambiada)."""
+    stmt = complete_task_stmt(task_id, owner_id)
+    if supports_returning(db.bind.dialect, "update"):
+        fila = (await db.execute(stmt.returning(*TASK_ROW_COLUMNS))).first()
+        cambiada = fila is not None
+    else:
+        cambiada = bool((await db.execute(stmt)).rowcount)
+        fila = None
+    if fila is None:
+        fila = await get_task_row(db, task_id, owner_id)
+        if fila is None:
+            await db.rollback()
+            return None, False
+    if cambiada:
+        await bump_tasks_version(db, owner_id, completed=1)
+        await db.commit()
+    return fila, cambiada
+
+async def delete_task(db: AsyncSession, task_id: int, owner_id: int) -> bool:
+    """Equivalente asíncrono de crud.delete_task."""
+    if supports_returning(db.bind.dialect, "delete"):
+        fila = (await db.execute(delete_task_stmt(task_id, owner_id).returning(models.Task.completed))).first()
+        if fila is None:
+            await db.rollback()
+            return False
+        completada = bool(fila.completed)
+    elif (await db.execute(delete_task_stmt(task_id, owner_id, completed=False))).rowcount:
+        completada = False
+    elif (await db.execute(delete_task_stmt(task_id, owner_id, completed=True))).rowcount:
+        completada = True
+    else:
+        await db.rollback()
+        return False
+    await bump_tasks_version(db, owner_id, total=-1, completed=-int(completada))
+    await db.commit()
+    return True
+
+
+# --- Claves de idempotencia (ver crud.get_idempotency_key) ---
+
+async def get_idempotency_key(db: AsyncSession, owner_id: int, key: str):
+    result = await db.execute(idempotency_key_query(owner_id, key))
+    return result.scalars().first()
+
+async def save_idempotency_response(db: AsyncSession, owner_id: int, key: str, status_code: int, media_type: Optional[str], body: bytes) -> None:
+    await db.execute(idempotency_response_stmt(owner_id, key, status_code, media_type, body))
+    await db.commit()
+
+async def delete_idempotency_key(db: AsyncSession, owner_id: int, key: str) -> None:
+    await db.execute(idempotency_key_delete_stmt(owner_id, key))
+    await db.commit()
+
+
+# --- Funciones CRUD para Usuarios ---
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    """Obtiene un usuario por su nombre de usuario."""
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    """Crea un nuevo usuario con la contraseña hasheada (bcrypt fuera del event loop)."""
+    hashed_password = await asyncio.to_thread(get_password_hash, user.password)
+    db_user = models.User(username=user.username, hashed_password=hashed_password)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def update_user_active(db: AsyncSession, user: models.User, is_active: bool):
+    """Equivalente asíncrono de crud.update_user_active (invalida la caché y revoca los tokens)."""
+    user.is_active = is_active
+    await db.execute(token_revocation_delete_stmt(user.id))
+    revocacion = None if is_active else token_revocation_row(user.id)
+    if revocacion is not None:
+        db.add(revocacion)
+    await db.commit()
+    _apply_user_active(user, revocacion)
+    await db.refresh(user)
+    return user
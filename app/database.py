@@ -1,12 +1,18 @@
 # app/database.py
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 import os
+import time
 from dotenv import load_dotenv
 
+from . import instrumentation, metrics, replicas, sharding
+
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv(
@@ -19,23 +25,331 @@ SQLALCHEMY_DATABASE_URL = os.getenv(
 # Cualquier otra cosa (incluyendo None) se considera False.
 SQLALCHEMY_ECHO = os.getenv("SQLALCHEMY_ECHO", "False").lower() in ('true', '1', 't')
 
+# --- Configuración del pool de conexiones ---
+# DB_POOL_SIZE: conexiones permanentes por proceso (worker).
+# DB_MAX_OVERFLOW: conexiones extra temporales por encima de DB_POOL_SIZE.
+# DB_POOL_TIMEOUT: segundos máximos esperando una conexión libre.
+# DB_POOL_RECYCLE: segundos tras los que se recicla una conexión; debe ser
+#   menor que el wait_timeout de MySQL para no usar conexiones cerradas por el servidor.
+# DB_POOL_PRE_PING: comprueba la conexión antes de usarla y la repone si está rota.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() in ('true', '1', 't')
+
+# Tamaño mínimo de palabra del índice FULLTEXT de MySQL (innodb_ft_min_token_size
+# del servidor, 3 por defecto): las búsquedas con palabras más cortas usan LIKE
+MYSQL_FT_MIN_TOKEN_SIZE = int(os.getenv("MYSQL_FT_MIN_TOKEN_SIZE", "3"))
+
+pool_checkout_wait = metrics.histogram(
+    "db_pool_checkout_wait_seconds",
+    "Tiempo esperando una conexión libre del pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+pool_checkout_timeouts = metrics.counter(
+    "db_pool_checkout_timeouts_total",
+    "Peticiones de conexión que agotaron DB_POOL_TIMEOUT",
+)
+
+
+class _TimedCheckoutMixin:
+    """Mide el tiempo de espera de cada checkout del pool."""
+
+    pool_label = "sync"
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_checkout_timeouts.inc(labels={"pool": self.pool_label})
+            raise
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - inicio, labels={"pool": self.pool_label})
+
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pool_label = "sync"
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pool_label = "async"
+
+
+def _pool_kwargs(url, poolclass):
+    """
+    Argumentos del pool para create_engine. SQLite en memoria usa un pool
+    especial de SQLAlchemy y no admite estas opciones.
+    """
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# --- Modo asíncrono ---
+# Si DATABASE_URL usa un driver asíncrono (ej. mysql+aiomysql://, sqlite+aiosqlite://)
+# se crea además un AsyncEngine y las rutas principales de tareas pasan a ser async.
+# El engine síncrono se mantiene siempre (create_db_tables.py, resto de rutas),
+# usando el driver síncrono equivalente.
+ASYNC_TO_SYNC_DRIVERS = {
+    "aiomysql": "pymysql",
+    "asyncmy": "pymysql",
+    "aiosqlite": "pysqlite",
+}
+
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+IS_ASYNC = _url.get_driver_name() in ASYNC_TO_SYNC_DRIVERS
+
+if IS_ASYNC:
+    SYNC_DATABASE_URL = _url.set(
+        drivername=f"{_url.get_backend_name()}+{ASYNC_TO_SYNC_DRIVERS[_url.get_driver_name()]}"
+    )
+else:
+    SYNC_DATABASE_URL = _url
+
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=SQLALCHEMY_ECHO # Ahora lee de la variable de entorno
+    SYNC_DATABASE_URL,
+    echo=SQLALCHEMY_ECHO, # Ahora lee de la variable de entorno
+    **_pool_kwargs(SYNC_DATABASE_URL, TimedQueuePool)
 )
 
+# Tiempo y número de sentencias SQL por petición (ver app/instrumentation.py)
+instrumentation.instrument_engine(engine)
+
+def _extra_engines(urls, poolclass):
+    """Engines síncronos adicionales (réplicas y shards), instrumentados como `engine`."""
+    engines = []
+    for url in urls:
+        eng = create_engine(url, echo=SQLALCHEMY_ECHO, **_pool_kwargs(url, poolclass))
+        instrumentation.instrument_engine(eng)
+        engines.append(eng)
+    return engines
+
+def _sync_url(url):
+    """URL con el driver síncrono equivalente (como SYNC_DATABASE_URL)."""
+    url = make_url(url)
+    if url.get_driver_name() in ASYNC_TO_SYNC_DRIVERS:
+        url = url.set(drivername=f"{url.get_backend_name()}+{ASYNC_TO_SYNC_DRIVERS[url.get_driver_name()]}")
+    return url
+
+def _async_engines(urls):
+    engines = []
+    for url in urls:
+        eng = create_async_engine(url, echo=SQLALCHEMY_ECHO, **_pool_kwargs(make_url(url), TimedAsyncAdaptedQueuePool))
+        instrumentation.instrument_engine(eng.sync_engine)
+        engines.append(eng)
+    return engines
+
+# --- Réplicas de lectura ---
+# Con DATABASE_REPLICA_URLS las sesiones creadas con info={"replica": True}
+# leen de las réplicas (ver app/replicas.py); el resto usan solo el primario.
+REPLICA_SYNC_URLS = [_sync_url(u) for u in replicas.DATABASE_REPLICA_URLS]
+replica_engines = _extra_engines(REPLICA_SYNC_URLS, TimedQueuePool)
+replica_pool = replicas.ReplicaPool(replica_engines) if replica_engines else None
+
+
+class RoutingSession(replicas.RoutingSession):
+    replicas = replica_pool
+
+
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
-    bind=engine
+    bind=engine,
+    class_=RoutingSession,
 )
 
+# --- Shards ---
+# Con DATABASE_SHARD_URLS las tareas de cada usuario viven en el shard que le
+# asigna shard_map (ver app/sharding.py). DATABASE_URL es el shard 0.
+SHARD_SYNC_URLS = [_sync_url(u) for u in sharding.DATABASE_SHARD_URLS]
+shard_engines = [engine, *_extra_engines(SHARD_SYNC_URLS, TimedQueuePool)]
+
+if IS_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        _url,
+        echo=SQLALCHEMY_ECHO,
+        **_pool_kwargs(_url, TimedAsyncAdaptedQueuePool)
+    )
+    instrumentation.instrument_engine(async_engine.sync_engine)
+
+    async_replica_engines = _async_engines(replicas.DATABASE_REPLICA_URLS)
+    async_shard_engines = [async_engine, *_async_engines(sharding.DATABASE_SHARD_URLS)]
+    # Las AsyncSession enrutan con su sesión síncrona interna, que usa los
+    # .sync_engine; la salud se comprueba con los engines síncronos de arriba
+    async_replica_pool = replicas.ReplicaPool(
+        [e.sync_engine for e in async_replica_engines], check_engines=replica_engines
+    ) if async_replica_engines else None
+
+    class AsyncRoutingSession(replicas.RoutingSession):
+        replicas = async_replica_pool
+
+    # expire_on_commit=False: tras el commit los objetos siguen siendo legibles
+    # sin lanzar una recarga implícita (no permitida fuera de un await).
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+        sync_session_class=AsyncRoutingSession,
+    )
+else:
+    async_engine = None
+    async_replica_engines = []
+    async_shard_engines = []
+    async_replica_pool = None
+    AsyncSessionLocal = None
+
 Base = declarative_base()
 
+
+def pool_status():
+    """Estado actual de los pools de conexiones (para /metrics)."""
+    engines = {"sync": engine}
+    if async_engine is not None:
+        engines["async"] = async_engine.sync_engine
+    for nombre, eng in zip(replica_pool.names if replica_pool else (), replica_engines):
+        engines[nombre] = eng
+    for i, eng in enumerate(shard_engines[1:], start=1):
+        engines[f"shard{i}"] = eng
+    for i, eng in enumerate(async_shard_engines[1:], start=1):
+        engines[f"shard{i}_async"] = eng.sync_engine
+    if async_replica_pool is not None:
+        for nombre, eng in zip(async_replica_pool.names, async_replica_pool.engines):
+            engines[f"{nombre}_async"] = eng
+    estado = {}
+    for nombre, eng in engines.items():
+        pool = eng.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        estado[nombre] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+    return estado
+
+def _dispose_after_fork():
+    """
+    En el proceso hijo de un fork (workers de serve.py con --preload): descarta
+    las conexiones heredadas sin cerrarlas, porque siguen siendo del padre.
+    Cada worker abre las suyas la primera vez que las necesita.
+    """
+    engines = [*shard_engines, *replica_engines]
+    if async_engine is not None:
+        engines += [e.sync_engine for e in (*async_shard_engines, *async_replica_engines)]
+    for eng in engines:
+        eng.dispose(close=False)
+    # El bloque de IDs de tareas reservado por el padre no se puede repartir en dos procesos
+    if task_ids is not None:
+        task_ids.reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Dependencia que entrega una AsyncSession (solo en modo asíncrono)."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def replica_session_info(owner_id=None) -> dict:
+    """
+    info= para crear una sesión que lea de las réplicas. Vacío (primario) si no
+    hay réplicas o si el usuario ha escrito hace poco (lectura tras escritura).
+    """
+    if replica_pool is None or (owner_id is not None and replicas.is_pinned(owner_id)):
+        return {}
+    return {"replica": True}
+
+def _load_shard_assignments():
+    """Filas de user_shards, leídas del shard 0 (para shard_map)."""
+    from . import crud # crud importa models, que importa este módulo
+    db = SessionLocal()
+    try:
+        return crud.get_user_shards(db)
+    finally:
+        db.close()
+
+shard_map = sharding.ShardMap(len(shard_engines), loader=_load_shard_assignments)
+
+def _reserve_task_ids(count: int) -> int:
+    """Reserva `count` IDs de tareas en la secuencia del shard 0 (para task_ids)."""
+    from . import crud
+    db = SessionLocal()
+    try:
+        return crud.reserve_ids(db, "tasks", count)
+    finally:
+        db.close()
+
+# Con varios shards los IDs de las tareas los asigna la aplicación, únicos entre
+# shards; con uno solo, el autoincremento de la tabla (task_ids es None)
+task_ids = sharding.IdAllocator(_reserve_task_ids) if len(shard_engines) > 1 else None
+
+def shard_session(owner_id: int, read: bool = False):
+    """
+    Sesión síncrona en el shard del usuario. Con read=True lee de las réplicas
+    si el usuario está en el shard 0 (las réplicas son de DATABASE_URL).
+    Lanza sharding.ShardMovingError si el usuario se está moviendo de shard.
+    """
+    shard = shard_map.shard_for(owner_id)
+    info = replica_session_info(owner_id) if read and shard == 0 else {}
+    return SessionLocal(bind=shard_engines[shard], info=info)
+
+def async_shard_session(owner_id: int, read: bool = False):
+    """Equivalente de shard_session con AsyncSession (solo en modo asíncrono)."""
+    shard = shard_map.shard_for(owner_id)
+    info = replica_session_info(owner_id) if read and shard == 0 else {}
+    return AsyncSessionLocal(bind=async_shard_engines[shard], info=info)
+
+def _load_token_revocations(since):
+    """Filas recientes de token_revocations, leídas del shard 0 (para security.revoked_users)."""
+    from . import crud
+    db = SessionLocal()
+    try:
+        return crud.get_token_revocations(db, since)
+    finally:
+        db.close()
+
+def start_revocation_refresh():
+    """Carga token_revocations y la recarga periódicamente (REVOCATION_REFRESH_SECONDS)."""
+    from . import security
+    security.revoked_users.start(_load_token_revocations)
+
+def stop_revocation_refresh():
+    from . import security
+    security.revoked_users.stop()
+
+def start_shard_map_refresh():
+    """Carga user_shards y la recarga periódicamente (solo con varios shards)."""
+    shard_map.start()
+
+def stop_shard_map_refresh():
+    shard_map.stop()
+
+def start_replica_health_checks():
+    """Arranca las comprobaciones periódicas de salud de las réplicas (si las hay)."""
+    for pool in (replica_pool, async_replica_pool):
+        if pool is not None:
+            pool.start()
+
+def stop_replica_health_checks():
+    for pool in (replica_pool, async_replica_pool):
+        if pool is not None:
+            pool.stop()
@@ -1,11 +1,12 @@
 # app/dependencies.py
 
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
 from jose import JWTError
 
-from . import crud, schemas, database, security # Importa todos los módulos necesarios
+from . import crud, schemas, database, security, sharding # Importa todos los módulos necesarios
+from .cache import principal_cache
 
 # Define el esquema de seguridad OAuth2 con un punto de token
 # Esto le dice a FastAPI dónde esperar el token y cómo se llama el endpoint de login.
@@ -19,10 +20,37 @@ def get_db():
     finally:
         db.close()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _load_principal_sync(username: str):
+    """Carga el usuario con una sesión síncrona (se ejecuta en el threadpool)."""
+    db = database.SessionLocal(info=database.replica_session_info())
+    try:
+        user = crud.get_user_by_username(db, username=username)
+        return schemas.UserPrincipal.model_validate(user) if user else None
+    finally:
+        db.close()
+
+async def _load_principal(username: str):
+    """
+    Carga el usuario sin bloquear el event loop: con AsyncSession en modo
+    asíncrono, o delegando la consulta síncrona al threadpool.
+    """
+    if database.IS_ASYNC:
+        from . import crud_async # Solo se importa en modo asíncrono (requiere greenlet)
+        async with database.AsyncSessionLocal(info=database.replica_session_info()) as db:
+            user = await crud_async.get_user_by_username(db, username=username)
+            return schemas.UserPrincipal.model_validate(user) if user else None
+    return await run_in_threadpool(_load_principal_sync, username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Dependencia que verifica el token JWT, decodifica el usuario y lo retorna.
     Si el token es inválido o el usuario no existe, lanza HTTPException.
+    Devuelve un schemas.UserPrincipal:
+    - Tokens con los claims "uid" y "act": se autoriza solo con el token, sin
+      base de datos ni caché (salvo que el usuario esté en la lista de revocación).
+    - Tokens antiguos (solo "sub"): el usuario se busca por nombre, con una
+      caché en memoria (TTL + LRU) para no consultar la base de datos cada vez.
+      La lista de revocación se comprueba también, porque la caché es por proceso.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -42,8 +70,75 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError: # Atrapa errores específicos de JWT
         raise credentials_exception
 
-    # Busca el usuario en la base de datos
-    user = crud.get_user_by_username(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+    if payload.get("uid") is not None:
+        # Camino rápido: todo lo necesario viene firmado en el token
+        principal = schemas.UserPrincipal(
+            id=payload["uid"], username=token_data.username, is_active=bool(payload.get("act", True))
+        )
+        if principal.is_active and security.is_revoked(payload):
+            # Token emitido antes de desactivar al usuario
+            raise credentials_exception
+    else:
+        # Primero la caché; solo si falla se busca el usuario en la base de datos
+        principal = principal_cache.get(token_data.username)
+        if principal is None:
+            principal = await _load_principal(token_data.username)
+            if principal is None:
+                raise credentials_exception
+            principal_cache.set(principal.username, principal)
+        if security.is_revoked(payload, principal.id):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Usuario inactivo")
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Usuario inactivo")
+    return principal
+
+
+# --- Sesiones de las tareas (shard del usuario, ver app/sharding.py) ---
+# Las rutas de tareas usan una sesión en el shard del usuario autenticado.
+# Las rutas GET leen además de una réplica (si hay DATABASE_REPLICA_URLS),
+# salvo que el usuario haya modificado sus tareas hace menos de
+# REPLICA_PIN_SECONDS: entonces leen del primario para ver su propio cambio.
+def _shard_moving_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Las tareas de este usuario se están moviendo; reintenta en unos segundos",
+        headers={"Retry-After": str(max(1, round(sharding.SHARD_MAP_REFRESH_SECONDS)))},
+    )
+
+def task_session(owner_id: int, read: bool = False):
+    """database.shard_session que responde 503 si el usuario se está moviendo de shard."""
+    try:
+        return database.shard_session(owner_id, read=read)
+    except sharding.ShardMovingError:
+        raise _shard_moving_exception()
+
+def async_task_session(owner_id: int, read: bool = False):
+    """Equivalente de task_session con AsyncSession (solo en modo asíncrono)."""
+    try:
+        return database.async_shard_session(owner_id, read=read)
+    except sharding.ShardMovingError:
+        raise _shard_moving_exception()
+
+def get_task_db(current_user: schemas.UserPrincipal = Depends(get_current_user)):
+    db = task_session(current_user.id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db(current_user: schemas.UserPrincipal = Depends(get_current_user)):
+    db = task_session(current_user.id, read=True)
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_task_db(current_user: schemas.UserPrincipal = Depends(get_current_user)):
+    """Equivalente de get_task_db con AsyncSession (solo en modo asíncrono)."""
+    async with async_task_session(current_user.id) as db:
+        yield db
+
+async def get_async_read_db(current_user: schemas.UserPrincipal = Depends(get_current_user)):
+    """Equivalente de get_read_db con AsyncSession (solo en modo asíncrono)."""
+    async with async_task_session(current_user.id, read=True) as db:
+        yield db
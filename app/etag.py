@@ -0,0 +1,40 @@
+# app/etag.py
+# ETag fuertes para las lecturas de tareas, calculados a partir de la versión
+# de las tareas del usuario (users.tasks_version) y de los parámetros de la
+# petición. Si el cliente envía un If-None-Match que coincide, se responde
+# 304 sin consultar las tareas ni serializar el cuerpo.
+
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+# Obliga al cliente a revalidar siempre (con If-None-Match) y a no compartir la caché
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """ETag fuerte a partir de las partes que identifican la representación."""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    candidatos = (c.strip() for c in if_none_match.split(","))
+    return any((c[2:] if c.startswith("W/") else c) == etag for c in candidatos)
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Devuelve la respuesta 304 si el cliente ya tiene esta versión; si no, None."""
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers(etag))
+    return None
+
+
+def headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
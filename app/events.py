@@ -0,0 +1,384 @@
+# app/events.py
+# Broker de eventos de cambios en las tareas (pub/sub por usuario).
+#
+# Los routers publican un evento tras cada cambio confirmado (created, updated,
+# completed, deleted, ...) y GET /tasks/events lo reenvía por Server-Sent Events
+# a los dispositivos conectados de ese usuario. Así los clientes no necesitan
+# hacer polling de GET /tasks/ y un cliente inactivo no genera lecturas en la BBDD.
+#
+# Backends:
+# - InMemoryBroker (por defecto): dentro del proceso. Solo ve los eventos del
+#   propio worker, válido con un único worker. Guarda el historial de como mucho
+#   EVENTS_MAX_USERS usuarios y lo descarta tras EVENTS_REPLAY_SECONDS sin
+#   eventos (salvo si el usuario tiene conexiones abiertas).
+# - RedisStreamBroker: si se define EVENTS_REDIS_URL. Un stream de Redis por
+#   usuario, compartido por todos los workers (requiere `pip install redis`).
+# - Cualquier otra implementación de Broker indicada en EVENTS_BROKER="modulo:Clase".
+
+import abc
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional, Set
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from . import logs, schemas
+
+load_dotenv()
+
+# Segundos entre heartbeats cuando no hay eventos (mantiene viva la conexión)
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Eventos recientes que se guardan por usuario para reanudar con Last-Event-ID
+EVENTS_REPLAY_BUFFER = int(os.getenv("EVENTS_REPLAY_BUFFER", "1000"))
+# Segundos que se conserva el historial de un usuario sin eventos ni conexiones (InMemoryBroker)
+EVENTS_REPLAY_SECONDS = float(os.getenv("EVENTS_REPLAY_SECONDS", "300"))
+# Usuarios con historial en memoria; se descartan primero los menos recientes (InMemoryBroker)
+EVENTS_MAX_USERS = int(os.getenv("EVENTS_MAX_USERS", "10000"))
+# Eventos pendientes por conexión antes de considerarla lenta y cortarla
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL")
+EVENTS_BROKER = os.getenv("EVENTS_BROKER")
+
+logger = logs.get_logger(__name__)
+
+# Tipo de evento que indica al cliente que ha perdido eventos y debe recargar la lista
+RESET_EVENT = "reset"
+
+
+@dataclass
+class Event:
+    id: str
+    type: str
+    data: dict = field(default_factory=dict)
+
+    def to_sse(self) -> str:
+        """Formato de Server-Sent Events."""
+        payload = json.dumps(self.data, ensure_ascii=False, separators=(",", ":"))
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+
+class Broker(abc.ABC):
+    """
+    Interfaz de los backends de eventos.
+    - publish() se llama desde las rutas síncronas (en el threadpool) y
+      publish_async() desde las asíncronas, que no deben bloquear el event loop.
+      Por defecto publish_async() ejecuta publish() en el threadpool.
+    - subscribe() devuelve un iterador asíncrono de eventos; produce None cada
+      `heartbeat` segundos sin eventos, para que el llamador envíe un heartbeat.
+    """
+
+    @abc.abstractmethod
+    def publish(self, owner_id: int, type: str, data: dict) -> None:
+        ...
+
+    async def publish_async(self, owner_id: int, type: str, data: dict) -> None:
+        await run_in_threadpool(self.publish, owner_id, type, data)
+
+    @abc.abstractmethod
+    def subscribe(self, owner_id: int, last_event_id: Optional[str] = None,
+                  heartbeat: float = EVENTS_HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Event]]:
+        ...
+
+    def close(self) -> None:
+        """Cierra las suscripciones abiertas (al apagar la aplicación)."""
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event: Optional[Event]) -> None:
+        """Se ejecuta en el event loop del suscriptor. None = cerrar."""
+        if self.overflowed:
+            return
+        if event is None:
+            self._finish(None)
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente demasiado lento: se descartan sus eventos pendientes y se le
+            # pide que recargue. Así un cliente lento no consume memoria sin límite.
+            self._finish(Event(id="", type=RESET_EVENT, data={"reason": "overflow"}))
+
+    def _finish(self, last: Optional[Event]) -> None:
+        """Vacía la cola y deja como único elemento el evento final."""
+        self.overflowed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(last)
+
+
+class _Stream:
+    """Historial de un usuario. Los IDs son "generación-n", con n consecutivo."""
+
+    __slots__ = ("generation", "last_id", "history", "touched")
+
+    def __init__(self, generation: int, replay_buffer: int):
+        self.generation = generation
+        self.last_id = 0
+        self.history: Deque[Event] = deque(maxlen=replay_buffer)
+        self.touched = time.monotonic()
+
+
+class InMemoryBroker(Broker):
+    """
+    Broker dentro del proceso, con buffer de reanudación por usuario. Los
+    historiales forman un LRU acotado a `max_users` y caducan tras
+    `replay_seconds` sin eventos; nunca se descarta el de un usuario conectado.
+    Al descartarlo, el siguiente evento abre una generación nueva y un cliente
+    que reanude con un ID de la anterior recibe un reset.
+    """
+
+    # Historiales que se revisan como mucho en cada publicación para desalojar
+    _EVICT_SCAN = 32
+
+    def __init__(self, replay_buffer: int = EVENTS_REPLAY_BUFFER, queue_size: int = EVENTS_QUEUE_SIZE,
+                 max_users: int = EVENTS_MAX_USERS, replay_seconds: float = EVENTS_REPLAY_SECONDS):
+        self.replay_buffer = replay_buffer
+        self.queue_size = queue_size
+        self.max_users = max(max_users, 1)
+        self.replay_seconds = replay_seconds
+        self._lock = threading.Lock()
+        self._streams: "OrderedDict[int, _Stream]" = OrderedDict()
+        self._generations = itertools.count(1)
+        self._subscribers: Dict[int, Set[_Subscriber]] = {}
+
+    def publish(self, owner_id: int, type: str, data: dict) -> None:
+        with self._lock:
+            ahora = time.monotonic()
+            stream = self._streams.get(owner_id)
+            if stream is None:
+                stream = self._streams[owner_id] = _Stream(next(self._generations), self.replay_buffer)
+            else:
+                self._streams.move_to_end(owner_id)
+            # IDs consecutivos por usuario: permiten detectar eventos perdidos
+            stream.last_id += 1
+            stream.touched = ahora
+            event = Event(id=f"{stream.generation}-{stream.last_id}", type=type, data=data)
+            stream.history.append(event)
+            suscriptores = list(self._subscribers.get(owner_id, ()))
+            self._evict(ahora)
+        for sub in suscriptores:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                pass  # El event loop del suscriptor ya está cerrado
+
+    async def publish_async(self, owner_id: int, type: str, data: dict) -> None:
+        # publish() no bloquea: se ejecuta directamente en el event loop
+        self.publish(owner_id, type, data)
+
+    def _evict(self, ahora: float) -> None:
+        """Descarta los historiales más antiguos sobrantes o caducados. Con el lock."""
+        caducidad = ahora - self.replay_seconds
+        for _ in range(min(self._EVICT_SCAN, len(self._streams))):
+            owner_id, stream = next(iter(self._streams.items()))
+            if len(self._streams) <= self.max_users and stream.touched > caducidad:
+                break
+            if owner_id in self._subscribers:
+                # Usuario conectado: su historial se conserva mientras lo esté
+                stream.touched = ahora
+                self._streams.move_to_end(owner_id)
+            else:
+                del self._streams[owner_id]
+
+    def _replay(self, owner_id: int, last_event_id: Optional[str]):
+        """Eventos posteriores a last_event_id, o un reset si ya no están en el buffer."""
+        if not last_event_id:
+            return []
+        generacion, _, ultimo = last_event_id.partition("-")
+        try:
+            generacion, ultimo = int(generacion), int(ultimo)
+        except ValueError:
+            return [Event(id="", type=RESET_EVENT, data={"reason": "invalid_last_event_id"})]
+        stream = self._streams.get(owner_id)
+        if stream is None or stream.generation != generacion or ultimo > stream.last_id:
+            # ID desconocido (ej. el worker se ha reiniciado o el historial se
+            # descartó por inactividad): el cliente debe recargar
+            return [Event(id="", type=RESET_EVENT, data={"reason": "unknown_last_event_id"})]
+        pendientes = stream.last_id - ultimo
+        if pendientes > len(stream.history):
+            # El evento siguiente al último visto ya salió del buffer
+            return [Event(id="", type=RESET_EVENT, data={"reason": "too_old"})]
+        return list(stream.history)[len(stream.history) - pendientes:]
+
+    async def subscribe(self, owner_id: int, last_event_id: Optional[str] = None,
+                        heartbeat: float = EVENTS_HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Event]]:
+        sub = _Subscriber(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            # Registro y lectura del historial bajo el mismo lock: no se pierde
+            # ningún evento publicado entre ambos pasos
+            self._subscribers.setdefault(owner_id, set()).add(sub)
+            pendientes = self._replay(owner_id, last_event_id)
+        try:
+            for event in pendientes:
+                yield event
+                if event.type == RESET_EVENT:
+                    return
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                yield event
+                if event.type == RESET_EVENT:
+                    return
+        finally:
+            with self._lock:
+                suscriptores = self._subscribers.get(owner_id)
+                if suscriptores is not None:
+                    suscriptores.discard(sub)
+                    if not suscriptores:
+                        del self._subscribers[owner_id]
+
+    def close(self) -> None:
+        with self._lock:
+            todos = [sub for subs in self._subscribers.values() for sub in subs]
+        for sub in todos:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, None)
+            except RuntimeError:
+                pass
+
+
+class RedisStreamBroker(Broker):
+    """
+    Broker compartido entre workers usando un stream de Redis por usuario
+    (XADD con MAXLEN para el buffer, XREAD BLOCK para leer). Los IDs de
+    evento son los de Redis, válidos en cualquier worker para reanudar.
+    """
+
+    def __init__(self, url: str, replay_buffer: int = EVENTS_REPLAY_BUFFER):
+        import redis  # Dependencia opcional
+        import redis.asyncio
+
+        self.url = url
+        self.replay_buffer = replay_buffer
+        self._sync = redis.Redis.from_url(url)
+        self._async_factory = redis.asyncio.Redis.from_url
+        # Cliente asíncrono para publish_async(), ligado al event loop que lo crea
+        self._publisher = None
+        self._publisher_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closed = False
+
+    @staticmethod
+    def _key(owner_id: int) -> str:
+        return f"tasks:events:{owner_id}"
+
+    def _entry(self, type: str, data: dict) -> dict:
+        return {"type": type, "data": json.dumps(data, ensure_ascii=False, separators=(",", ":"))}
+
+    def publish(self, owner_id: int, type: str, data: dict) -> None:
+        self._sync.xadd(self._key(owner_id), self._entry(type, data), maxlen=self.replay_buffer, approximate=True)
+
+    async def publish_async(self, owner_id: int, type: str, data: dict) -> None:
+        loop = asyncio.get_running_loop()
+        if self._publisher is None or self._publisher_loop is not loop:
+            self._publisher = self._async_factory(self.url)
+            self._publisher_loop = loop
+        await self._publisher.xadd(
+            self._key(owner_id), self._entry(type, data), maxlen=self.replay_buffer, approximate=True
+        )
+
+    async def subscribe(self, owner_id: int, last_event_id: Optional[str] = None,
+                        heartbeat: float = EVENTS_HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Event]]:
+        client = self._async_factory(self.url)
+        key = self._key(owner_id)
+        try:
+            if last_event_id:
+                if not _valid_redis_id(last_event_id):
+                    yield Event(id="", type=RESET_EVENT, data={"reason": "invalid_last_event_id"})
+                    return
+                # Redis >= 7 informa del mayor ID recortado por MAXLEN: si es
+                # posterior al último visto, el cliente ha perdido eventos
+                try:
+                    info = await client.xinfo_stream(key)
+                except Exception:
+                    info = {}
+                recortado = info.get("max-deleted-entry-id") or info.get(b"max-deleted-entry-id")
+                if isinstance(recortado, bytes):
+                    recortado = recortado.decode()
+                if recortado and _redis_id_parts(recortado) > _redis_id_parts(last_event_id):
+                    yield Event(id="", type=RESET_EVENT, data={"reason": "too_old"})
+                    return
+                desde = last_event_id
+            else:
+                # Se parte del último ID actual (no de "$" en cada XREAD, que
+                # perdería los eventos publicados entre dos lecturas)
+                ultimos = await client.xrevrange(key, count=1)
+                desde = ultimos[0][0].decode() if ultimos else "0-0"
+            while not self._closed:
+                respuesta = await client.xread({key: desde}, block=int(heartbeat * 1000), count=100)
+                if not respuesta:
+                    yield None
+                    continue
+                for event_id, campos in respuesta[0][1]:
+                    desde = event_id.decode()
+                    yield Event(id=desde, type=campos[b"type"].decode(), data=json.loads(campos[b"data"]))
+        finally:
+            await client.aclose()
+
+    def close(self) -> None:
+        self._closed = True
+
+
+def _redis_id_parts(event_id: str):
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+def _valid_redis_id(event_id: str) -> bool:
+    try:
+        _redis_id_parts(event_id)
+        return True
+    except ValueError:
+        return False
+
+
+def _create_broker() -> Broker:
+    if EVENTS_BROKER:
+        modulo, _, clase = EVENTS_BROKER.partition(":")
+        return getattr(importlib.import_module(modulo), clase)()
+    if EVENTS_REDIS_URL:
+        return RedisStreamBroker(EVENTS_REDIS_URL)
+    return InMemoryBroker()
+
+
+broker: Broker = _create_broker()
+
+
+def publish(owner_id: int, type: str, data: dict) -> None:
+    """
+    Publica un cambio en las tareas del usuario. Se llama después del commit.
+    Un fallo del broker no debe romper la petición que ya ha confirmado el cambio.
+    """
+    try:
+        broker.publish(owner_id, type, data)
+    except Exception:
+        logger.exception("Error publicando evento", extra={"fields": {"type": type, "owner_id": owner_id}})
+
+
+async def publish_async(owner_id: int, type: str, data: dict) -> None:
+    """publish() para las rutas asíncronas: no bloquea el event loop."""
+    try:
+        await broker.publish_async(owner_id, type, data)
+    except Exception:
+        logger.exception("Error publicando evento", extra={"fields": {"type": type, "owner_id": owner_id}})
+
+
+def task_payload(task) -> dict:
+    """Datos de una tarea (objeto ORM o esquema) tal y como los devuelve la API."""
+    return schemas.Task.model_validate(task).model_dump(mode="json")
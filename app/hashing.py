@@ -0,0 +1,123 @@
+# app/hashing.py
+# Hashing y verificación de contraseñas (bcrypt) fuera del proceso principal.
+#
+# bcrypt consume ~200 ms de CPU por verificación sin soltar el GIL, así que
+# una ráfaga de logins bloquearía al resto de endpoints del worker. Aquí el
+# trabajo se envía a un pool de procesos dedicado, con un límite de
+# operaciones en curso: si se supera, se responde 503 inmediatamente en vez
+# de encolar sin límite.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+load_dotenv()
+
+# Coste de bcrypt. Los hashes con un coste menor se regeneran en el siguiente login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Procesos dedicados al hashing. 0 = hashing en el propio hilo (desarrollo/pruebas).
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Operaciones de hashing admitidas a la vez (en ejecución + en cola).
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", str(max(PASSWORD_HASH_WORKERS, 1) * 4)))
+# Segundos máximos esperando el resultado de una operación.
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+
+# --- Configuración de Hashing de Contraseñas ---
+# min_rounds = default_rounds hace que needs_update() marque los hashes antiguos
+# con menos coste, para rehacerlos automáticamente tras un login correcto.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(PASSWORD_HASH_QUEUE_LIMIT, 1))
+
+
+# --- Funciones que se ejecutan en los procesos del pool ---
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Crea el pool de procesos la primera vez que se usa (nunca al importar)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # "spawn": los procesos hijos no heredan hilos ni conexiones del worker
+                _executor = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def _run(func, *args):
+    """
+    Ejecuta func en el pool de procesos respetando el límite de operaciones
+    en curso. Lanza HTTPException 503 si el pool está saturado.
+    """
+    if PASSWORD_HASH_WORKERS <= 0:
+        return func(*args)
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servicio de autenticación saturado, inténtalo de nuevo",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        future = _get_executor().submit(func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # El hueco se libera cuando el trabajo termina de verdad, no cuando dejamos
+    # de esperarlo: tras un timeout sigue ocupando un proceso del pool
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Tiempo de espera agotado verificando la contraseña",
+            headers={"Retry-After": "1"},
+        )
+
+
+def hash_password(password: str) -> str:
+    """Hashea una contraseña en el pool de procesos."""
+    return _run(_hash, password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifica una contraseña en el pool de procesos."""
+    return _run(_verify_and_update, plain_password, hashed_password)[0]
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica una contraseña y, si el hash usa una configuración obsoleta
+    (ej. menos rondas que BCRYPT_ROUNDS), devuelve también el hash nuevo.
+    Devuelve (es_valida, nuevo_hash_o_None).
+    """
+    return _run(_verify_and_update, plain_password, hashed_password)
+
+
+def shutdown() -> None:
+    """Detiene el pool de procesos (al apagar la aplicación), esperando a las operaciones en curso."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
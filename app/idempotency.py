@@ -0,0 +1,356 @@
+# app/idempotency.py
+# Claves de idempotencia (cabecera Idempotency-Key) en las modificaciones de tareas.
+#
+# Los clientes móviles reintentan POST /tasks/ cuando vence su timeout; sin
+# clave, cada reintento vuelve a crear la tarea. Con la misma Idempotency-Key
+# (por usuario) la petición se ejecuta una sola vez y los reintentos reciben la
+# respuesta guardada (mismo código y cuerpo, con Idempotent-Replayed: true):
+#
+# - Caché en memoria acotada (TTLCache de IDEMPOTENCY_CACHE_MAXSIZE entradas)
+#   con las respuestas recientes: un reintento no toca la base de datos.
+# - Tabla idempotency_keys (en el shard del usuario, ver app/sharding.py): la
+#   fila de la clave se inserta en la misma transacción que la modificación
+#   (listener before_commit), así que ambas se confirman juntas o no se
+#   confirma ninguna. Por el índice único (owner_id, key), si otro worker
+#   ejecuta la misma clave a la vez su commit falla y se le sirve la respuesta
+#   del primero. La respuesta se guarda en la fila al terminar la petición.
+# - Duplicados en curso: si la primera petición sigue ejecutándose en el mismo
+#   worker, el duplicado espera su resultado (hasta IDEMPOTENCY_WAIT_SECONDS)
+#   en vez de ejecutarse.
+#
+# Reutilizar una clave con otro método, ruta o cuerpo devuelve 422. Solo
+# consumen la clave las peticiones que confirman una transacción: un 404 o un
+# error de validación pueden reintentarse con la misma clave. Las claves caducan
+# a las IDEMPOTENCY_TTL_SECONDS; purge_idempotency_keys.py las borra de la tabla.
+#
+# Se aplica con los tokens que llevan el claim "uid" (los antiguos, solo con
+# "sub", se atienden sin idempotencia) y no en POST /tasks/import, cuyo cuerpo
+# se procesa en streaming.
+
+import asyncio
+import hashlib
+import os
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security.utils import get_authorization_scheme_param
+from jose import JWTError
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import crud, database, dependencies, instrumentation, logs, metrics, models, ratelimit, security
+from .cache import TTLCache
+
+load_dotenv()
+
+# Tiempo durante el que una clave devuelve la respuesta guardada (24 h)
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Respuestas guardadas en memoria por worker
+IDEMPOTENCY_CACHE_MAXSIZE = int(os.getenv("IDEMPOTENCY_CACHE_MAXSIZE", "10000"))
+# Respuestas más grandes que esto solo se guardan en la base de datos (bytes)
+IDEMPOTENCY_CACHE_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_CACHE_MAX_BODY_BYTES", "65536"))
+# Espera máxima de un duplicado a que termine la primera petición (segundos)
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Rutas que aceptan Idempotency-Key (método, plantilla de la ruta)
+IDEMPOTENT_ROUTES = {
+    ("POST", "/tasks/"),
+    ("POST", "/tasks/bulk"),
+    ("PATCH", "/tasks/bulk/complete"),
+    ("DELETE", "/tasks/bulk"),
+    ("PUT", "/tasks/{task_id}"),
+    ("PATCH", "/tasks/{task_id}"),
+    ("DELETE", "/tasks/{task_id}"),
+    ("PATCH", "/tasks/{task_id}/complete"),
+}
+
+logger = logs.get_logger(__name__)
+
+replays = metrics.counter(
+    "idempotency_replays_total",
+    "Respuestas devueltas de nuevo por Idempotency-Key (source: memory, database o inflight)",
+)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _key_reused() -> HTTPException:
+    # 422 sin constante: su nombre cambia entre versiones de Starlette
+    return HTTPException(status_code=422, detail="Idempotency-Key ya usada con otra petición")
+
+def _in_progress() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="La petición con esta Idempotency-Key sigue en curso; reintente más tarde",
+    )
+
+
+class StoredResponse:
+    """Respuesta guardada de una clave. status_code None: la petición aún no ha terminado."""
+
+    __slots__ = ("request_hash", "status_code", "media_type", "body", "expires_at")
+
+    def __init__(self, request_hash: str, status_code: Optional[int], media_type: Optional[str], body: Optional[bytes], expires_at: datetime):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.media_type = media_type
+        self.body = body
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_row(cls, fila: models.IdempotencyKey) -> "StoredResponse":
+        return cls(
+            fila.request_hash, fila.status_code, fila.media_type, fila.response_body,
+            fila.created_at + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        )
+
+    def expired(self) -> bool:
+        return self.expires_at <= _utcnow()
+
+    def replay(self, request_hash: str, source: str) -> Response:
+        if request_hash != self.request_hash:
+            raise _key_reused()
+        if self.status_code is None:
+            raise _in_progress()
+        replays.inc(labels={"source": source})
+        return Response(
+            content=self.body or b"", status_code=self.status_code,
+            media_type=self.media_type, headers={REPLAYED_HEADER: "true"},
+        )
+
+
+# Respuestas recientes por (owner_id, key), en memoria de cada worker
+response_cache = TTLCache(maxsize=IDEMPOTENCY_CACHE_MAXSIZE, ttl=IDEMPOTENCY_TTL_SECONDS)
+
+# Peticiones con clave en curso en este worker: (owner_id, key) -> (request_hash, Future)
+_in_flight: dict = {}
+
+
+def _cache(ident: tuple, guardada: StoredResponse) -> None:
+    if guardada.status_code is not None and len(guardada.body or b"") <= IDEMPOTENCY_CACHE_MAX_BODY_BYTES:
+        response_cache.set(ident, guardada)
+
+
+# --- Fila de la clave, en la transacción de la modificación ---
+class _Pending:
+    """Clave de la petición en curso, a insertar con su primer commit."""
+
+    __slots__ = ("owner_id", "key", "request_hash", "recorded")
+
+    def __init__(self, owner_id: int, key: str, request_hash: str):
+        self.owner_id = owner_id
+        self.key = key
+        self.request_hash = request_hash
+        self.recorded = False
+
+
+# El contextvar llega al threadpool de las rutas síncronas y a los greenlets de AsyncSession
+_pending: ContextVar[Optional[_Pending]] = ContextVar("idempotency_pending", default=None)
+
+
+@event.listens_for(Session, "before_commit")
+def _record_key(session: Session) -> None:
+    pendiente = _pending.get()
+    if pendiente is None or pendiente.recorded:
+        return
+    session.add(models.IdempotencyKey(
+        owner_id=pendiente.owner_id, key=pendiente.key,
+        request_hash=pendiente.request_hash, created_at=_utcnow(),
+    ))
+    pendiente.recorded = True
+
+
+# --- Lectura y guardado en la base de datos (primario del shard del usuario) ---
+def _load_sync(owner_id: int, key: str) -> Optional[StoredResponse]:
+    db = dependencies.task_session(owner_id)
+    try:
+        fila = crud.get_idempotency_key(db, owner_id, key)
+        if fila is None:
+            return None
+        guardada = StoredResponse.from_row(fila)
+        if guardada.expired():
+            # Caducada pero aún sin purgar: se libera la clave
+            crud.delete_idempotency_key(db, owner_id, key)
+            return None
+        return guardada
+    finally:
+        db.close()
+
+async def _load(owner_id: int, key: str) -> Optional[StoredResponse]:
+    """Respuesta guardada de la clave, sin bloquear el event loop (como dependencies._load_principal)."""
+    if database.IS_ASYNC:
+        from . import crud_async # Solo se importa en modo asíncrono (requiere greenlet)
+        async with dependencies.async_task_session(owner_id) as db:
+            fila = await crud_async.get_idempotency_key(db, owner_id, key)
+            if fila is None:
+                return None
+            guardada = StoredResponse.from_row(fila)
+            if guardada.expired():
+                await crud_async.delete_idempotency_key(db, owner_id, key)
+                return None
+            return guardada
+    return await run_in_threadpool(_load_sync, owner_id, key)
+
+def _save_sync(owner_id: int, key: str, guardada: StoredResponse) -> None:
+    db = dependencies.task_session(owner_id)
+    try:
+        crud.save_idempotency_response(db, owner_id, key, guardada.status_code, guardada.media_type, guardada.body)
+    finally:
+        db.close()
+
+async def _save(owner_id: int, key: str, guardada: StoredResponse) -> None:
+    if database.IS_ASYNC:
+        from . import crud_async
+        async with dependencies.async_task_session(owner_id) as db:
+            await crud_async.save_idempotency_response(
+                db, owner_id, key, guardada.status_code, guardada.media_type, guardada.body
+            )
+        return
+    await run_in_threadpool(_save_sync, owner_id, key, guardada)
+
+async def _wait_stored(owner_id: int, key: str) -> Optional[StoredResponse]:
+    """
+    Fila de la clave, esperando hasta IDEMPOTENCY_WAIT_SECONDS a que otro
+    worker guarde su respuesta si aún no lo ha hecho.
+    """
+    loop = asyncio.get_running_loop()
+    limite = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        guardada = await _load(owner_id, key)
+        if guardada is None or guardada.status_code is not None or loop.time() >= limite:
+            return guardada
+        await asyncio.sleep(0.1)
+
+
+# --- Petición ---
+def _owner_id(request: Request) -> Optional[int]:
+    """
+    ID del usuario del token, o None si no es válido o es un token antiguo sin
+    "uid" (la ruta lo rechazará o lo atenderá sin idempotencia).
+    """
+    esquema, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if esquema.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = security.decode_access_token(token)
+    except (HTTPException, JWTError):
+        return None
+    if not payload or payload.get("uid") is None or not payload.get("act", True) or security.is_revoked(payload):
+        return None
+    return payload["uid"]
+
+async def _request_hash(request: Request) -> str:
+    """SHA-256 de método, ruta, query y cuerpo (el cuerpo queda en caché para la ruta)."""
+    h = hashlib.sha256()
+    h.update(f"{request.method} {request.url.path}?{request.url.query}\n".encode())
+    h.update(await request.body())
+    return h.hexdigest()
+
+async def _execute(handler, request: Request, owner_id: int, key: str, request_hash: str) -> Response:
+    """Ejecuta la petición una sola vez por clave y guarda su respuesta."""
+    ident = (owner_id, key)
+    while True:
+        guardada = response_cache.get(ident)
+        if guardada is not None and not guardada.expired():
+            return guardada.replay(request_hash, "memory")
+
+        en_curso = _in_flight.get(ident)
+        if en_curso is None:
+            break
+        # Duplicado de una petición en curso en este worker: espera su resultado
+        huella, futuro = en_curso
+        if huella != request_hash:
+            raise _key_reused()
+        try:
+            guardada = await asyncio.wait_for(asyncio.shield(futuro), IDEMPOTENCY_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise _in_progress()
+        if guardada is not None:
+            return guardada.replay(request_hash, "inflight")
+        # La primera no consumió la clave (error o nada que confirmar): se ejecuta esta
+
+    futuro = asyncio.get_running_loop().create_future()
+    _in_flight[ident] = (request_hash, futuro)
+    guardada = None
+    try:
+        guardada = await _wait_stored(owner_id, key)
+        if guardada is not None:
+            _cache(ident, guardada)
+            return guardada.replay(request_hash, "database")
+
+        pendiente = _Pending(owner_id, key, request_hash)
+        token = _pending.set(pendiente)
+        try:
+            response = await handler(request)
+        except IntegrityError:
+            # Otro worker ha confirmado la misma clave antes: se devuelve su respuesta
+            _pending.reset(token)
+            token = None
+            guardada = await _wait_stored(owner_id, key)
+            if guardada is None:
+                raise
+            _cache(ident, guardada)
+            return guardada.replay(request_hash, "database")
+        finally:
+            if token is not None:
+                _pending.reset(token)
+
+        if not pendiente.recorded:
+            return response
+        guardada = StoredResponse(
+            request_hash, response.status_code, response.headers.get("content-type"), bytes(response.body),
+            _utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        )
+        _cache(ident, guardada)
+        try:
+            await _save(owner_id, key, guardada)
+        except Exception:
+            # La modificación ya está confirmada: se responde igualmente. Los
+            # reintentos en este worker usan la caché; en otros, reciben 409
+            logger.exception("Error guardando la respuesta de una Idempotency-Key", extra={"fields": {"owner_id": owner_id}})
+        return response
+    finally:
+        del _in_flight[ident]
+        futuro.set_result(guardada if guardada is not None and guardada.status_code is not None else None)
+
+
+class IdempotentRoute(instrumentation.TimedRoute):
+    """
+    TimedRoute que, en las rutas de IDEMPOTENT_ROUTES, atiende la cabecera
+    Idempotency-Key antes de ejecutar el endpoint (y sus dependencias).
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if not any((metodo, self.path) in IDEMPOTENT_ROUTES for metodo in self.methods or ()):
+            return handler
+
+        async def app(request: Request) -> Response:
+            key = request.headers.get(HEADER)
+            if key is None:
+                return await handler(request)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres",
+                )
+            owner_id = _owner_id(request)
+            if owner_id is None:
+                return await handler(request)
+            # Las respuestas repetidas no resuelven las dependencias de la ruta:
+            # la petición se cuenta aquí (y lleva sus cabeceras RateLimit-*)
+            await ratelimit.charge_user(request, owner_id)
+            return await _execute(handler, request, owner_id, key, await _request_hash(request))
+
+        return app
@@ -0,0 +1,137 @@
+# app/importer.py
+# Lectura incremental de ficheros de importación de tareas (NDJSON o CSV).
+# El cuerpo de la petición se procesa trozo a trozo: nunca se carga entero en
+# memoria, así que el consumo no depende del tamaño del fichero.
+
+import codecs
+import csv
+import json
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from . import schemas
+
+load_dotenv()
+
+# Filas insertadas por lote (un executemany + commit por lote)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Máximo de errores por línea que se devuelven en el informe
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+# Tamaño máximo de un registro (caracteres); acota la memoria por línea
+IMPORT_MAX_RECORD_LENGTH = int(os.getenv("IMPORT_MAX_RECORD_LENGTH", str(64 * 1024)))
+
+_VALORES_TRUE = {"1", "true", "t", "yes", "y", "si", "sí"}
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Convierte un flujo de bytes UTF-8 en líneas de texto (sin el salto de línea)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pendiente = ""
+    async for chunk in chunks:
+        pendiente += decoder.decode(chunk)
+        *lineas, pendiente = pendiente.split("\n")
+        for linea in lineas:
+            yield linea.rstrip("\r")
+        if len(pendiente) > IMPORT_MAX_RECORD_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Línea demasiado larga (máximo {IMPORT_MAX_RECORD_LENGTH} caracteres)",
+            )
+    pendiente += decoder.decode(b"", final=True)
+    if pendiente:
+        yield pendiente.rstrip("\r")
+
+
+async def _iter_csv_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Agrupa líneas en registros CSV completos. Un campo entre comillas puede
+    contener saltos de línea: el registro termina cuando el número de comillas
+    acumuladas es par. Devuelve (número de la primera línea, registro).
+    """
+    numero = 0
+    registro, inicio, comillas = [], 0, 0
+    async for linea in lines:
+        numero += 1
+        if not registro:
+            inicio = numero
+        registro.append(linea)
+        comillas += linea.count('"')
+        if comillas % 2 == 0:
+            yield inicio, "\n".join(registro)
+            registro, comillas = [], 0
+        elif sum(len(parte) for parte in registro) > IMPORT_MAX_RECORD_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Registro CSV demasiado largo en la línea {inicio}",
+            )
+    if registro:
+        yield inicio, "\n".join(registro)
+
+
+def _parse_bool(valor) -> bool:
+    if isinstance(valor, bool):
+        return valor
+    if valor is None:
+        return False
+    return str(valor).strip().lower() in _VALORES_TRUE
+
+
+def _to_row(data) -> dict:
+    """Valida un registro contra schemas.TaskCreate y devuelve la fila a insertar."""
+    if not isinstance(data, dict):
+        raise ValueError("se esperaba un objeto con title y description")
+    task = schemas.TaskCreate.model_validate(data)
+    return {
+        "title": task.title,
+        "description": task.description,
+        "completed": _parse_bool(data.get("completed")),
+    }
+
+
+async def iter_rows(
+    chunks: AsyncIterator[bytes], import_format: schemas.ExportFormat
+) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Recorre el fichero y devuelve (línea, fila, None) para cada registro válido
+    o (línea, None, mensaje) para cada registro con errores.
+    Columnas/campos admitidos: title (obligatorio), description, completed.
+    """
+    lines = iter_lines(chunks)
+    if import_format == schemas.ExportFormat.csv:
+        cabecera = None
+        async for numero, registro in _iter_csv_records(lines):
+            if not registro.strip():
+                continue
+            valores = next(csv.reader([registro]))
+            if cabecera is None:
+                cabecera = [columna.strip() for columna in valores]
+                continue
+            if len(valores) != len(cabecera):
+                yield numero, None, f"se esperaban {len(cabecera)} columnas y hay {len(valores)}"
+                continue
+            data = {k: (v if v != "" else None) for k, v in zip(cabecera, valores)}
+            try:
+                yield numero, _to_row(data), None
+            except ValueError as e:
+                yield numero, None, _mensaje_error(e)
+    else:
+        numero = 0
+        async for linea in lines:
+            numero += 1
+            if not linea.strip():
+                continue
+            try:
+                yield numero, _to_row(json.loads(linea)), None
+            except ValueError as e:
+                yield numero, None, _mensaje_error(e)
+
+
+def _mensaje_error(error: ValueError) -> str:
+    """Mensaje legible de un error de JSON o de validación de Pydantic."""
+    errores = getattr(error, "errors", None)
+    if callable(errores):
+        return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in errores())
+    return str(error)
@@ -0,0 +1,234 @@
+# app/instrumentation.py
+# Medición por petición: latencia total, número de sentencias SQL, tiempo en la
+# base de datos y tiempo de serialización de la respuesta.
+#
+# - RequestTimingMiddleware (ASGI puro) crea un RequestStats por petición y lo
+#   guarda en un contextvar. Añade la cabecera Server-Timing y alimenta los
+#   histogramas de /metrics.
+# - instrument_engine() engancha before/after_cursor_execute a un engine: cada
+#   sentencia suma su duración al RequestStats de la petición en curso (el
+#   contextvar se propaga al threadpool de las rutas síncronas y a los greenlets
+#   de AsyncSession).
+# - TimedRoute marca cuándo termina el endpoint; desde ahí hasta que empieza la
+#   respuesta es serialización (validación con response_model + JSON).
+#
+# Sustituye a SQLALCHEMY_ECHO para depurar peticiones lentas en producción: solo
+# se registran las sentencias lentas y las peticiones con demasiadas sentencias
+# (patrón N+1), y una muestra del resto (LOG_SAMPLE_RATE).
+
+import functools
+import inspect
+import os
+import time
+from collections import Counter as _Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from . import logs, metrics
+
+load_dotenv()
+
+# Más sentencias que esto en una petición se considera un posible N+1
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "20"))
+# Sentencias más lentas que esto se registran siempre (ms)
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+# Peticiones más lentas que esto se registran siempre (ms)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Enviar la cabecera Server-Timing (desactivar si no se quiere exponer a clientes)
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "True").lower() in ("1", "true", "yes")
+
+logger = logs.get_logger(__name__)
+
+# --- Métricas ---
+request_duration = metrics.histogram(
+    "http_request_duration_seconds", "Duración total de las peticiones HTTP",
+)
+request_db_time = metrics.histogram(
+    "http_request_db_seconds", "Tiempo de cada petición dedicado a sentencias SQL",
+)
+request_serialization_time = metrics.histogram(
+    "http_request_serialization_seconds", "Tiempo de cada petición dedicado a serializar la respuesta",
+)
+request_queries = metrics.histogram(
+    "http_request_queries", "Sentencias SQL ejecutadas por petición",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+query_duration = metrics.histogram(
+    "db_query_duration_seconds", "Duración de las sentencias SQL",
+)
+n_plus_one = metrics.counter(
+    "http_requests_n_plus_one_total", "Peticiones que superan SQL_N_PLUS_ONE_THRESHOLD sentencias",
+)
+
+
+class RequestStats:
+    """Acumuladores de una petición."""
+
+    __slots__ = ("start", "queries", "db_seconds", "endpoint_end", "response_start", "statements")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.endpoint_end: Optional[float] = None
+        self.response_start: Optional[float] = None
+        # Veces que se repite cada sentencia (sin parámetros): identifica el N+1
+        self.statements: _Counter = _Counter()
+
+    @property
+    def serialization_seconds(self) -> float:
+        if self.endpoint_end is None or self.response_start is None:
+            return 0.0
+        return max(self.response_start - self.endpoint_end, 0.0)
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """RequestStats de la petición en curso (None fuera de una petición)."""
+    return _current.get()
+
+
+# --- Sentencias SQL ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("query_start")
+    if not inicios:
+        return
+    duracion = time.perf_counter() - inicios.pop()
+    query_duration.observe(duracion)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += duracion
+        stats.statements[statement] += 1
+    if duracion * 1000 >= SQL_SLOW_QUERY_MS:
+        logger.warning("Sentencia SQL lenta", extra={"fields": {
+            "duration_ms": round(duracion * 1000, 2),
+            "statement": " ".join(statement.split())[:500],
+            "executemany": executemany,
+        }})
+
+
+def instrument_engine(engine) -> None:
+    """Mide las sentencias de un engine síncrono (para AsyncEngine: su .sync_engine)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Endpoint / serialización ---
+def _timed_endpoint(endpoint):
+    """Envuelve el endpoint para anotar cuándo termina (conserva la firma para FastAPI)."""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def envoltorio(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_end()
+    else:
+        @functools.wraps(endpoint)
+        def envoltorio(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_end()
+    return envoltorio
+
+
+def _mark_endpoint_end() -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.endpoint_end = time.perf_counter()
+
+
+class TimedRoute(APIRoute):
+    """Ruta que permite separar el tiempo del endpoint del de serialización."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+# --- Middleware ---
+def _server_timing(stats: RequestStats, total: float) -> bytes:
+    partes = [
+        f"db;dur={stats.db_seconds * 1000:.2f};desc=\"{stats.queries} queries\"",
+        f"ser;dur={stats.serialization_seconds * 1000:.2f}",
+        f"total;dur={total * 1000:.2f}",
+    ]
+    return ", ".join(partes).encode("latin-1")
+
+
+class RequestTimingMiddleware:
+    """Middleware ASGI puro (sin BaseHTTPMiddleware: no copia ni bufferiza el cuerpo)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        estado = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                stats.response_start = time.perf_counter()
+                estado["status"] = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    cabeceras = list(message.get("headers", []))
+                    cabeceras.append((b"server-timing", _server_timing(stats, stats.response_start - stats.start)))
+                    message = {**message, "headers": cabeceras}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self._record(scope, stats, estado["status"])
+
+    @staticmethod
+    def _record(scope, stats: RequestStats, status_code: int) -> None:
+        total = time.perf_counter() - stats.start
+        # Plantilla de la ruta (/tasks/{task_id}), no la URL: cardinalidad acotada
+        ruta = getattr(scope.get("route"), "path", None) or "unmatched"
+        request_duration.observe(total, {"method": scope["method"], "route": ruta, "status": str(status_code)})
+        etiquetas = {"method": scope["method"], "route": ruta}
+        request_db_time.observe(stats.db_seconds, etiquetas)
+        request_queries.observe(stats.queries, etiquetas)
+        if stats.endpoint_end is not None:
+            request_serialization_time.observe(stats.serialization_seconds, etiquetas)
+
+        campos = {
+            "method": scope["method"],
+            "route": ruta,
+            "status": status_code,
+            "duration_ms": round(total * 1000, 2),
+            "queries": stats.queries,
+            "db_ms": round(stats.db_seconds * 1000, 2),
+            "serialization_ms": round(stats.serialization_seconds * 1000, 2),
+        }
+        if stats.queries > SQL_N_PLUS_ONE_THRESHOLD:
+            n_plus_one.inc(labels=etiquetas)
+            sentencia, repeticiones = stats.statements.most_common(1)[0]
+            logger.warning("Posible N+1: demasiadas sentencias SQL en una petición", extra={"fields": {
+                **campos,
+                "threshold": SQL_N_PLUS_ONE_THRESHOLD,
+                "top_statement": " ".join(sentencia.split())[:500],
+                "top_statement_count": repeticiones,
+            }})
+        elif total * 1000 >= SLOW_REQUEST_MS:
+            logger.warning("Petición lenta", extra={"fields": campos})
+        else:
+            logs.sampled(logger, "Petición", **campos)
@@ -0,0 +1,121 @@
+# app/logs.py
+# Logging estructurado y con muestreo para la aplicación.
+#
+# - Los mensajes se escriben desde un hilo aparte (QueueHandler + QueueListener):
+#   una petición nunca se bloquea escribiendo en stdout, a diferencia de print().
+# - Formato JSON (una línea por mensaje, fácil de indexar) o texto con clave=valor.
+# - sampled() registra solo una fracción (LOG_SAMPLE_RATE) de los mensajes
+#   informativos de alto volumen; los warnings y errores se registran siempre.
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" o "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Fracción de los mensajes de sampled() que se registran (1 = todos, 0 = ninguno)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Logger raíz de la aplicación: app.routers.tasks, app.instrumentation, ... cuelgan de él
+ROOT_LOGGER = "app"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """Añade al mensaje los campos pasados en extra={"fields": {...}}."""
+
+    def __init__(self, fmt: str = LOG_FORMAT):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        campos = getattr(record, "fields", None) or {}
+        if self.fmt == "json":
+            entrada = {
+                "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+                **campos,
+            }
+            if record.exc_info:
+                entrada["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entrada, ensure_ascii=False, default=str)
+        linea = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        if campos:
+            linea += " " + " ".join(f"{k}={v}" for k, v in campos.items())
+        if record.exc_info:
+            linea += "\n" + self.formatException(record.exc_info)
+        return linea
+
+
+def setup_logging() -> None:
+    """Configura el logger "app" (una sola vez por proceso)."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(StructuredFormatter())
+    cola: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(LOG_LEVEL)
+    _queue_handler = logging.handlers.QueueHandler(cola)
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+
+
+def _restart_after_fork() -> None:
+    """
+    En el proceso hijo de un fork el hilo que escribe los mensajes no existe:
+    se arranca otro, con una cola nueva (la heredada puede quedar bloqueada).
+    """
+    global _listener
+    if _listener is None:
+        return
+    cola: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _queue_handler.queue = cola
+    _listener = logging.handlers.QueueListener(cola, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown_logging() -> None:
+    """Vacía la cola de mensajes pendientes (al apagar la aplicación)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger hijo de "app" (acepta __name__, ej. "app.routers.tasks")."""
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + "."):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+
+def sampled(logger: logging.Logger, msg: str, **fields) -> None:
+    """Mensaje informativo de alto volumen (uno por petición): solo se registra una fracción."""
+    if LOG_SAMPLE_RATE <= 0 or not logger.isEnabledFor(logging.INFO):
+        return
+    if LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE:
+        logger.info(msg, extra={"fields": fields})
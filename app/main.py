@@ -1,19 +1,73 @@
 # app/main.py
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 # Importa ambos routers
-from .routers import tasks, auth # ¡Ahora importa 'auth' también!
+from .routers import tasks, auth, metrics # ¡Ahora importa 'auth' también!
+from . import database, events, hashing, instrumentation, logs, ratelimit, replicas, security
+
+# Logging estructurado (sustituye a los print() de las rutas)
+logs.setup_logging()
+
+# Sin SECRET_KEY (o JWT_KEYS) la API no arranca: no hay clave por defecto
+security.check_signing_keys()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Comprobaciones periódicas de salud de las réplicas de lectura (si las hay)
+    database.start_replica_health_checks()
+    # Mapa de usuarios movidos de shard (solo con DATABASE_SHARD_URLS)
+    database.start_shard_map_refresh()
+    # Usuarios desactivados en cualquier worker (tabla token_revocations)
+    database.start_revocation_refresh()
+    yield
+    # Al apagar: cierra los flujos de eventos abiertos y detiene el pool de
+    # procesos de hashing de contraseñas
+    events.broker.close()
+    database.stop_replica_health_checks()
+    database.stop_shard_map_refresh()
+    database.stop_revocation_refresh()
+    hashing.shutdown()
+    logs.shutdown_logging()
 
 # Crea la instancia de la aplicación FastAPI
 app = FastAPI(
+    lifespan=lifespan,
     title="API de Tareas con Autenticación (FastAPI)",
     description="Una API simple para gestionar tareas con operaciones CRUD y autenticación JWT.",
     version="0.1.0",
 )
 
+# Latencia, sentencias SQL y serialización por petición: cabecera Server-Timing
+# y métricas http_request_* en /metrics
+app.add_middleware(instrumentation.RequestTimingMiddleware)
+
+# Cabeceras RateLimit-* en todas las respuestas de las rutas limitadas,
+# también en las que la ruta crea directamente (304, streaming, repeticiones)
+app.add_middleware(ratelimit.RateLimitHeadersMiddleware)
+
+# Lectura tras escritura con réplicas: la marca para leer del primario viaja en
+# una cookie, así cualquier worker la respeta
+if replicas.DATABASE_REPLICA_URLS:
+    app.add_middleware(replicas.ReadAfterWriteMiddleware)
+
+# En modo asíncrono (DATABASE_URL con driver async) las rutas principales de
+# tareas se sirven con AsyncSession y sustituyen a sus equivalentes síncronas.
+# La sustitución se hace en el mismo sitio para conservar el orden de las rutas
+# (las rutas fijas como /tasks/bulk deben seguir antes que /tasks/{task_id}).
+if database.IS_ASYNC:
+    from .routers import tasks_async # Requiere sqlalchemy[asyncio]
+    rutas_async = {(r.path, frozenset(r.methods)): r for r in tasks_async.router.routes}
+    tasks.router.routes = [
+        rutas_async.get((r.path, frozenset(getattr(r, "methods", None) or ())), r)
+        for r in tasks.router.routes
+    ]
+
 # Incluye ambos routers en la aplicación principal
 app.include_router(tasks.router)
 app.include_router(auth.router) # ¡Nuevo! Incluye el router de autenticación
+app.include_router(metrics.router)
 
 # Endpoint raíz (opcional, puedes mantenerlo o eliminarlo)
 @app.get("/")
@@ -0,0 +1,144 @@
+# app/metrics.py
+# Registro mínimo de métricas en formato de exposición de Prometheus (texto).
+# Sin dependencias externas: contadores, histogramas y gauges calculados al
+# vuelo en cada lectura de /metrics.
+
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Buckets por defecto (segundos), pensados para latencias de peticiones y consultas
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = list(labels) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    cuerpo = ",".join(f'{k}="{v}"' for k, v in pares)
+    return "{" + cuerpo + "}"
+
+
+def _key(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+class Counter:
+    """Contador monótono, opcionalmente con etiquetas."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histograma acumulativo con buckets fijos, opcionalmente con etiquetas."""
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _key(labels)
+        with self._lock:
+            serie = self._series.get(key)
+            if serie is None:
+                # [cuentas por bucket..., suma, total]
+                serie = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if value <= limite:
+                    serie[i] += 1
+            serie[-2] += value
+            serie[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, serie in sorted(self._series.items()):
+                for i, limite in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, ('le', repr(limite)))} {serie[i]}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels, ('le', '+Inf'))} {serie[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {serie[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {serie[-1]}")
+        return lines
+
+
+class GaugeFunc:
+    """
+    Gauge cuyo valor se calcula al leer /metrics.
+    `func` devuelve una lista de (etiquetas, valor).
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, func: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.func():
+            lines.append(f"{self.name}{_format_labels(_key(labels))} {value}")
+        return lines
+
+
+class CounterFunc(GaugeFunc):
+    """
+    Contador monótono que lleva otro objeto (ej. los aciertos de una caché),
+    leído al servir /metrics. Se expone como counter para que rate() funcione.
+    """
+
+    type = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str) -> Counter:
+    return REGISTRY.register(Counter(name, help))
+
+
+def histogram(name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, buckets))
+
+
+def gauge_func(name: str, help: str, func) -> GaugeFunc:
+    return REGISTRY.register(GaugeFunc(name, help, func))
+
+
+def counter_func(name: str, help: str, func) -> CounterFunc:
+    return REGISTRY.register(CounterFunc(name, help, func))
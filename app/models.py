@@ -1,6 +1,6 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey # Asegúrate de importar ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, LargeBinary # Asegúrate de importar ForeignKey
 from sqlalchemy.orm import relationship # Asegúrate de importar relationship
 
 from .database import Base
@@ -9,7 +9,7 @@ from .database import Base
 class Task(Base):
     __tablename__ = "tasks"
     id = Column(Integer, primary_key=True, index=True)
-    title = Column(String(255), index=True)
+    title = Column(String(255))
     description = Column(String(1000), nullable=True)
     completed = Column(Boolean, default=False)
     # --- NUEVO: Columna para la clave foránea ---
@@ -19,6 +19,17 @@ class Task(Base):
     # Esto permite acceder al usuario asociado a una tarea (ej. task.owner)
     owner = relationship("User", back_populates="tasks")
 
+    # Índice compuesto (owner_id, id): sirve tanto para filtrar por propietario
+    # como para la paginación por cursor (WHERE owner_id = ? AND id > ? ORDER BY id)
+    # (owner_id, completed, id): mismo patrón filtrando además por estado.
+    # FULLTEXT (title, description): búsqueda de texto en MySQL (en otros motores
+    # se crea como índice normal).
+    __table_args__ = (
+        Index("ix_tasks_owner_id_id", "owner_id", "id"),
+        Index("ix_tasks_owner_id_completed_id", "owner_id", "completed", "id"),
+        Index("ix_tasks_title_description_ft", "title", "description", mysql_prefix="FULLTEXT"),
+    )
+
     def __repr__(self):
         return f"<Task(id={self.id}, title='{self.title}', completed={self.completed})>"
 
@@ -30,10 +41,82 @@ class User(Base):
     username = Column(String(50), unique=True, index=True)
     hashed_password = Column(String(255))
     is_active = Column(Boolean, default=True)
+    # Versión de las tareas del usuario: se incrementa con cada cambio en ellas
+    # y alimenta los ETag de GET /tasks/ y GET /tasks/{task_id}
+    tasks_version = Column(Integer, default=0, server_default="0", nullable=False)
+    # Contadores de tareas (total y completadas), actualizados en el mismo
+    # UPDATE que tasks_version; alimentan GET /tasks/stats sin COUNT(*)
+    tasks_total = Column(Integer, default=0, server_default="0", nullable=False)
+    tasks_completed = Column(Integer, default=0, server_default="0", nullable=False)
 
     # --- NUEVO: Relación ORM ---
     # Esto permite acceder a las tareas de un usuario (ej. user.tasks)
     tasks = relationship("Task", back_populates="owner")
 
     def __repr__(self):
-        return f"<User(id={self.id}, username='{self.username}', is_active={self.is_active})>"
\ No newline at end of file
+        return f"<User(id={self.id}, username='{self.username}', is_active={self.is_active})>"
+
+# --- Claves de idempotencia (ver app/idempotency.py) ---
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(255), nullable=False)
+    # SHA-256 del método, la ruta y el cuerpo: la misma clave con otra petición se rechaza
+    request_hash = Column(String(64), nullable=False)
+    # Respuesta guardada. NULL mientras la petición que la usó no ha terminado
+    # (la fila se inserta en la misma transacción que la modificación)
+    status_code = Column(Integer, nullable=True)
+    media_type = Column(String(100), nullable=True)
+    response_body = Column(LargeBinary(length=2**24), nullable=True) # MEDIUMBLOB en MySQL
+    created_at = Column(DateTime, nullable=False)
+
+    # (owner_id, key) único: es la búsqueda de cada petición con clave y lo que
+    # impide que dos workers confirmen la misma clave. created_at: purga.
+    __table_args__ = (
+        Index("ix_idempotency_keys_owner_id_key", "owner_id", "key", unique=True),
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey(owner_id={self.owner_id}, key='{self.key}', status_code={self.status_code})>"
+
+# --- Tokens revocados (ver security.RevocationList) ---
+# Solo se usa en el shard 0. Un usuario desactivado tiene aquí el instante de
+# la desactivación: sus tokens emitidos antes se rechazan en todos los workers.
+class TokenRevocation(Base):
+    __tablename__ = "token_revocations"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    revoked_at = Column(DateTime, nullable=False, index=True) # UTC
+
+    def __repr__(self):
+        return f"<TokenRevocation(user_id={self.user_id}, revoked_at={self.revoked_at})>"
+
+
+# --- Secuencias de IDs compartidas por los shards (ver sharding.IdAllocator) ---
+# Solo se usa en el shard 0. next_id es el primer ID aún sin reservar.
+class IdSequence(Base):
+    __tablename__ = "id_sequences"
+
+    name = Column(String(50), primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<IdSequence(name='{self.name}', next_id={self.next_id})>"
+
+
+# --- Usuarios movidos de shard (ver app/sharding.py) ---
+# Solo se usa en el shard 0 (DATABASE_URL). Los usuarios que no aparecen aquí
+# están en el shard que indica la estrategia (SHARD_STRATEGY).
+class UserShard(Base):
+    __tablename__ = "user_shards"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard = Column(Integer, nullable=False)
+    # True mientras rebalance_shards.py copia sus tareas: sus peticiones reciben 503
+    moving = Column(Boolean, default=False, nullable=False)
+
+    def __repr__(self):
+        return f"<UserShard(owner_id={self.owner_id}, shard={self.shard}, moving={self.moving})>"
@@ -0,0 +1,48 @@
+# app/pagination.py
+
+import base64
+import json
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+# --- Paginación por cursor (keyset) ---
+# El cursor es opaco para el cliente: internamente es el último id devuelto,
+# codificado en base64 para que nadie dependa de su formato.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Codifica el id de la última fila de la página como cursor opaco."""
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Decodifica un cursor opaco y devuelve el id a partir del cual continuar.
+    Lanza HTTPException 400 si el cursor no es válido.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = data["id"]
+        if not isinstance(last_id, int):
+            raise ValueError("id no entero")
+        return last_id
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido",
+        )
+
+
+def next_cursor(items: list, limit: int) -> Optional[str]:
+    """
+    Devuelve el cursor de la página siguiente, o None si esta es la última.
+    Solo hay página siguiente si la actual se llenó por completo.
+    """
+    if limit <= 0 or len(items) < limit:
+        return None
+    return encode_cursor(items[-1].id)
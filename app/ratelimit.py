@@ -0,0 +1,344 @@
+# app/ratelimit.py
+# Limitación de peticiones con token buckets.
+#
+# - Rutas de tareas: un bucket por usuario (id de get_current_user).
+# - Rutas /auth/*: un bucket por IP del cliente (aún no hay usuario).
+# - Opcionalmente, un bucket global por ruta compartido por todos los clientes
+#   (ej. para que POST /auth/token no sature el pool de bcrypt).
+#
+# Cada bucket es O(1): (tokens, instante de la última recarga). Se guardan en
+# un almacén acotado en memoria con desalojo LRU, o en Redis si se define
+# RATE_LIMIT_REDIS_URL (límites compartidos entre workers). Las respuestas
+# llevan las cabeceras RateLimit-* y, al rechazar (429), Retry-After. Las
+# añade RateLimitHeadersMiddleware, así que también las llevan las respuestas
+# que la ruta crea directamente: 304 (ETag), streaming (exportación, SSE) y
+# respuestas repetidas de Idempotency-Key (ver app/idempotency.py).
+#
+# Formato de los límites: "N/periodo", con periodo second, minute, hour, day o
+# un número de segundos ("100/minute", "5/second", "20/30").
+
+import abc
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request, Response, status
+
+from . import metrics, schemas
+from .dependencies import get_current_user
+
+load_dotenv()
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True)
+class Limit:
+    """`capacity` peticiones por `period` segundos (ráfaga máxima = capacity)."""
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        """Tokens que se recuperan por segundo."""
+        return self.capacity / self.period
+
+    @property
+    def policy(self) -> str:
+        """Valor de la cabecera RateLimit-Policy (ej. "100;w=60")."""
+        return f"{self.capacity};w={math.ceil(self.period)}"
+
+    @classmethod
+    def parse(cls, texto: str) -> "Limit":
+        cantidad, sep, periodo = texto.strip().partition("/")
+        if not sep:
+            raise ValueError(f"Límite inválido: {texto!r} (formato N/periodo)")
+        periodo = periodo.strip()
+        segundos = PERIODS.get(periodo) or PERIODS.get(periodo.rstrip("s"))
+        if segundos is None:
+            segundos = float(periodo)
+        limite = cls(int(cantidad), float(segundos))
+        if limite.capacity <= 0 or limite.period <= 0:
+            raise ValueError(f"Límite inválido: {texto!r}")
+        return limite
+
+
+def _parse_routes(valor: Optional[str]) -> Dict[str, Limit]:
+    """'POST /auth/token=10/minute,GET /tasks/=300/minute' -> {"POST /auth/token": Limit, ...}"""
+    rutas = {}
+    for entrada in (valor or "").split(","):
+        if not entrada.strip():
+            continue
+        ruta, sep, limite = entrada.rpartition("=")
+        if not sep:
+            raise ValueError(f"Entrada inválida en RATE_LIMIT_ROUTES: {entrada!r}")
+        rutas[" ".join(ruta.split())] = Limit.parse(limite)
+    return rutas
+
+
+# --- Configuración ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() in ("1", "true", "yes")
+# Límite por usuario de las rutas de tareas
+RATE_LIMIT_USER = Limit.parse(os.getenv("RATE_LIMIT_USER", "600/minute"))
+# Límite por IP de las rutas /auth/*
+RATE_LIMIT_IP = Limit.parse(os.getenv("RATE_LIMIT_IP", "60/minute"))
+# Límites por ruta ("MÉTODO /plantilla=N/periodo"), sustituyen a los anteriores
+RATE_LIMIT_ROUTES = _parse_routes(os.getenv("RATE_LIMIT_ROUTES", "POST /auth/token=10/minute,POST /auth/register=5/minute"))
+# Límites globales por ruta (todos los clientes juntos), además de los anteriores
+RATE_LIMIT_GLOBAL_ROUTES = _parse_routes(os.getenv("RATE_LIMIT_GLOBAL_ROUTES"))
+# Buckets guardados en memoria; se desalojan los menos usados
+RATE_LIMIT_MAXSIZE = int(os.getenv("RATE_LIMIT_MAXSIZE", "100000"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+
+rejections = metrics.counter("rate_limit_rejections_total", "Peticiones rechazadas con 429 por el rate limit")
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    limit: Limit
+    remaining: int
+    reset: int  # Segundos hasta que el bucket vuelve a estar lleno
+    retry_after: int  # Segundos hasta que hay un token (solo si no se permite)
+
+
+def _decision(allowed: bool, tokens: float, limit: Limit, cost: float) -> Decision:
+    return Decision(
+        allowed=allowed,
+        limit=limit,
+        remaining=max(int(tokens), 0),
+        reset=math.ceil((limit.capacity - tokens) / limit.rate),
+        retry_after=0 if allowed else max(math.ceil((cost - tokens) / limit.rate), 1),
+    )
+
+
+# --- Almacenes ---
+class RateLimitStore(abc.ABC):
+    """
+    Interfaz de los almacenes de buckets. hit() consume `cost` tokens del
+    bucket `key` si hay suficientes (operación atómica) y devuelve la decisión.
+    """
+
+    @abc.abstractmethod
+    async def hit(self, key: str, limit: Limit, cost: float = 1) -> Decision:
+        ...
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """
+    Buckets en memoria del proceso, como mucho `maxsize` (desalojo LRU: un
+    bucket desalojado vuelve a empezar lleno, y los desalojados son los inactivos).
+    """
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAXSIZE):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def hit(self, key: str, limit: Limit, cost: float = 1) -> Decision:
+        return self.hit_sync(key, limit, cost)
+
+    def hit_sync(self, key: str, limit: Limit, cost: float = 1) -> Decision:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(limit.capacity), now]
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+                bucket[1] = now
+            allowed = bucket[0] >= cost
+            if allowed:
+                bucket[0] -= cost
+            tokens = bucket[0]
+        return _decision(allowed, tokens, limit, cost)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# Recarga y consumo atómicos en Redis. Usa la hora del servidor de Redis para
+# que todos los workers compartan el mismo reloj. Devuelve los tokens como
+# texto porque Lua trunca los números a enteros al devolverlos.
+_REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """Buckets compartidos entre workers en Redis (requiere `pip install redis`)."""
+
+    def __init__(self, url: str):
+        import redis.asyncio  # Dependencia opcional
+
+        self._client = redis.asyncio.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET)
+
+    async def hit(self, key: str, limit: Limit, cost: float = 1) -> Decision:
+        allowed, tokens = await self._script(
+            keys=[f"ratelimit:{key}"], args=[limit.capacity, limit.rate, cost]
+        )
+        return _decision(bool(allowed), float(tokens), limit, cost)
+
+
+def _create_store() -> RateLimitStore:
+    if RATE_LIMIT_REDIS_URL:
+        return RedisRateLimitStore(RATE_LIMIT_REDIS_URL)
+    return InMemoryRateLimitStore()
+
+
+store: RateLimitStore = _create_store()
+
+
+# --- Cabeceras RateLimit-* de la respuesta ---
+class _RequestLimit:
+    """Decisión del rate limit de la petición en curso (la rellena _check)."""
+
+    def __init__(self):
+        self.decision: Optional[Decision] = None
+
+
+_request_limit: ContextVar[Optional[_RequestLimit]] = ContextVar("request_limit", default=None)
+
+
+def _headers(decision: Decision) -> Dict[str, str]:
+    return {
+        "RateLimit-Limit": str(decision.limit.capacity),
+        "RateLimit-Remaining": str(decision.remaining),
+        "RateLimit-Reset": str(decision.reset),
+        "RateLimit-Policy": decision.limit.policy,
+    }
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Middleware ASGI puro: añade las cabeceras RateLimit-* de la decisión de la
+    petición a su respuesta, sea cual sea la Response que devuelva la ruta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        marca = _RequestLimit()
+        token = _request_limit.set(marca)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and marca.decision is not None:
+                presentes = {nombre.lower() for nombre, _ in message.get("headers", [])}
+                nuevas = [
+                    (nombre.lower().encode("latin-1"), valor.encode("latin-1"))
+                    for nombre, valor in _headers(marca.decision).items()
+                    if nombre.lower().encode("latin-1") not in presentes
+                ]
+                message = {**message, "headers": [*message.get("headers", []), *nuevas]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_limit.reset(token)
+
+
+# --- Dependencias ---
+def _route_name(request: Request) -> str:
+    """'MÉTODO /plantilla' de la ruta (ej. "PUT /tasks/{task_id}")."""
+    ruta = request.scope.get("route")
+    return f"{request.method} {getattr(ruta, 'path', request.url.path)}"
+
+
+def _set_headers(response: Response, decision: Decision) -> None:
+    marca = _request_limit.get()
+    if marca is not None:
+        # Las añade RateLimitHeadersMiddleware a la respuesta que se envíe
+        marca.decision = decision
+    else:
+        response.headers.update(_headers(decision))
+
+
+def _reject(decision: Decision, ruta: str, ambito: str) -> HTTPException:
+    rejections.inc(labels={"route": ruta, "scope": ambito})
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Demasiadas peticiones, inténtalo más tarde",
+        headers={"Retry-After": str(decision.retry_after), **_headers(decision)},
+    )
+
+
+async def _check(request: Request, response: Response, cliente: str, limite_por_defecto: Limit) -> None:
+    marca = _request_limit.get()
+    if marca is not None and marca.decision is not None:
+        # Ya se ha contado esta petición (ver charge_user)
+        return
+    ruta = _route_name(request)
+    limite_global = RATE_LIMIT_GLOBAL_ROUTES.get(ruta)
+    if limite_global is not None:
+        decision = await store.hit(f"global:{ruta}", limite_global)
+        if not decision.allowed:
+            raise _reject(decision, ruta, "global")
+    limite = RATE_LIMIT_ROUTES.get(ruta, limite_por_defecto)
+    # Las rutas con límite propio tienen su bucket; el resto comparten el del cliente
+    clave = f"{cliente}:{ruta}" if ruta in RATE_LIMIT_ROUTES else cliente
+    decision = await store.hit(clave, limite)
+    if not decision.allowed:
+        raise _reject(decision, ruta, "client")
+    _set_headers(response, decision)
+
+
+async def limit_by_user(
+    request: Request,
+    response: Response,
+    current_user: schemas.UserPrincipal = Depends(get_current_user),
+) -> None:
+    """Dependencia de las rutas de tareas: límite por usuario autenticado."""
+    if RATE_LIMIT_ENABLED:
+        await _check(request, response, f"user:{current_user.id}", RATE_LIMIT_USER)
+
+
+async def charge_user(request: Request, user_id: int) -> None:
+    """
+    Cuenta la petición en el bucket del usuario antes de resolver las
+    dependencias: lo usa IdempotentRoute con las respuestas repetidas, que no
+    llegan a ejecutar la ruta. La dependencia limit_by_user ya no la cuenta otra vez.
+    """
+    if RATE_LIMIT_ENABLED:
+        await _check(request, Response(), f"user:{user_id}", RATE_LIMIT_USER)
+
+
+async def limit_by_ip(request: Request, response: Response) -> None:
+    """
+    Dependencia de las rutas /auth/*: límite por IP del cliente. Detrás de un
+    proxy, arrancar uvicorn con --proxy-headers para que la IP sea la del cliente.
+    """
+    if RATE_LIMIT_ENABLED:
+        ip = request.client.host if request.client else "unknown"
+        await _check(request, response, f"ip:{ip}", RATE_LIMIT_IP)
@@ -0,0 +1,227 @@
+# app/replicas.py
+# Enrutado de lecturas a réplicas de la base de datos.
+#
+# - ReplicaPool: réplicas en round robin. Un hilo comprueba periódicamente su
+#   salud (SELECT 1) y las que fallan dejan de usarse hasta que se recuperan;
+#   una desconexión durante una consulta también la marca como no disponible.
+# - RoutingSession: sesión que envía los SELECT a una réplica solo si se ha
+#   creado con info={"replica": True}; escrituras, flush y SELECT ... FOR UPDATE
+#   van siempre al primario (el bind de la sesión).
+# - Lectura tras escritura: cada cambio en las tareas de un usuario (ver
+#   crud.bump_tasks_version) lo fija al primario durante REPLICA_PIN_SECONDS,
+#   para que no lea de una réplica que aún no ha recibido su cambio. La marca
+#   viaja en la cookie REPLICA_PIN_COOKIE (instante hasta el que leer del
+#   primario), así vale en cualquier worker; ReadAfterWriteMiddleware la lee en
+#   cada petición y la envía en las respuestas que escriben. Cada proceso
+#   recuerda además a sus usuarios fijados, para los clientes sin cookies.
+#
+# Sin DATABASE_REPLICA_URLS no se crea nada de esto: todo va al primario.
+
+import itertools
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from starlette.requests import cookie_parser
+
+from . import logs
+from .cache import TTLCache
+
+load_dotenv()
+
+# URLs de las réplicas separadas por comas (mismo driver que DATABASE_URL)
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+# Segundos que un usuario lee del primario después de modificar sus tareas
+# (debe superar el retraso de replicación habitual)
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+# Cookie con el instante (epoch) hasta el que el cliente lee del primario
+REPLICA_PIN_COOKIE = os.getenv("REPLICA_PIN_COOKIE", "primary_until")
+# Segundos entre comprobaciones de salud de las réplicas
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "10"))
+
+logger = logs.get_logger(__name__)
+
+# Usuarios fijados al primario en este proceso (clientes que no devuelven la cookie)
+_pinned = TTLCache(maxsize=100000, ttl=REPLICA_PIN_SECONDS)
+
+
+class _RequestPin:
+    """Marca de la petición en curso: hasta cuándo leer del primario y si hay que renovarla."""
+
+    __slots__ = ("until", "written")
+
+    def __init__(self, until: float = 0.0):
+        self.until = until
+        self.written = False
+
+
+# El contextvar llega al threadpool de las rutas síncronas y a los greenlets de AsyncSession
+_request_pin: ContextVar[Optional[_RequestPin]] = ContextVar("replica_pin", default=None)
+
+
+def pin_to_primary(owner_id: int) -> None:
+    """Las lecturas del usuario irán al primario durante REPLICA_PIN_SECONDS."""
+    if DATABASE_REPLICA_URLS:
+        _pinned.set(owner_id, True)
+        marca = _request_pin.get()
+        if marca is not None:
+            marca.until = time.time() + REPLICA_PIN_SECONDS
+            marca.written = True
+
+def is_pinned(owner_id: int) -> bool:
+    if not DATABASE_REPLICA_URLS:
+        return False
+    marca = _request_pin.get()
+    return (marca is not None and marca.until > time.time()) or _pinned.get(owner_id) is not None
+
+
+def _cookie_until(scope) -> float:
+    """Instante de la cookie de la petición, acotado a REPLICA_PIN_SECONDS desde ahora."""
+    for nombre, valor in scope.get("headers", ()):
+        if nombre == b"cookie":
+            try:
+                until = float(cookie_parser(valor.decode("latin-1")).get(REPLICA_PIN_COOKIE, ""))
+            except ValueError:
+                return 0.0
+            # El cliente controla la cookie: no puede fijarse al primario indefinidamente
+            return min(until, time.time() + REPLICA_PIN_SECONDS)
+    return 0.0
+
+
+class ReadAfterWriteMiddleware:
+    """
+    Middleware ASGI puro: lee la cookie REPLICA_PIN_COOKIE y, si la petición ha
+    modificado tareas, la devuelve renovada en la respuesta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        marca = _RequestPin(_cookie_until(scope))
+        token = _request_pin.set(marca)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and marca.written:
+                cookie = (
+                    f"{REPLICA_PIN_COOKIE}={marca.until:.3f}; Max-Age={math.ceil(REPLICA_PIN_SECONDS)}; "
+                    "Path=/; HttpOnly; SameSite=Lax"
+                )
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_pin.reset(token)
+
+
+class ReplicaPool:
+    """
+    Réplicas disponibles en round robin.
+    `engines` son los engines con los que se consulta; `check_engines`, los
+    síncronos con los que se comprueba la salud (los mismos en modo síncrono).
+    """
+
+    def __init__(self, engines: list, check_engines: Optional[list] = None, names: Optional[List[str]] = None):
+        self.engines = list(engines)
+        self.check_engines = list(check_engines or engines)
+        self.names = names or [f"replica{i}" for i in range(len(self.engines))]
+        self._healthy = [True] * len(self.engines)
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        for i, eng in enumerate(self.engines):
+            event.listen(eng, "handle_error", self._on_error(i))
+
+    def _on_error(self, indice: int):
+        def handle_error(context):
+            # Conexión perdida durante una consulta: se deja de usar hasta la próxima comprobación
+            if context.is_disconnect:
+                self._set_health(indice, False)
+        return handle_error
+
+    def _set_health(self, indice: int, sano: bool) -> None:
+        with self._lock:
+            cambio = self._healthy[indice] != sano
+            self._healthy[indice] = sano
+        if cambio:
+            if sano:
+                logger.info("Réplica disponible de nuevo", extra={"fields": {"replica": self.names[indice]}})
+            else:
+                logger.warning("Réplica no disponible, las lecturas van al primario", extra={"fields": {"replica": self.names[indice]}})
+
+    def choose(self):
+        """Siguiente réplica sana en round robin, o None si no hay ninguna."""
+        with self._lock:
+            sanas = [eng for eng, sano in zip(self.engines, self._healthy) if sano]
+        if not sanas:
+            return None
+        return sanas[next(self._rr) % len(sanas)]
+
+    def check(self) -> None:
+        """Comprueba todas las réplicas con SELECT 1."""
+        for i, eng in enumerate(self.check_engines):
+            try:
+                with eng.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                self._set_health(i, True)
+            except Exception:
+                self._set_health(i, False)
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(zip(self.names, self._healthy))
+
+    def start(self, interval: float = REPLICA_HEALTH_INTERVAL) -> None:
+        """Arranca el hilo de comprobaciones de salud (una vez por proceso)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def bucle():
+            while not self._stop.wait(interval):
+                self.check()
+
+        self._thread = threading.Thread(target=bucle, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class RoutingSession(Session):
+    """
+    Sesión que lee de una réplica cuando se crea con info={"replica": True}.
+    La misma sesión usa siempre la misma réplica (lecturas coherentes entre sí).
+    Las subclases indican el ReplicaPool en `replicas`.
+    """
+
+    replicas: Optional[ReplicaPool] = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            self.replicas is not None
+            and self.info.get("replica")
+            and not self._flushing
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        ):
+            replica = self.info.get("replica_engine")
+            if replica is None:
+                replica = self.info["replica_engine"] = self.replicas.choose()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
@@ -1,19 +1,18 @@
 # app/routers/auth.py
 
-from datetime import timedelta
-
 from ..database import get_db
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm # Para el formulario de login (username y password)
 from sqlalchemy.orm import Session
 
-from .. import schemas, crud, database, security # Importa los nuevos módulos
-from ..security import create_access_token, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES
+from .. import schemas, crud, database, security, hashing, instrumentation, ratelimit # Importa los nuevos módulos
 
 # Crea una instancia de APIRouter para la autenticación
 router = APIRouter(
     prefix="/auth",
     tags=["Authentication"], # Etiqueta para la documentación
+    route_class=instrumentation.TimedRoute,
+    dependencies=[Depends(ratelimit.limit_by_ip)], # Rate limit (ver app/ratelimit.py)
 )
 
 
@@ -32,7 +31,15 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
             detail="El nombre de usuario ya está registrado"
         )
     # Crea el usuario usando la función CRUD
-    return crud.create_user(db=db, user=user)
+    db_user = crud.create_user(db=db, user=user)
+    # Con varios shards, copia mínima del usuario en el suyo (ver app/sharding.py)
+    if database.shard_map.shard_for(db_user.id) != 0:
+        shard_db = database.shard_session(db_user.id)
+        try:
+            crud.create_shard_user(shard_db, db_user.id, db_user.username)
+        finally:
+            shard_db.close()
+    return db_user
 
 # --- Endpoint de Login y Obtención de Token ---
 # Usa OAuth2PasswordRequestForm para manejar la entrada de username y password del formulario
@@ -43,18 +50,41 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     Recibe el nombre de usuario y la contraseña en un formulario.
     """
     user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    password_ok, new_hash = (False, None)
+    if user:
+        # bcrypt se ejecuta en el pool de procesos; 503 si está saturado
+        password_ok, new_hash = hashing.verify_and_update(form_data.password, user.hashed_password)
+    if not password_ok:
         # Si las credenciales son incorrectas, devuelve un error 401 Unauthorized
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nombre de usuario o contraseña incorrectos",
             headers={"WWW-Authenticate": "Bearer"}, # Indica que se espera un token Bearer
         )
-    # Crea el token de acceso JWT
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, # "sub" (subject) es la convención para el identificador del usuario
-        expires_delta=access_token_expires
+    if new_hash:
+        # El hash usaba un coste obsoleto: se regenera con la configuración actual
+        crud.update_user_password_hash(db, user, new_hash)
+    # Access token (con el id y el estado del usuario como claims, para que las
+    # rutas no consulten la base de datos) y refresh token
+    return security.create_token_pair(user)
+
+# --- Endpoint de Renovación del Token ---
+@router.post("/refresh", response_model=schemas.Token)
+def refresh_access_token(payload: schemas.TokenRefresh, db: Session = Depends(get_db)):
+    """
+    Obtiene un access token nuevo (y un refresh token nuevo) a partir de un
+    refresh token válido, sin volver a enviar la contraseña ni ejecutar bcrypt.
+    Comprueba en la base de datos que el usuario sigue existiendo y activo.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Refresh token inválido",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    # Retorna el token y su tipo
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    claims = security.decode_refresh_token(payload.refresh_token)
+    if claims is None or claims.get("uid") is None:
+        raise credentials_exception
+    user = crud.get_user(db, user_id=claims["uid"])
+    if user is None or not user.is_active or user.username != claims.get("sub"):
+        raise credentials_exception
+    return security.create_token_pair(user)
@@ -0,0 +1,78 @@
+# app/routers/metrics.py
+
+import os
+import secrets
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+
+from .. import database, idempotency, metrics
+from ..cache import principal_cache
+
+load_dotenv()
+
+# Token que Prometheus debe enviar en "Authorization: Bearer <token>"
+# (bearer_token en la configuración del scrape). Sin él, /metrics queda
+# abierto y solo debe ser accesible desde la red interna.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+def require_metrics_token(request: Request):
+    if not METRICS_TOKEN:
+        return
+    esquema, _, token = request.headers.get("Authorization", "").partition(" ")
+    if esquema.lower() != "bearer" or not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token de métricas no válido",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+router = APIRouter(
+    tags=["Metrics"],
+    dependencies=[Depends(require_metrics_token)],
+)
+
+
+def _pool_gauge(campo: str):
+    def leer():
+        return [({"pool": nombre}, estado[campo]) for nombre, estado in database.pool_status().items()]
+    return leer
+
+
+def _replica_health():
+    return [({"replica": nombre}, int(sana)) for nombre, sana in (
+        database.replica_pool.status().items() if database.replica_pool else ()
+    )]
+
+
+def _cache_gauge(campo: str):
+    def leer():
+        return [
+            ({"cache": "principal"}, principal_cache.stats()[campo]),
+            ({"cache": "idempotency"}, idempotency.response_cache.stats()[campo]),
+        ]
+    return leer
+
+
+metrics.gauge_func("db_pool_size", "Tamaño configurado del pool", _pool_gauge("size"))
+metrics.gauge_func("db_pool_checked_in", "Conexiones libres en el pool", _pool_gauge("checked_in"))
+metrics.gauge_func("db_pool_checked_out", "Conexiones en uso", _pool_gauge("checked_out"))
+metrics.gauge_func("db_pool_overflow", "Conexiones de overflow abiertas (negativo: huecos libres hasta pool_size)", _pool_gauge("overflow"))
+metrics.gauge_func("db_replica_healthy", "1 si la réplica se usa para lecturas, 0 si se ha descartado", _replica_health)
+metrics.counter_func("cache_hits_total", "Aciertos acumulados de la caché", _cache_gauge("hits"))
+metrics.counter_func("cache_misses_total", "Fallos acumulados de la caché", _cache_gauge("misses"))
+metrics.gauge_func("cache_size", "Entradas actuales de la caché", _cache_gauge("size"))
+
+
+# --- Endpoint de métricas (formato de texto de Prometheus) ---
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Expone las métricas del proceso: estado del pool de conexiones,
+    histograma de espera en el checkout y contadores de la caché de usuarios.
+    Cada worker expone sus propias métricas.
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
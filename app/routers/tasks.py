@@ -1,24 +1,26 @@
 # app/routers/tasks.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import csv
+import io
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from .. import schemas, crud, database, models
-from ..dependencies import get_current_user
+from .. import schemas, crud, etag, events, idempotency, importer, logs, pagination, ratelimit, serialization
+from ..dependencies import get_current_user, get_read_db, get_task_db, task_session
 
 router = APIRouter(
     prefix="/tasks",
     tags=["Tasks"],
     responses={404: {"description": "Not found"}},
+    route_class=idempotency.IdempotentRoute, # TimedRoute + Idempotency-Key (ver app/idempotency.py)
+    dependencies=[Depends(ratelimit.limit_by_user)], # Rate limit (ver app/ratelimit.py)
 )
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+logger = logs.get_logger(__name__)
 
 # --- Endpoints de Tareas ---
 
@@ -26,111 +28,401 @@ def get_db():
 @router.post("/", response_model=schemas.Task, status_code=status.HTTP_201_CREATED)
 def create_task_route(
     task: schemas.TaskCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user) # ¡Aquí obtenemos el usuario autenticado!
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user) # ¡Aquí obtenemos el usuario autenticado!
 ):
     """
     Crea una nueva tarea asignada al usuario autenticado. Requiere autenticación.
     """
-    print(f"Usuario autenticado creando tarea: {current_user.username}")
+    logs.sampled(logger, "Creando tarea", user=current_user.username)
     # MODIFICACIÓN CLAVE AQUÍ: Pasar el ID del usuario activo
-    return crud.create_task(db=db, task=task, owner_id=current_user.id) # <--- ¡Pasamos current_user.id!
+    db_task = crud.create_task(db=db, task=task, owner_id=current_user.id) # <--- ¡Pasamos current_user.id!
+    events.publish(current_user.id, "created", events.task_payload(db_task))
+    return db_task
 
 # Operación: Obtener Todas las Tareas del Usuario (GET)
 @router.get("/", response_model=List[schemas.Task])
 def get_tasks_route(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user) # ¡Añadido!
+    cursor: Optional[str] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = Query(None, min_length=1, max_length=200),
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user) # ¡Añadido!
 ):
     """
     Obtiene todas las tareas del usuario autenticado. Requiere autenticación.
+    Admite dos modos de paginación:
+    - offset: `skip` y `limit` (modo clásico, se mantiene por compatibilidad).
+    - cursor: `cursor` y `limit`. El cursor de la página siguiente se devuelve en
+      la cabecera `X-Next-Cursor` (también en modo offset, para poder cambiar de modo).
+    Filtros (se aplican en la base de datos):
+    - `completed`: solo tareas completadas (true) o pendientes (false).
+    - `search`: texto a buscar en título y descripción. En MySQL (índice
+      FULLTEXT) encuentra las tareas que contienen todas las palabras, en
+      cualquier orden, como inicio de palabra ("inform" encuentra "informe",
+      "forme" no). Si alguna palabra es más corta que MYSQL_FT_MIN_TOKEN_SIZE
+      o es una stopword de MySQL, y en otros motores, busca el texto completo
+      como subcadena (LIKE '%texto%').
+    - `sort`: "id" (por defecto) o "-id" (más recientes primero).
+    Devuelve un ETag: con If-None-Match se responde 304 sin consultar las tareas.
     """
-    print(f"Usuario autenticado obteniendo tareas: {current_user.username}")
+    logs.sampled(logger, "Obteniendo tareas", user=current_user.username)
+    etag_actual = etag.make_etag(
+        "list", current_user.id, crud.get_tasks_version(db, current_user.id),
+        skip, limit, cursor, completed, search, sort.value,
+    )
+    respuesta_304 = etag.not_modified(request, etag_actual)
+    if respuesta_304 is not None:
+        return respuesta_304
+    response.headers.update(etag.headers(etag_actual))
     # Filtrar tareas por owner_id
-    tasks = db.query(models.Task).filter(models.Task.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return tasks
+    after_id = pagination.decode_cursor(cursor) if cursor else None
+    # Solo las columnas de schemas.Task, como tuplas, codificadas directamente
+    # a JSON: sin objetos ORM ni validación por fila (ver app/serialization.py)
+    filas = crud.get_task_rows_by_owner(
+        db, owner_id=current_user.id, skip=skip, limit=limit, after_id=after_id,
+        completed=completed, search=search, sort=sort,
+    )
+    cursor_siguiente = pagination.next_cursor(filas, limit)
+    if cursor_siguiente:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = cursor_siguiente
+    return serialization.json_response(serialization.task_list_json(filas), response)
+
+# Operación: Obtener los Contadores de Tareas del Usuario (GET)
+@router.get("/stats", response_model=schemas.TaskStats)
+def get_task_stats_route(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Devuelve el número de tareas del usuario autenticado: total, completadas y
+    pendientes. Se lee de los contadores de users (una consulta por clave
+    primaria), sin contar las tareas. Admite If-None-Match (ETag).
+    Requiere autenticación.
+    """
+    fila = crud.get_tasks_stats(db, current_user.id)
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    etag_actual = etag.make_etag("stats", current_user.id, fila.tasks_version)
+    respuesta_304 = etag.not_modified(request, etag_actual)
+    if respuesta_304 is not None:
+        return respuesta_304
+    response.headers.update(etag.headers(etag_actual))
+    return schemas.TaskStats(
+        total=fila.tasks_total,
+        completed=fila.tasks_completed,
+        open=fila.tasks_total - fila.tasks_completed,
+    )
+
+# --- Exportación ---
+# Filas leídas de la base de datos por cada lote del cursor de servidor
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CSV_COLUMNS = ["id", "title", "description", "completed"]
+
+def _export_lines(db: Session, owner_id: int, export_format: schemas.ExportFormat, completed: Optional[bool], search: Optional[str]):
+    """
+    Generador con el contenido de la exportación, un trozo por lote de filas.
+    Usa su propia sesión (task_session con read=True, como get_read_db) y la
+    cierra al terminar: la de una dependencia ya está cerrada cuando empieza
+    el streaming.
+    """
+    try:
+        if export_format == schemas.ExportFormat.csv:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_CSV_COLUMNS)
+            yield buffer.getvalue()
+        for lote in crud.iter_task_rows(db, owner_id, completed=completed, search=search, batch_size=EXPORT_BATCH_SIZE):
+            if export_format == schemas.ExportFormat.csv:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(
+                    (fila.id, fila.title, fila.description or "", "true" if fila.completed else "false")
+                    for fila in lote
+                )
+                yield buffer.getvalue()
+            else:
+                # Mismas claves y orden que schemas.Task
+                yield serialization.task_ndjson(lote)
+    finally:
+        db.close()
+
+# Operación: Exportar Todas las Tareas del Usuario (GET)
+@router.get("/export")
+def export_tasks_route(
+    export_format: schemas.ExportFormat = Query(schemas.ExportFormat.ndjson, alias="format"),
+    completed: Optional[bool] = None,
+    search: Optional[str] = Query(None, min_length=1, max_length=200),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Exporta todas las tareas del usuario autenticado en NDJSON (una tarea JSON
+    por línea) o CSV. La respuesta se genera en streaming desde un cursor de
+    servidor, así que la memoria no depende del número de tareas y el primer
+    byte llega de inmediato. Admite los filtros `completed` y `search`.
+    Requiere autenticación.
+    """
+    logger.info("Exportando tareas", extra={"fields": {"user": current_user.username, "format": export_format.value}})
+    media_type = "text/csv" if export_format == schemas.ExportFormat.csv else "application/x-ndjson"
+    return StreamingResponse(
+        _export_lines(task_session(current_user.id, read=True), current_user.id, export_format, completed, search),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tasks.{export_format.value}"'},
+    )
+
+# --- Cambios en tiempo real (Server-Sent Events) ---
+# Intervalo de reconexión que se sugiere al navegador (EventSource), en ms
+EVENTS_RETRY_MS = 3000
+
+# Operación: Suscribirse a los Cambios de las Tareas (GET)
+@router.get("/events")
+async def task_events_route(
+    request: Request,
+    last_event_id: Optional[str] = Query(None, max_length=64),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Flujo Server-Sent Events con los cambios de las tareas del usuario
+    autenticado, hechos desde cualquier dispositivo: created, updated, completed,
+    deleted, bulk_created, bulk_completed, bulk_deleted e imported.
+
+    - Para reanudar sin perder eventos se envía la cabecera `Last-Event-ID` (o el
+      parámetro `last_event_id`). Si esos eventos ya no están disponibles, o el
+      cliente no consume a tiempo, se envía un evento `reset`: el cliente debe
+      recargar GET /tasks/ y volver a conectarse.
+    - Cada EVENTS_HEARTBEAT_SECONDS sin cambios se envía un comentario `: ping`.
+
+    No consulta la base de datos mientras la conexión está abierta.
+    Requiere autenticación.
+    """
+    desde = request.headers.get("last-event-id") or last_event_id
+
+    async def flujo():
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        async for event in events.broker.subscribe(current_user.id, desde):
+            if await request.is_disconnected():
+                break
+            yield ": ping\n\n" if event is None else event.to_sse()
+
+    return StreamingResponse(
+        flujo(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Importación ---
+
+# Operación: Importar Tareas desde NDJSON o CSV (POST)
+@router.post("/import", response_model=schemas.ImportReport)
+async def import_tasks_route(
+    request: Request,
+    import_format: Optional[schemas.ExportFormat] = Query(None, alias="format"),
+    batch_size: int = Query(importer.IMPORT_BATCH_SIZE, ge=1, le=10000),
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Importa tareas desde el cuerpo de la petición, en NDJSON (un objeto JSON por
+    línea) o CSV con cabecera. Campos: title (obligatorio), description, completed.
+    El formato se toma de `format` o, si no se indica, del Content-Type
+    (text/csv para CSV; NDJSON en otro caso).
+
+    El cuerpo se lee y valida en streaming; las filas válidas se insertan en
+    lotes de `batch_size` con un commit por lote, así que la memoria no depende
+    del tamaño del fichero. Las líneas inválidas no detienen la importación: se
+    cuentan y se devuelven en `errors` (hasta IMPORT_MAX_ERRORS).
+    Requiere autenticación.
+    """
+    if import_format is None:
+        content_type = request.headers.get("content-type", "")
+        import_format = schemas.ExportFormat.csv if "csv" in content_type else schemas.ExportFormat.ndjson
+
+    report = schemas.ImportReport()
+    lote = []
+    async for linea, fila, error in importer.iter_rows(request.stream(), import_format):
+        if error is not None:
+            report.failed += 1
+            if len(report.errors) < importer.IMPORT_MAX_ERRORS:
+                report.errors.append(schemas.ImportLineError(line=linea, error=error))
+            else:
+                report.errors_truncated = True
+            continue
+        lote.append(fila)
+        if len(lote) >= batch_size:
+            report.inserted += await run_in_threadpool(crud.insert_tasks_batch, db, lote, current_user.id)
+            report.batches += 1
+            lote = []
+            logs.sampled(logger, "Importación en curso", user=current_user.username, inserted=report.inserted, failed=report.failed)
+    if lote:
+        report.inserted += await run_in_threadpool(crud.insert_tasks_batch, db, lote, current_user.id)
+        report.batches += 1
+    logger.info("Importación terminada", extra={"fields": {"user": current_user.username, "inserted": report.inserted, "failed": report.failed}})
+    if report.inserted:
+        # Un único evento: los clientes recargan la lista en vez de recibir miles de eventos
+        await events.publish_async(current_user.id, "imported", {"inserted": report.inserted})
+    return report
+
+# --- Operaciones masivas (bulk) ---
+# Deben declararse antes de las rutas /{task_id} para que "bulk" no se
+# interprete como un ID de tarea.
+
+# Operación: Crear Varias Tareas (POST)
+@router.post("/bulk", response_model=List[schemas.Task], status_code=status.HTTP_201_CREATED)
+def create_tasks_bulk_route(
+    payload: schemas.TaskBulkCreate,
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Crea varias tareas del usuario autenticado en una sola transacción.
+    Devuelve las tareas creadas en el mismo orden. Requiere autenticación.
+    """
+    logs.sampled(logger, "Creando tareas en bloque", user=current_user.username, count=len(payload.tasks))
+    creadas = crud.create_tasks_bulk(db=db, tasks=payload.tasks, owner_id=current_user.id)
+    events.publish(current_user.id, "bulk_created", {"tasks": [t.model_dump(mode="json") for t in creadas]})
+    return creadas
+
+# Operación: Completar Varias Tareas (PATCH)
+@router.patch("/bulk/complete", response_model=List[schemas.BulkItemResult])
+def complete_tasks_bulk_route(
+    payload: schemas.TaskIds,
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Marca como completadas varias tareas del usuario en una sola transacción.
+    Devuelve el resultado por ID ("completed" o "not_found"). Requiere autenticación.
+    """
+    logs.sampled(logger, "Completando tareas en bloque", user=current_user.username, count=len(payload.ids))
+    resultados = crud.complete_tasks_bulk(db=db, task_ids=payload.ids, owner_id=current_user.id)
+    ids = [r.id for r in resultados if r.status == "completed"]
+    if ids:
+        events.publish(current_user.id, "bulk_completed", {"ids": ids})
+    return resultados
+
+# Operación: Eliminar Varias Tareas (DELETE)
+@router.delete("/bulk", response_model=List[schemas.BulkItemResult])
+def delete_tasks_bulk_route(
+    payload: schemas.TaskIds,
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Elimina varias tareas del usuario en una sola transacción.
+    Devuelve el resultado por ID ("deleted" o "not_found"). Requiere autenticación.
+    """
+    logs.sampled(logger, "Eliminando tareas en bloque", user=current_user.username, count=len(payload.ids))
+    resultados = crud.delete_tasks_bulk(db=db, task_ids=payload.ids, owner_id=current_user.id)
+    ids = [r.id for r in resultados if r.status == "deleted"]
+    if ids:
+        events.publish(current_user.id, "bulk_deleted", {"ids": ids})
+    return resultados
 
 # Operación: Obtener Tarea por ID (GET)
 @router.get("/{task_id}", response_model=schemas.Task)
 def get_task_by_id_route(
     task_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user) # ¡Añadido!
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user) # ¡Añadido!
 ):
     """
     Obtiene una tarea específica por su ID, asegurándose de que pertenezca al usuario autenticado.
-    Requiere autenticación.
+    Admite If-None-Match (ETag). Requiere autenticación.
     """
-    print(f"Usuario autenticado obteniendo tarea {task_id}: {current_user.username}")
+    logs.sampled(logger, "Obteniendo tarea", user=current_user.username, task_id=task_id)
+    etag_actual = etag.make_etag("task", current_user.id, crud.get_tasks_version(db, current_user.id), task_id)
+    respuesta_304 = etag.not_modified(request, etag_actual)
+    if respuesta_304 is not None:
+        return respuesta_304
+    response.headers.update(etag.headers(etag_actual))
     # Filtrar por ID de tarea Y owner_id
-    task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
-    if task is None:
+    fila = crud.get_task_row(db, task_id=task_id, owner_id=current_user.id)
+    if fila is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada")
-    return task
+    return serialization.json_response(serialization.task_json(fila), response)
 
 # Operación: Actualizar Tarea (PUT)
 @router.put("/{task_id}", response_model=schemas.Task)
 def update_task_route(
     task_id: int,
     task: schemas.TaskCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user) # ¡Añadido!
+    response: Response,
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user) # ¡Añadido!
 ):
     """
     Actualiza una tarea específica por su ID. Requiere autenticación.
+    Un único UPDATE acotado por owner_id (ver crud.update_task).
     """
-    print(f"Usuario autenticado actualizando tarea {task_id}: {current_user.username}")
-    # Asegúrate de que la tarea pertenece al usuario actual antes de actualizar
-    db_task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
-    if db_task is None:
+    logs.sampled(logger, "Actualizando tarea", user=current_user.username, task_id=task_id)
+    fila = crud.update_task(db, task_id=task_id, owner_id=current_user.id, values=task.model_dump())
+    if fila is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
-    
-    # Actualiza los campos
-    db_task.title = task.title
-    db_task.description = task.description
-    db.commit()
-    db.refresh(db_task)
-    return db_task
+    events.publish(current_user.id, "updated", serialization.task_dict(fila))
+    return serialization.json_response(serialization.task_json(fila), response)
+
+# Operación: Actualizar Parcialmente una Tarea (PATCH)
+@router.patch("/{task_id}", response_model=schemas.Task)
+def patch_task_route(
+    task_id: int,
+    task: schemas.TaskUpdate,
+    response: Response,
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Actualiza solo los campos enviados (title y/o description) de una tarea.
+    Requiere autenticación.
+    """
+    logs.sampled(logger, "Actualizando tarea (parcial)", user=current_user.username, task_id=task_id)
+    cambios = task.model_dump(exclude_unset=True)
+    fila = crud.update_task(db, task_id=task_id, owner_id=current_user.id, values=cambios)
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
+    if cambios:
+        events.publish(current_user.id, "updated", serialization.task_dict(fila))
+    return serialization.json_response(serialization.task_json(fila), response)
 
 # Operación: Eliminar Tarea (DELETE)
 @router.delete("/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_task_route(
     task_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user) # ¡Añadido!
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user) # ¡Añadido!
 ):
     """
     Elimina una tarea específica por su ID. Requiere autenticación.
     """
-    print(f"Usuario autenticado eliminando tarea {task_id}: {current_user.username}")
-    # Asegúrate de que la tarea pertenece al usuario actual antes de eliminar
-    db_task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
-    if db_task is None:
+    logs.sampled(logger, "Eliminando tarea", user=current_user.username, task_id=task_id)
+    if not crud.delete_task(db, task_id=task_id, owner_id=current_user.id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
-    
-    db.delete(db_task)
-    db.commit()
+    events.publish(current_user.id, "deleted", {"id": task_id})
     return
 
 # Operación: Actualizar Estado de Tarea (PATCH)
 @router.patch("/{task_id}/complete", response_model=schemas.Task)
 def complete_task_route(
     task_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user) # ¡Añadido!
+    response: Response,
+    db: Session = Depends(get_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user) # ¡Añadido!
 ):
     """
     Marca una tarea como completada por su ID. Requiere autenticación.
     """
-    print(f"Usuario autenticado completando tarea {task_id}: {current_user.username}")
-    # Asegúrate de que la tarea pertenece al usuario actual antes de marcar como completada
-    db_task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
-    if db_task is None:
+    logs.sampled(logger, "Completando tarea", user=current_user.username, task_id=task_id)
+    fila, cambiada = crud.complete_task(db, task_id=task_id, owner_id=current_user.id)
+    if fila is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
-    
-    db_task.completed = True
-    db.commit()
-    db.refresh(db_task)
-    return db_task
\ No newline at end of file
+    if cambiada:
+        events.publish(current_user.id, "completed", serialization.task_dict(fila))
+    return serialization.json_response(serialization.task_json(fila), response)
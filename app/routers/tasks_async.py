@@ -0,0 +1,357 @@
+# app/routers/tasks_async.py
+# Versión asíncrona de los endpoints de tareas de app/routers/tasks.py.
+# Solo se registra en modo asíncrono (database.IS_ASYNC); en ese caso sustituye
+# a las rutas síncronas equivalentes (ver app/main.py). Así la concurrencia queda
+# limitada por las conexiones de la base de datos y no por el threadpool.
+# No hay versión de GET /tasks/events (ya es async y no usa la base de datos)
+# ni de las rutas de app/routers/auth.py (ver la cabecera de app/crud_async.py).
+
+import csv
+import io
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from .. import schemas, crud_async, etag, events, idempotency, importer, logs, ratelimit, pagination, serialization
+from ..dependencies import async_task_session, get_async_read_db, get_async_task_db, get_current_user
+from .tasks import EXPORT_BATCH_SIZE, EXPORT_CSV_COLUMNS
+
+router = APIRouter(
+    prefix="/tasks",
+    tags=["Tasks"],
+    responses={404: {"description": "Not found"}},
+    route_class=idempotency.IdempotentRoute, # TimedRoute + Idempotency-Key (ver app/idempotency.py)
+    dependencies=[Depends(ratelimit.limit_by_user)], # Rate limit (ver app/ratelimit.py)
+)
+
+logger = logs.get_logger(__name__)
+
+# --- Endpoints de Tareas (async) ---
+
+# Operación: Crear Tarea (POST)
+@router.post("/", response_model=schemas.Task, status_code=status.HTTP_201_CREATED)
+async def create_task_route(
+    task: schemas.TaskCreate,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Crea una nueva tarea asignada al usuario autenticado. Requiere autenticación.
+    """
+    logs.sampled(logger, "Creando tarea", user=current_user.username)
+    db_task = await crud_async.create_task(db=db, task=task, owner_id=current_user.id)
+    await events.publish_async(current_user.id, "created", events.task_payload(db_task))
+    return db_task
+
+# Operación: Obtener Todas las Tareas del Usuario (GET)
+@router.get("/", response_model=List[schemas.Task])
+async def get_tasks_route(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    completed: Optional[bool] = None,
+    search: Optional[str] = Query(None, min_length=1, max_length=200),
+    sort: schemas.TaskSort = schemas.TaskSort.id_asc,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Obtiene todas las tareas del usuario autenticado (offset o cursor),
+    con los filtros `completed`, `search` y `sort`. Admite If-None-Match (ETag).
+    `search` se comporta distinto en MySQL (FULLTEXT) que en otros motores
+    (LIKE), ver tasks.get_tasks_route. Requiere autenticación.
+    """
+    logs.sampled(logger, "Obteniendo tareas", user=current_user.username)
+    etag_actual = etag.make_etag(
+        "list", current_user.id, await crud_async.get_tasks_version(db, current_user.id),
+        skip, limit, cursor, completed, search, sort.value,
+    )
+    respuesta_304 = etag.not_modified(request, etag_actual)
+    if respuesta_304 is not None:
+        return respuesta_304
+    response.headers.update(etag.headers(etag_actual))
+    after_id = pagination.decode_cursor(cursor) if cursor else None
+    # Tuplas codificadas directamente a JSON (ver app/serialization.py)
+    filas = await crud_async.get_task_rows_by_owner(
+        db, owner_id=current_user.id, skip=skip, limit=limit, after_id=after_id,
+        completed=completed, search=search, sort=sort,
+    )
+    cursor_siguiente = pagination.next_cursor(filas, limit)
+    if cursor_siguiente:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = cursor_siguiente
+    return serialization.json_response(serialization.task_list_json(filas), response)
+
+# Operación: Obtener los Contadores de Tareas del Usuario (GET)
+@router.get("/stats", response_model=schemas.TaskStats)
+async def get_task_stats_route(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Total, completadas y pendientes del usuario autenticado, leídos de los
+    contadores de users. Admite If-None-Match (ETag). Requiere autenticación.
+    """
+    fila = await crud_async.get_tasks_stats(db, current_user.id)
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
+    etag_actual = etag.make_etag("stats", current_user.id, fila.tasks_version)
+    respuesta_304 = etag.not_modified(request, etag_actual)
+    if respuesta_304 is not None:
+        return respuesta_304
+    response.headers.update(etag.headers(etag_actual))
+    return schemas.TaskStats(
+        total=fila.tasks_total,
+        completed=fila.tasks_completed,
+        open=fila.tasks_total - fila.tasks_completed,
+    )
+
+# --- Exportación ---
+
+async def _export_lines(db: AsyncSession, owner_id: int, export_format: schemas.ExportFormat, completed: Optional[bool], search: Optional[str]):
+    """Equivalente asíncrono de tasks._export_lines (usa y cierra su propia sesión)."""
+    try:
+        if export_format == schemas.ExportFormat.csv:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_CSV_COLUMNS)
+            yield buffer.getvalue()
+        async for lote in crud_async.iter_task_rows(db, owner_id, completed=completed, search=search, batch_size=EXPORT_BATCH_SIZE):
+            if export_format == schemas.ExportFormat.csv:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(
+                    (fila.id, fila.title, fila.description or "", "true" if fila.completed else "false")
+                    for fila in lote
+                )
+                yield buffer.getvalue()
+            else:
+                yield serialization.task_ndjson(lote)
+    finally:
+        await db.close()
+
+# Operación: Exportar Todas las Tareas del Usuario (GET)
+@router.get("/export")
+async def export_tasks_route(
+    export_format: schemas.ExportFormat = Query(schemas.ExportFormat.ndjson, alias="format"),
+    completed: Optional[bool] = None,
+    search: Optional[str] = Query(None, min_length=1, max_length=200),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Exporta todas las tareas del usuario autenticado en NDJSON o CSV, en
+    streaming desde un cursor de servidor. Admite los filtros `completed` y
+    `search`. Requiere autenticación.
+    """
+    logger.info("Exportando tareas", extra={"fields": {"user": current_user.username, "format": export_format.value}})
+    media_type = "text/csv" if export_format == schemas.ExportFormat.csv else "application/x-ndjson"
+    return StreamingResponse(
+        _export_lines(async_task_session(current_user.id, read=True), current_user.id, export_format, completed, search),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tasks.{export_format.value}"'},
+    )
+
+# --- Importación ---
+
+# Operación: Importar Tareas desde NDJSON o CSV (POST)
+@router.post("/import", response_model=schemas.ImportReport)
+async def import_tasks_route(
+    request: Request,
+    import_format: Optional[schemas.ExportFormat] = Query(None, alias="format"),
+    batch_size: int = Query(importer.IMPORT_BATCH_SIZE, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Importa tareas desde el cuerpo de la petición, en NDJSON o CSV con cabecera,
+    en lotes de `batch_size` con un commit por lote. Las líneas inválidas se
+    cuentan y se devuelven en `errors`. Requiere autenticación.
+    """
+    if import_format is None:
+        content_type = request.headers.get("content-type", "")
+        import_format = schemas.ExportFormat.csv if "csv" in content_type else schemas.ExportFormat.ndjson
+
+    report = schemas.ImportReport()
+    lote = []
+    async for linea, fila, error in importer.iter_rows(request.stream(), import_format):
+        if error is not None:
+            report.failed += 1
+            if len(report.errors) < importer.IMPORT_MAX_ERRORS:
+                report.errors.append(schemas.ImportLineError(line=linea, error=error))
+            else:
+                report.errors_truncated = True
+            continue
+        lote.append(fila)
+        if len(lote) >= batch_size:
+            report.inserted += await crud_async.insert_tasks_batch(db, lote, current_user.id)
+            report.batches += 1
+            lote = []
+            logs.sampled(logger, "Importación en curso", user=current_user.username, inserted=report.inserted, failed=report.failed)
+    if lote:
+        report.inserted += await crud_async.insert_tasks_batch(db, lote, current_user.id)
+        report.batches += 1
+    logger.info("Importación terminada", extra={"fields": {"user": current_user.username, "inserted": report.inserted, "failed": report.failed}})
+    if report.inserted:
+        await events.publish_async(current_user.id, "imported", {"inserted": report.inserted})
+    return report
+
+# --- Operaciones masivas (bulk) ---
+# Antes de las rutas /{task_id}, como en app/routers/tasks.py.
+
+# Operación: Crear Varias Tareas (POST)
+@router.post("/bulk", response_model=List[schemas.Task], status_code=status.HTTP_201_CREATED)
+async def create_tasks_bulk_route(
+    payload: schemas.TaskBulkCreate,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Crea varias tareas del usuario autenticado en una sola transacción.
+    Devuelve las tareas creadas en el mismo orden. Requiere autenticación.
+    """
+    logs.sampled(logger, "Creando tareas en bloque", user=current_user.username, count=len(payload.tasks))
+    creadas = await crud_async.create_tasks_bulk(db=db, tasks=payload.tasks, owner_id=current_user.id)
+    await events.publish_async(current_user.id, "bulk_created", {"tasks": [t.model_dump(mode="json") for t in creadas]})
+    return creadas
+
+# Operación: Completar Varias Tareas (PATCH)
+@router.patch("/bulk/complete", response_model=List[schemas.BulkItemResult])
+async def complete_tasks_bulk_route(
+    payload: schemas.TaskIds,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Marca como completadas varias tareas del usuario en una sola transacción.
+    Devuelve el resultado por ID ("completed" o "not_found"). Requiere autenticación.
+    """
+    logs.sampled(logger, "Completando tareas en bloque", user=current_user.username, count=len(payload.ids))
+    resultados = await crud_async.complete_tasks_bulk(db=db, task_ids=payload.ids, owner_id=current_user.id)
+    ids = [r.id for r in resultados if r.status == "completed"]
+    if ids:
+        await events.publish_async(current_user.id, "bulk_completed", {"ids": ids})
+    return resultados
+
+# Operación: Eliminar Varias Tareas (DELETE)
+@router.delete("/bulk", response_model=List[schemas.BulkItemResult])
+async def delete_tasks_bulk_route(
+    payload: schemas.TaskIds,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Elimina varias tareas del usuario en una sola transacción.
+    Devuelve el resultado por ID ("deleted" o "not_found"). Requiere autenticación.
+    """
+    logs.sampled(logger, "Eliminando tareas en bloque", user=current_user.username, count=len(payload.ids))
+    resultados = await crud_async.delete_tasks_bulk(db=db, task_ids=payload.ids, owner_id=current_user.id)
+    ids = [r.id for r in resultados if r.status == "deleted"]
+    if ids:
+        await events.publish_async(current_user.id, "bulk_deleted", {"ids": ids})
+    return resultados
+
+# Operación: Obtener Tarea por ID (GET)
+@router.get("/{task_id}", response_model=schemas.Task)
+async def get_task_by_id_route(
+    task_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Obtiene una tarea específica por su ID, asegurándose de que pertenezca al usuario autenticado.
+    Admite If-None-Match (ETag).
+    """
+    logs.sampled(logger, "Obteniendo tarea", user=current_user.username, task_id=task_id)
+    etag_actual = etag.make_etag("task", current_user.id, await crud_async.get_tasks_version(db, current_user.id), task_id)
+    respuesta_304 = etag.not_modified(request, etag_actual)
+    if respuesta_304 is not None:
+        return respuesta_304
+    response.headers.update(etag.headers(etag_actual))
+    fila = await crud_async.get_task_row(db, task_id=task_id, owner_id=current_user.id)
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada")
+    return serialization.json_response(serialization.task_json(fila), response)
+
+# Operación: Actualizar Tarea (PUT)
+@router.put("/{task_id}", response_model=schemas.Task)
+async def update_task_route(
+    task_id: int,
+    task: schemas.TaskCreate,
+    response: Response,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Actualiza una tarea específica por su ID. Requiere autenticación.
+    """
+    logs.sampled(logger, "Actualizando tarea", user=current_user.username, task_id=task_id)
+    fila = await crud_async.update_task(db, task_id=task_id, owner_id=current_user.id, values=task.model_dump())
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
+    await events.publish_async(current_user.id, "updated", serialization.task_dict(fila))
+    return serialization.json_response(serialization.task_json(fila), response)
+
+# Operación: Actualizar Parcialmente una Tarea (PATCH)
+@router.patch("/{task_id}", response_model=schemas.Task)
+async def patch_task_route(
+    task_id: int,
+    task: schemas.TaskUpdate,
+    response: Response,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Actualiza solo los campos enviados (title y/o description) de una tarea.
+    Requiere autenticación.
+    """
+    logs.sampled(logger, "Actualizando tarea (parcial)", user=current_user.username, task_id=task_id)
+    cambios = task.model_dump(exclude_unset=True)
+    fila = await crud_async.update_task(db, task_id=task_id, owner_id=current_user.id, values=cambios)
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
+    if cambios:
+        await events.publish_async(current_user.id, "updated", serialization.task_dict(fila))
+    return serialization.json_response(serialization.task_json(fila), response)
+
+# Operación: Eliminar Tarea (DELETE)
+@router.delete("/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_task_route(
+    task_id: int,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Elimina una tarea específica por su ID. Requiere autenticación.
+    """
+    logs.sampled(logger, "Eliminando tarea", user=current_user.username, task_id=task_id)
+    if not await crud_async.delete_task(db, task_id=task_id, owner_id=current_user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
+    await events.publish_async(current_user.id, "deleted", {"id": task_id})
+    return
+
+# Operación: Actualizar Estado de Tarea (PATCH)
+@router.patch("/{task_id}/complete", response_model=schemas.Task)
+async def complete_task_route(
+    task_id: int,
+    response: Response,
+    db: AsyncSession = Depends(get_async_task_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """
+    Marca una tarea como completada por su ID. Requiere autenticación.
+    """
+    logs.sampled(logger, "Completando tarea", user=current_user.username, task_id=task_id)
+    fila, cambiada = await crud_async.complete_task(db, task_id=task_id, owner_id=current_user.id)
+    if fila is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tarea no encontrada o no pertenece a este usuario")
+    if cambiada:
+        await events.publish_async(current_user.id, "completed", serialization.task_dict(fila))
+    return serialization.json_response(serialization.task_json(fila), response)
+
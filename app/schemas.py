@@ -1,7 +1,9 @@
 # app/schemas.py
 
-from pydantic import BaseModel, Field
-from typing import Optional
+from enum import Enum
+
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional
 
 # --- Modelos de Tarea (ya existentes) ---
 class TaskBase(BaseModel):
@@ -11,6 +13,28 @@ class TaskBase(BaseModel):
 class TaskCreate(TaskBase):
     pass
 
+class TaskUpdate(BaseModel):
+    """
+    Esquema para la actualización parcial (PATCH) de una tarea: solo se
+    modifican los campos enviados. description admite null para borrarla.
+    """
+    title: Optional[str] = Field(None, example="Aprender FastAPI a fondo")
+    description: Optional[str] = Field(None, example="Repasar dependencias y middlewares")
+
+    @field_validator("title")
+    @classmethod
+    def title_not_null(cls, value):
+        if value is None:
+            raise ValueError("title no puede ser null")
+        return value
+
+class TaskSort(str, Enum):
+    """
+    Orden del listado de tareas: "id" (más antiguas primero) o "-id" (más recientes primero).
+    """
+    id_asc = "id"
+    id_desc = "-id"
+
 class Task(TaskBase):
     id: int
     completed: bool = False
@@ -26,6 +50,65 @@ class Task(TaskBase):
             }
         }
 
+class TaskStats(BaseModel):
+    """
+    Esquema para los contadores de tareas del usuario (GET /tasks/stats).
+    """
+    total: int
+    completed: int
+    open: int
+
+class ExportFormat(str, Enum):
+    """
+    Formato de exportación de tareas: JSON por líneas (NDJSON) o CSV.
+    """
+    ndjson = "ndjson"
+    csv = "csv"
+
+# --- Operaciones masivas (bulk) sobre tareas ---
+# Límite de elementos por petición para acotar el tamaño de la transacción
+BULK_MAX_ITEMS = 1000
+
+class TaskBulkCreate(BaseModel):
+    """
+    Esquema para crear varias tareas en una sola petición y transacción.
+    """
+    tasks: List[TaskCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class TaskIds(BaseModel):
+    """
+    Esquema con la lista de IDs de tareas sobre los que operar en bloque.
+    """
+    ids: List[int] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS, example=[1, 2, 3])
+
+class BulkItemResult(BaseModel):
+    """
+    Resultado de una operación masiva para un ID concreto.
+    status: "completed", "deleted" o "not_found".
+    """
+    id: int
+    status: str
+
+# --- Importación de tareas ---
+
+class ImportLineError(BaseModel):
+    """
+    Error de validación de una línea del fichero importado.
+    """
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    """
+    Resultado de una importación: filas insertadas, filas rechazadas,
+    lotes confirmados y los primeros errores por línea.
+    """
+    inserted: int = 0
+    failed: int = 0
+    batches: int = 0
+    errors: List[ImportLineError] = []
+    errors_truncated: bool = False
+
 # --- NUEVO: Modelos de Usuario ---
 
 class UserBase(BaseModel):
@@ -59,12 +142,33 @@ class User(UserBase):
             }
         }
 
+class UserPrincipal(BaseModel):
+    """
+    Representación mínima e inmutable del usuario autenticado.
+    Es lo que se guarda en la caché de dependencies.get_current_user.
+    """
+    id: int
+    username: str
+    is_active: bool = True
+
+    class Config:
+        from_attributes = True
+        frozen = True
+
 class Token(BaseModel):
     """
     Esquema para la respuesta del token JWT.
     """
     access_token: str
     token_type: str = "bearer" # Siempre "bearer" para tokens de portador
+    refresh_token: Optional[str] = None # Para obtener un access token nuevo sin contraseña
+    expires_in: Optional[int] = None # Segundos de validez del access token
+
+class TokenRefresh(BaseModel):
+    """
+    Esquema para renovar el access token con un refresh token (POST /auth/refresh).
+    """
+    refresh_token: str
 
 class TokenData(BaseModel):
     """
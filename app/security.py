@@ -1,7 +1,9 @@
 # app/security.py
 
+import secrets
+import threading
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Dict, Iterable, Optional, Tuple
 
 # Importamos las excepciones específicas de jose y el módulo jwt
 # Modificamos la importación de jose.exceptions
@@ -11,28 +13,152 @@ from jose.exceptions import ExpiredSignatureError # Esta suele ser suficiente y
 # ¡ESTO ES LO QUE FALTABA! Importar HTTPException y status de FastAPI
 from fastapi import HTTPException, status 
 
-from passlib.context import CryptContext 
 import os
 from dotenv import load_dotenv 
 
+from . import hashing, logs
+
 # Carga las variables de entorno desde el archivo .env
 load_dotenv()
 
 # --- Configuración de Hashing de Contraseñas ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Ver app/hashing.py (pool de procesos y rehash automático)
+pwd_context = hashing.pwd_context
+
+logger = logs.get_logger(__name__)
 
-SECRET_KEY = os.getenv("SECRET_KEY", "fallback_secret_key_if_not_set_in_env")
+# Sin valor por defecto: una clave conocida permitiría firmar tokens de
+# cualquier usuario. La aplicación no arranca sin SECRET_KEY ni JWT_KEYS
+# (check_signing_keys); los scripts de mantenimiento no la necesitan.
+SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256" # Algoritmo de hashing para JWT
-ACCESS_TOKEN_EXPIRE_MINUTES = 30 # El token expirará en 30 minutos
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")) # El token expirará en 30 minutos
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+# --- Claves de firma (rotación) ---
+# JWT_KEYS="kid1:secreto1,kid2:secreto2": claves aceptadas al verificar.
+# JWT_ACTIVE_KID: clave con la que se firman los tokens nuevos (por defecto, la primera).
+# Para rotar: añadir la clave nueva, cambiar JWT_ACTIVE_KID y, cuando caduquen
+# los refresh tokens firmados con la antigua, quitarla de JWT_KEYS.
+# Sin JWT_KEYS se usa SECRET_KEY con el kid "default".
+# Tokens sin cabecera kid (emitidos antes de la rotación): sin JWT_KEYS se
+# verifican con SECRET_KEY; con JWT_KEYS, solo si se define JWT_LEGACY_KEY
+# (la SECRET_KEY con la que se firmaron) y, si no, se rechazan.
+DEFAULT_KID = "default"
+
+
+def _parse_keys(valor: Optional[str]) -> Dict[str, str]:
+    claves = {}
+    for entrada in (valor or "").split(","):
+        if not entrada.strip():
+            continue
+        kid, sep, secreto = entrada.strip().partition(":")
+        if not sep or not kid or not secreto:
+            raise ValueError("JWT_KEYS debe tener el formato kid:secreto[,kid:secreto...]")
+        claves[kid] = secreto
+    if not claves and SECRET_KEY:
+        claves[DEFAULT_KID] = SECRET_KEY
+    return claves
+
+
+JWT_KEYS = _parse_keys(os.getenv("JWT_KEYS"))
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID") or next(iter(JWT_KEYS), None)
+if JWT_KEYS and JWT_ACTIVE_KID not in JWT_KEYS:
+    raise ValueError(f"JWT_ACTIVE_KID={JWT_ACTIVE_KID} no está en JWT_KEYS")
+JWT_LEGACY_KEY = os.getenv("JWT_LEGACY_KEY") if os.getenv("JWT_KEYS") else SECRET_KEY
+
+
+def check_signing_keys() -> None:
+    """Impide arrancar la API sin claves de firma configuradas (SECRET_KEY o JWT_KEYS)."""
+    if not JWT_KEYS:
+        raise RuntimeError(
+            "Define SECRET_KEY (o JWT_KEYS) en el entorno o en .env: sin clave de firma "
+            "no se pueden emitir ni verificar tokens"
+        )
+
+# Tipos de token (claim "typ"): un refresh token no sirve como access token ni al revés
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+# --- Lista de revocación ---
+# Usuarios desactivados: sus tokens emitidos antes de la desactivación se
+# rechazan. Se guardan en la tabla token_revocations (shard 0), que
+# crud.update_user_active escribe en la misma transacción que is_active, y
+# cada worker la recarga cada REVOCATION_REFRESH_SECONDS (como user_shards):
+# una desactivación llega a todos los workers en ese plazo. Solo se cargan
+# las revocaciones de los últimos ACCESS_TOKEN_EXPIRE_MINUTES, las únicas
+# que pueden afectar a un access token aún válido; los refresh tokens
+# consultan la base de datos.
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+
+
+class RevocationList:
+    """
+    user_id -> instante (epoch) de la revocación. `loader(desde)` devuelve las
+    revocaciones posteriores a `desde` como tuplas (user_id, epoch).
+    """
+
+    def __init__(self):
+        self._revoked: Dict[int, float] = {}
+        self._loader: Optional[Callable[[datetime], Iterable[Tuple[int, float]]]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def revoke(self, user_id: int, at: float) -> None:
+        """Aplica una revocación en este proceso sin esperar a la recarga."""
+        self._revoked = {**self._revoked, user_id: at}
+
+    def restore(self, user_id: int) -> None:
+        self._revoked = {k: v for k, v in self._revoked.items() if k != user_id}
+
+    def is_revoked(self, user_id: Optional[int], issued_at: float) -> bool:
+        revocado_en = self._revoked.get(user_id)
+        return revocado_en is not None and issued_at <= revocado_en
+
+    def load(self) -> None:
+        """Recarga las revocaciones; si falla se mantienen las anteriores."""
+        if self._loader is None:
+            return
+        desde = datetime.now(timezone.utc) - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        try:
+            self._revoked = {user_id: at for user_id, at in self._loader(desde)}
+        except Exception:
+            logger.warning("No se pudo recargar la lista de revocación", exc_info=True)
+
+    def start(self, loader, interval: float = REVOCATION_REFRESH_SECONDS) -> None:
+        """Carga la lista y arranca el hilo que la recarga (una vez por proceso)."""
+        self._loader = loader
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.load()
+        self._stop.clear()
+
+        def bucle():
+            while not self._stop.wait(interval):
+                self.load()
+
+        self._thread = threading.Thread(target=bucle, name="token-revocations", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+revoked_users = RevocationList()
+
+
+def is_revoked(payload: dict, user_id: Optional[int] = None) -> bool:
+    """True si el token se emitió antes de que se revocaran los tokens de su usuario."""
+    return revoked_users.is_revoked(payload.get("uid", user_id), payload.get("iat", 0))
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica si una contraseña plana coincide con una contraseña hasheada."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return hashing.verify_password(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Hashea una contraseña."""
-    return pwd_context.hash(password)
+    return hashing.hash_password(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -40,24 +166,64 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     Crea un token de acceso JWT.
     data: Diccionario con la información a codificar (ej. {"sub": "username"}).
     expires_delta: Opcional, timedelta para la duración del token.
+    Se firma con la clave JWT_ACTIVE_KID, indicada en la cabecera "kid".
     """
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.setdefault("typ", ACCESS_TOKEN_TYPE)
+    to_encode.update({"exp": expire, "iat": int(now.timestamp())})
+    encoded_jwt = jwt.encode(
+        to_encode, JWT_KEYS[JWT_ACTIVE_KID], algorithm=ALGORITHM, headers={"kid": JWT_ACTIVE_KID}
+    )
     return encoded_jwt
 
-def decode_access_token(token: str):
+def user_claims(user) -> dict:
+    """
+    Claims que identifican al usuario: con "uid" y "act" las rutas pueden
+    autorizar la petición sin consultar la base de datos.
+    """
+    return {"sub": user.username, "uid": user.id, "act": bool(user.is_active)}
+
+def create_token_pair(user) -> dict:
+    """Access token + refresh token para el usuario (respuesta de /auth/token y /auth/refresh)."""
+    claims = user_claims(user)
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_access_token(
+            {**claims, "typ": REFRESH_TOKEN_TYPE, "jti": secrets.token_urlsafe(16)},
+            expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        ),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def _signing_key(token: str) -> Optional[str]:
+    """Clave con la que verificar el token según su cabecera kid (None si es desconocida)."""
+    kid = jwt.get_unverified_header(token).get("kid")
+    if kid is None:
+        return JWT_LEGACY_KEY  # Token emitido antes de la rotación de claves
+    return JWT_KEYS.get(kid)
+
+def decode_access_token(token: str, token_type: str = ACCESS_TOKEN_TYPE):
     """
     Decodifica un token JWT y maneja errores específicos.
     Lanza HTTPException si el token ha expirado,
-    de lo contrario devuelve el payload o None si hay otro error JWT.
+    de lo contrario devuelve el payload o None si hay otro error JWT
+    (firma, kid desconocido o tipo de token distinto de `token_type`).
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        key = _signing_key(token)
+        if key is None:
+            logger.debug("Token JWT con kid desconocido")
+            return None
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
+        # Los tokens antiguos no llevan "typ": solo pueden ser access tokens
+        if payload.get("typ", ACCESS_TOKEN_TYPE) != token_type:
+            return None
         return payload
     except ExpiredSignatureError:
         # Si el token ha expirado, lanzamos una excepción HTTP con un detalle específico
@@ -70,5 +236,9 @@ def decode_access_token(token: str):
     # Si ExpiredSignatureError no la captura, JWTError general lo hará.
     except JWTError as e: 
         # Para errores de firma o formato, o cualquier otro error JWT
-        print(f"DEBUG: Error JWT genérico inesperado: {e}") # Útil para depuración interna
-        return None
\ No newline at end of file
+        logger.debug("Error JWT genérico inesperado: %s", e) # Útil para depuración interna
+        return None
+
+def decode_refresh_token(token: str):
+    """Como decode_access_token, pero solo acepta refresh tokens."""
+    return decode_access_token(token, token_type=REFRESH_TOKEN_TYPE)
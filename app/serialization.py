@@ -0,0 +1,66 @@
+# app/serialization.py
+# Serialización directa de tareas a JSON, sin objetos ORM ni validación Pydantic.
+#
+# Las lecturas de tareas (listado, detalle y exportación) seleccionan solo las
+# columnas de schemas.Task como tuplas (crud.TASK_ROW_COLUMNS) y las codifican
+# aquí a bytes. Con response_model, FastAPI validaría cada fila con
+# from_attributes tras materializar los objetos ORM en la identity map; en
+# páginas grandes eso cuesta más que la propia consulta.
+#
+# La salida es idéntica byte a byte a la de FastAPI con response_model=schemas.Task:
+# mismas claves en el mismo orden, JSON compacto y UTF-8 sin escapar. Se usa
+# orjson si está instalado (`pip install orjson`) y si no, json de la biblioteca
+# estándar con las mismas opciones.
+
+import json
+from typing import Iterable
+
+from fastapi import Response
+
+try:
+    import orjson  # Dependencia opcional
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def dumps(obj) -> bytes:
+    """JSON compacto en UTF-8 (orjson o json con separadores compactos)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def task_dict(row) -> dict:
+    """
+    Fila (id, title, description, completed), en el orden de
+    crud.TASK_ROW_COLUMNS, como diccionario con las claves y el orden de
+    schemas.Task. Se desempaqueta por posición (más rápido que por nombre).
+    """
+    id, title, description, completed = row
+    return {"title": title, "description": description, "id": id, "completed": bool(completed)}
+
+
+def task_json(row) -> bytes:
+    return dumps(task_dict(row))
+
+
+def task_list_json(rows: Iterable) -> bytes:
+    return dumps([task_dict(row) for row in rows])
+
+
+def task_ndjson(rows: Iterable) -> bytes:
+    """Una tarea por línea (exportación NDJSON)."""
+    return b"".join(dumps(task_dict(row)) + b"\n" for row in rows)
+
+
+def json_response(content: bytes, response: Response, status_code: int = 200) -> Response:
+    """
+    Respuesta con el JSON ya codificado. Copia las cabeceras del `response`
+    inyectado en la ruta (ETag, X-Next-Cursor, RateLimit-*), que FastAPI solo
+    añade cuando la ruta no devuelve su propia Response.
+    """
+    respuesta = Response(content=content, status_code=status_code, media_type=JSON_MEDIA_TYPE)
+    respuesta.headers.raw.extend(response.headers.raw)
+    return respuesta
@@ -0,0 +1,168 @@
+# app/sharding.py
+# Reparto de las tareas entre varias bases de datos (shards) por owner_id.
+#
+# - El shard 0 es DATABASE_URL y los shards 1..N-1, DATABASE_SHARD_URLS. El
+#   shard 0 guarda además la tabla users completa (registro y login) y la tabla
+#   user_shards con los usuarios que se han movido de shard.
+# - Cada usuario vive entero en un shard: sus tareas, sus claves de
+#   idempotencia y una copia mínima de su fila de users (id y username), en la
+#   que se actualizan tasks_version, tasks_total y tasks_completed en la misma
+#   transacción que sus tareas. Todas las consultas de tareas van acotadas por
+#   owner_id, así que ninguna necesita más de un shard.
+# - ShardMap decide el shard de cada usuario: primero user_shards (cada worker
+#   la recarga cada SHARD_MAP_REFRESH_SECONDS) y si no está, la estrategia:
+#     range: SHARD_RANGES es el primer owner_id de cada shard a partir del 1
+#            (ej. "500000,1000000"); los usuarios existentes siguen en el 0.
+#     hash:  owner_id % N. Solo para bases de datos nuevas: cambiar N reparte
+#            de nuevo a casi todos los usuarios.
+# - rebalance_shards.py mueve a un usuario de shard por lotes. Mientras tanto
+#   sus peticiones de tareas responden 503 (ShardMovingError).
+# - Los IDs de las tareas son únicos entre shards, así que un movimiento los
+#   conserva (URLs, cursores y ETag siguen valiendo). Salen de la secuencia
+#   "tasks" de la tabla id_sequences del shard 0: cada proceso reserva bloques
+#   de SHARD_TASK_ID_BLOCK IDs (IdAllocator) y los reparte sin consultar la BBDD.
+#   Los IDs que no llega a usar un proceso se pierden (huecos en la numeración).
+#
+# Sin DATABASE_SHARD_URLS hay un único shard (DATABASE_URL) y nada cambia.
+
+import bisect
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from . import logs
+
+load_dotenv()
+
+# URLs de los shards 1..N-1 separadas por comas (mismo driver que DATABASE_URL)
+DATABASE_SHARD_URLS = [u.strip() for u in os.getenv("DATABASE_SHARD_URLS", "").split(",") if u.strip()]
+# "range" (por defecto) o "hash"
+SHARD_STRATEGY = os.getenv("SHARD_STRATEGY", "range").lower()
+# Primer owner_id de cada shard a partir del 1 (estrategia "range")
+SHARD_RANGES = [int(v) for v in os.getenv("SHARD_RANGES", "").split(",") if v.strip()]
+# Segundos entre recargas de user_shards en cada worker
+SHARD_MAP_REFRESH_SECONDS = float(os.getenv("SHARD_MAP_REFRESH_SECONDS", "5"))
+# IDs de tareas que reserva cada proceso de una vez en la secuencia del shard 0
+SHARD_TASK_ID_BLOCK = int(os.getenv("SHARD_TASK_ID_BLOCK", "1000"))
+
+logger = logs.get_logger(__name__)
+
+
+class ShardMovingError(Exception):
+    """Las tareas del usuario se están moviendo de shard (rebalance_shards.py)."""
+
+
+class ShardMap:
+    """
+    owner_id -> índice del shard. `loader` devuelve las filas de user_shards
+    como tuplas (owner_id, shard, moving); sin loader solo se usa la estrategia.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        strategy: str = SHARD_STRATEGY,
+        ranges: Optional[List[int]] = None,
+        loader: Optional[Callable[[], Iterable[Tuple[int, int, bool]]]] = None,
+    ):
+        ranges = list(SHARD_RANGES if ranges is None else ranges)
+        if strategy not in ("range", "hash"):
+            raise ValueError(f"SHARD_STRATEGY desconocida: {strategy!r} (range o hash)")
+        if count > 1 and strategy == "range":
+            if len(ranges) != count - 1:
+                raise ValueError(
+                    f"SHARD_RANGES debe tener {count - 1} valores (primer owner_id de los shards 1..{count - 1})"
+                )
+            if ranges != sorted(set(ranges)):
+                raise ValueError("SHARD_RANGES debe ser creciente")
+        self.count = count
+        self.strategy = strategy
+        self.ranges = ranges
+        self._loader = loader
+        # Usuarios movidos: owner_id -> (shard, moving). Se sustituye entero al recargar
+        self._assigned: Dict[int, Tuple[int, bool]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def default_shard(self, owner_id: int) -> int:
+        """Shard según la estrategia, sin tener en cuenta user_shards."""
+        if self.count == 1:
+            return 0
+        if self.strategy == "hash":
+            return owner_id % self.count
+        return bisect.bisect_right(self.ranges, owner_id)
+
+    def shard_for(self, owner_id: int) -> int:
+        """Shard del usuario. Lanza ShardMovingError si se está moviendo."""
+        asignado = self._assigned.get(owner_id)
+        if asignado is None:
+            return self.default_shard(owner_id)
+        shard, moving = asignado
+        if moving:
+            raise ShardMovingError(owner_id)
+        return shard
+
+    def load(self) -> None:
+        """Recarga user_shards; si falla se mantiene el mapa anterior."""
+        if self._loader is None or self.count == 1:
+            return
+        try:
+            self._assigned = {owner_id: (shard, bool(moving)) for owner_id, shard, moving in self._loader()}
+        except Exception:
+            logger.warning("No se pudo recargar el mapa de shards", exc_info=True)
+
+    def start(self, interval: float = SHARD_MAP_REFRESH_SECONDS) -> None:
+        """Carga el mapa y arranca el hilo que lo recarga (una vez por proceso)."""
+        if self.count == 1 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self.load()
+        self._stop.clear()
+
+        def bucle():
+            while not self._stop.wait(interval):
+                self.load()
+
+        self._thread = threading.Thread(target=bucle, name="shard-map", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class IdAllocator:
+    """
+    Reparte IDs únicos entre procesos por bloques (hi/lo). `reserve(n)` reserva
+    n IDs consecutivos en la secuencia compartida y devuelve el primero.
+    """
+
+    def __init__(self, reserve: Callable[[int], int], block_size: int = SHARD_TASK_ID_BLOCK):
+        self._reserve = reserve
+        self.block_size = max(block_size, 1)
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+
+    def take(self, count: int) -> List[int]:
+        """`count` IDs nuevos. Reserva un bloque en la BBDD si no quedan suficientes."""
+        with self._lock:
+            if self._end - self._next < count:
+                # Lo que quede del bloque actual se descarta: los IDs de un lote son consecutivos
+                tamaño = max(count, self.block_size)
+                self._next = self._reserve(tamaño)
+                self._end = self._next + tamaño
+            inicio = self._next
+            self._next += count
+        return list(range(inicio, inicio + count))
+
+    async def take_async(self, count: int) -> List[int]:
+        """take() sin bloquear el event loop cuando hay que reservar un bloque."""
+        if self._end - self._next >= count:
+            return self.take(count)
+        return await run_in_threadpool(self.take, count)
+
+    def reset(self) -> None:
+        """Olvida el bloque actual (en el hijo de un fork: no puede compartirlo con el padre)."""
+        with self._lock:
+            self._next = self._end = 0
@@ -0,0 +1,271 @@
+# benchmarks/bench_api.py
+# Benchmark de carga de la API: latencia p50/p95/p99 y peticiones/segundo de
+# login, listado (primera página y páginas profundas), get, create, update y delete.
+#
+# Modos:
+# - inprocess: la app de app/main.py dentro del propio proceso (httpx + ASGI),
+#   sin red ni servidor. Mide el coste de FastAPI + crud + base de datos.
+# - uvicorn: un servidor uvicorn real en un subproceso, atacado por HTTP local.
+#
+# Por defecto usa una base de datos SQLite temporal sembrada al empezar; con
+# --database-url se puede usar un MySQL local (se reutilizan los usuarios
+# bench* que ya existan).
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_api --mode inprocess uvicorn --requests 500 --concurrency 16
+#   python -m benchmarks.compare benchmarks/results/api-<antes>.json benchmarks/results/api-<despues>.json
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import metadata, summarize, write_results
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "bench-password"
+PAGE = 20
+SCENARIOS = ["login", "list_shallow", "list_deep_offset", "list_deep_cursor", "get", "create", "update", "delete"]
+
+
+# --- Datos de prueba ---
+def seed(users: int, tasks_per_user: int) -> dict:
+    """Crea los usuarios bench<N> con sus tareas. Devuelve {username: [ids de tareas]}."""
+    from sqlalchemy import insert, select
+    from app import database, hashing, models
+
+    database.Base.metadata.create_all(bind=database.engine)
+    # El mismo hash para todos: sembrar no debe costar un bcrypt por usuario
+    hashed = hashing.pwd_context.hash(PASSWORD)
+    ids = {}
+    with database.SessionLocal() as db:
+        for n in range(users):
+            username = f"bench{n}"
+            user = db.execute(select(models.User).where(models.User.username == username)).scalar_one_or_none()
+            if user is None:
+                # Los contadores de GET /tasks/stats se mantienen en las escrituras
+                # de la API; al insertar directamente hay que fijarlos aquí
+                user = models.User(
+                    username=username, hashed_password=hashed,
+                    tasks_total=tasks_per_user, tasks_completed=(tasks_per_user + 2) // 3,
+                )
+                db.add(user)
+                db.flush()
+                filas = [
+                    {
+                        "title": f"Tarea {i}",
+                        "description": f"Descripción de la tarea {i} del usuario {username}",
+                        "completed": i % 3 == 0,
+                        "owner_id": user.id,
+                    }
+                    for i in range(tasks_per_user)
+                ]
+                for inicio in range(0, len(filas), 1000):
+                    db.execute(insert(models.Task), filas[inicio:inicio + 1000])
+            ids[username] = list(db.execute(
+                select(models.Task.id).where(models.Task.owner_id == user.id).order_by(models.Task.id)
+            ).scalars())
+        db.commit()
+    return ids
+
+
+# --- Escenarios ---
+def build_requests(nombre: str, n: int, tokens: dict, ids: dict, creadas: list, rnd: random.Random):
+    """Genera n peticiones (método, url, kwargs) del escenario, repartidas entre usuarios."""
+    from app.pagination import encode_cursor
+
+    usuarios = list(tokens)
+    for i in range(n):
+        username = usuarios[i % len(usuarios)]
+        auth = {"headers": {"Authorization": f"Bearer {tokens[username]}"}}
+        propias = ids[username]
+        if nombre == "login":
+            yield "POST", "/auth/token", {"data": {"username": username, "password": PASSWORD}}
+        elif nombre == "list_shallow":
+            yield "GET", f"/tasks/?limit={PAGE}", auth
+        elif nombre == "list_deep_offset":
+            yield "GET", f"/tasks/?skip={max(len(propias) - PAGE, 0)}&limit={PAGE}", auth
+        elif nombre == "list_deep_cursor":
+            desde = propias[-PAGE - 1] if len(propias) > PAGE else 0
+            yield "GET", f"/tasks/?cursor={encode_cursor(desde)}&limit={PAGE}", auth
+        elif nombre == "get":
+            yield "GET", f"/tasks/{rnd.choice(propias)}", auth
+        elif nombre == "create":
+            yield "POST", "/tasks/", {**auth, "json": {"title": f"Nueva {i}", "description": "Creada por el benchmark"}}
+        elif nombre == "update":
+            yield "PUT", f"/tasks/{rnd.choice(propias)}", {**auth, "json": {"title": f"Editada {i}", "description": None}}
+        elif nombre == "delete":
+            # Se borran las tareas creadas en el escenario create (los datos sembrados no cambian)
+            if not creadas:
+                return
+            owner, task_id = creadas.pop()
+            yield "DELETE", f"/tasks/{task_id}", {"headers": {"Authorization": f"Bearer {tokens[owner]}"}}
+
+
+async def run_scenario(cliente, peticiones, concurrencia: int, on_response=None) -> dict:
+    """Ejecuta las peticiones con `concurrencia` clientes simultáneos y resume las latencias."""
+    latencias = []
+    errores = 0
+    codigos = {}
+    pendientes = iter(peticiones)
+
+    async def cliente_virtual():
+        nonlocal errores
+        for metodo, url, kwargs in pendientes:
+            inicio = time.perf_counter()
+            respuesta = await cliente.request(metodo, url, **kwargs)
+            latencias.append(time.perf_counter() - inicio)
+            codigos[respuesta.status_code] = codigos.get(respuesta.status_code, 0) + 1
+            if respuesta.status_code >= 400:
+                errores += 1
+            elif on_response is not None:
+                on_response(kwargs, respuesta)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente_virtual() for _ in range(concurrencia)))
+    resumen = summarize(latencias, time.perf_counter() - inicio, errores)
+    # Códigos de respuesta: ej. los 503 del login cuando se supera PASSWORD_HASH_QUEUE_LIMIT
+    resumen["status_codes"] = {str(c): n for c, n in sorted(codigos.items())}
+    return resumen
+
+
+async def run_suite(cliente, args, ids: dict) -> dict:
+    rnd = random.Random(args.seed)
+    tokens = {}
+    for username in ids:
+        r = await cliente.post("/auth/token", data={"username": username, "password": PASSWORD})
+        r.raise_for_status()
+        tokens[username] = r.json()["access_token"]
+
+    # Calentamiento: conexiones del pool, caché de usuarios, procesos de bcrypt...
+    for metodo, url, kwargs in build_requests("list_shallow", args.warmup, tokens, ids, [], rnd):
+        await cliente.request(metodo, url, **kwargs)
+
+    creadas = []
+    token_owner = {f"Bearer {t}": u for u, t in tokens.items()}
+
+    def guardar_creada(kwargs, respuesta):
+        creadas.append((token_owner[kwargs["headers"]["Authorization"]], respuesta.json()["id"]))
+
+    resultados = {}
+    for nombre in args.scenarios:
+        n = args.login_requests if nombre == "login" else args.requests
+        peticiones = build_requests(nombre, n, tokens, ids, creadas, rnd)
+        resultados[nombre] = await run_scenario(
+            cliente, peticiones, args.concurrency,
+            on_response=guardar_creada if nombre == "create" else None,
+        )
+        r = resultados[nombre]
+        print(f"  {nombre:<18} {r['rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.2f} ms  "
+              f"p95 {r['p95_ms']:>8.2f} ms  p99 {r['p99_ms']:>8.2f} ms  errores {r['errors']}",
+              file=sys.stderr)
+    return resultados
+
+
+# --- Modos ---
+async def bench_inprocess(args, ids: dict) -> dict:
+    import httpx
+    from app import hashing
+    from app.main import app
+
+    transporte = httpx.ASGITransport(app=app)
+    # Los print() de las rutas se descartan para no mezclarlos con la salida del benchmark
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+            resultados = await run_suite(cliente, args, ids)
+    hashing.shutdown()
+    return resultados
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def bench_uvicorn(args, ids: dict) -> dict:
+    import httpx
+
+    port = _free_port()
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.server_workers), "--log-level", "warning", "--no-access-log"],
+        cwd=PROJECT_ROOT, env=os.environ.copy(), stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    limites = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limites, timeout=60) as cliente:
+            limite = time.monotonic() + 30
+            while True:
+                try:
+                    if (await cliente.get("/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if servidor.poll() is not None or time.monotonic() > limite:
+                    raise RuntimeError("uvicorn no ha arrancado")
+                await asyncio.sleep(0.1)
+            return await run_suite(cliente, args, ids)
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia y req/s de la API de tareas")
+    parser.add_argument("--mode", nargs="+", choices=["inprocess", "uvicorn"], default=["inprocess", "uvicorn"])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--database-url", default=None,
+                        help="Por defecto, un SQLite temporal nuevo en cada ejecución")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--tasks-per-user", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones por escenario")
+    parser.add_argument("--login-requests", type=int, default=50, help="Peticiones del escenario login (bcrypt)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--server-workers", type=int, default=1, help="Workers de uvicorn en modo uvicorn")
+    parser.add_argument("--bcrypt-rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", "12")))
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="Mantener el rate limit (por defecto se desactiva para medir la API)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None,
+                        help="Fichero JSON de resultados ('-' = stdout). Por defecto benchmarks/results/api-<commit>.json")
+    args = parser.parse_args()
+
+    temporal = None
+    if args.database_url is None:
+        temporal = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+        args.database_url = f"sqlite:///{temporal}"
+    # La configuración de la app se lee al importar: se fija antes (y la hereda uvicorn)
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("SQLALCHEMY_ECHO", "False")
+    # La API no arranca sin clave de firma: una aleatoria basta para la prueba
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))
+    if not args.rate_limit:
+        os.environ["RATE_LIMIT_ENABLED"] = "False"
+
+    try:
+        ids = seed(args.users, args.tasks_per_user)
+        resultados = {}
+        for modo in args.mode:
+            print(f"Modo {modo}:", file=sys.stderr)
+            bench = bench_inprocess if modo == "inprocess" else bench_uvicorn
+            resultados[modo] = asyncio.run(bench(args, ids))
+    finally:
+        if temporal:
+            os.unlink(temporal)
+
+    write_results("api", {"benchmark": "api", "meta": metadata(args), "results": resultados}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/bench_hashing.py
+# Mide el rendimiento del login (verificación bcrypt) en logins/segundo y por núcleo,
+# usando el pool de procesos de app/hashing.py con distinto número de workers.
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_hashing --workers 1 2 4 --logins 200 --rounds 12
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def medir(workers: int, logins: int, concurrencia: int, rounds: int) -> dict:
+    # La configuración de app.hashing se lee al importar, por eso se fija antes
+    os.environ["PASSWORD_HASH_WORKERS"] = str(workers)
+    os.environ["PASSWORD_HASH_QUEUE_LIMIT"] = str(max(concurrencia, 1))
+    os.environ["BCRYPT_ROUNDS"] = str(rounds)
+    import importlib
+    from app import hashing
+    hashing = importlib.reload(hashing)
+
+    hash_guardado = hashing.pwd_context.hash("secret123")
+    # Calentamiento: arranca los procesos del pool
+    with ThreadPoolExecutor(max_workers=concurrencia) as hilos:
+        list(hilos.map(lambda _: hashing.verify_password("secret123", hash_guardado), range(max(workers, 1))))
+
+        inicio = time.perf_counter()
+        resultados = list(hilos.map(lambda _: hashing.verify_password("secret123", hash_guardado), range(logins)))
+        duracion = time.perf_counter() - inicio
+
+    hashing.shutdown()
+    assert all(resultados)
+    # Núcleos realmente usados: no más procesos que CPUs disponibles
+    nucleos = min(max(workers, 1), os.cpu_count() or 1)
+    return {
+        "workers": workers,
+        "rounds": rounds,
+        "logins": logins,
+        "seconds": round(duracion, 4),
+        "logins_per_sec": round(logins / duracion, 2),
+        "logins_per_sec_per_core": round(logins / duracion / nucleos, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de logins/seg del hashing de contraseñas")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, os.cpu_count() or 1],
+                        help="Tamaños del pool de procesos a probar (0 = en el propio hilo)")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=(os.cpu_count() or 1) * 2)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    resultados = [medir(w, args.logins, args.concurrency, args.rounds) for w in args.workers]
+    print(json.dumps({"benchmark": "password_hashing", "cpu_count": os.cpu_count(), "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/bench_micro.py
+# Micro-benchmarks de las piezas que se ejecutan en cada petición autenticada:
+# codificar/decodificar el JWT y serializar las tareas, con los esquemas Pydantic
+# (objetos ORM + response_model) y con la serialización directa de tuplas de
+# app/serialization.py. Los casos task_list_query_* incluyen además la consulta
+# sobre un SQLite en memoria, para comparar el coste completo por fila. No usa red.
+#
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.bench_micro --tasks 100 --repeat 5
+
+import argparse
+import json
+import sys
+import time
+from datetime import timedelta
+from typing import List
+
+from .common import metadata, summarize, write_results
+
+
+def medir(funcion, iteraciones: int, repeticiones: int) -> dict:
+    """
+    Ejecuta `funcion` en `repeticiones` tandas de `iteraciones` llamadas.
+    Las latencias p50/p95/p99 son las de cada llamada (media de su tanda).
+    """
+    funcion()  # Calentamiento
+    por_llamada = []
+    total = 0.0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        duracion = time.perf_counter() - inicio
+        total += duracion
+        por_llamada.extend([duracion / iteraciones] * iteraciones)
+    resumen = summarize(por_llamada, total)
+    resumen["ops_per_sec"] = resumen.pop("rps")
+    resumen["calls"] = resumen.pop("requests")
+    del resumen["errors"]
+    return resumen
+
+
+def casos(n_tareas: int) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from app import crud, models, schemas, security, serialization
+    from app.database import Base
+    from app.pagination import decode_cursor, encode_cursor
+
+    token = security.create_access_token({"sub": "bench0"}, expires_delta=timedelta(minutes=30))
+    orm = [
+        models.Task(id=i, title=f"Tarea {i}", description=f"Descripción de la tarea {i}",
+                    completed=i % 3 == 0, owner_id=1)
+        for i in range(1, n_tareas + 1)
+    ]
+    validadas = [schemas.Task.model_validate(t) for t in orm]
+    lista = TypeAdapter(List[schemas.Task])
+    cursor = encode_cursor(n_tareas)
+
+    # Misma página leída de la base de datos: objetos ORM (antes) o tuplas (ahora)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as db:
+        db.add(models.User(id=1, username="bench0", hashed_password="x"))
+        db.add_all(orm)
+        db.commit()
+    sesion = Session(engine)
+    filas = crud.get_task_rows_by_owner(sesion, 1, limit=n_tareas)
+
+    def consulta_orm():
+        tareas = sesion.scalars(crud.tasks_by_owner_query(1, limit=n_tareas, dialect_name="sqlite")).all()
+        respuesta = lista.dump_json(lista.validate_python(tareas, from_attributes=True))
+        sesion.expunge_all()
+        return respuesta
+
+    def consulta_filas():
+        return serialization.task_list_json(crud.get_task_rows_by_owner(sesion, 1, limit=n_tareas))
+
+    return {
+        "jwt_encode": lambda: security.create_access_token({"sub": "bench0"}, expires_delta=timedelta(minutes=30)),
+        "jwt_decode": lambda: security.decode_access_token(token),
+        "task_validate_orm": lambda: schemas.Task.model_validate(orm[0]),
+        f"task_list_validate_orm_{n_tareas}": lambda: [schemas.Task.model_validate(t) for t in orm],
+        f"task_list_dump_json_{n_tareas}": lambda: lista.dump_json(validadas),
+        # Lo que hace FastAPI con un response_model: validar, jsonable_encoder y json.dumps
+        f"task_list_response_{n_tareas}": lambda: json.dumps(
+            jsonable_encoder(lista.validate_python(orm, from_attributes=True))
+        ).encode(),
+        # Camino actual de FastAPI con response_model (validar y dump_json en Rust)
+        f"task_list_validate_dump_json_{n_tareas}": lambda: lista.dump_json(
+            lista.validate_python(orm, from_attributes=True)
+        ),
+        # Serialización directa de tuplas (app/serialization.py)
+        f"task_list_rows_json_{n_tareas}": lambda: serialization.task_list_json(filas),
+        f"task_list_query_orm_{n_tareas}": consulta_orm,
+        f"task_list_query_rows_{n_tareas}": consulta_filas,
+        "cursor_encode": lambda: encode_cursor(n_tareas),
+        "cursor_decode": lambda: decode_cursor(cursor),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de JWT y serialización de esquemas")
+    parser.add_argument("--tasks", type=int, default=100, help="Tamaño de la lista en los casos de listas")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None,
+                        help="Fichero JSON de resultados ('-' = stdout). Por defecto benchmarks/results/micro-<commit>.json")
+    args = parser.parse_args()
+
+    resultados = {}
+    for nombre, funcion in casos(args.tasks).items():
+        # Las listas son mucho más lentas: menos llamadas para un tiempo parecido
+        iteraciones = max(args.iterations // args.tasks, 10) if "list" in nombre else args.iterations
+        resultados[nombre] = medir(funcion, iteraciones, args.repeat)
+        r = resultados[nombre]
+        if "list" in nombre:
+            r["per_row_us"] = round(r["p50_ms"] * 1000 / args.tasks, 3)
+        print(f"  {nombre:<36} {r['ops_per_sec']:>12.1f} ops/s  p50 {r['p50_ms'] * 1000:>10.2f} µs"
+              + (f"  ({r['per_row_us']:.3f} µs/fila)" if "per_row_us" in r else ""),
+              file=sys.stderr)
+
+    write_results("micro", {"benchmark": "micro", "meta": metadata(args), "results": resultados}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/common.py
+# Utilidades compartidas por los benchmarks: estadísticas de latencia,
+# metadatos del entorno y escritura de resultados en JSON.
+#
+# Los resultados incluyen el commit de git para poder comparar dos ejecuciones
+# con `python -m benchmarks.compare antes.json despues.json`.
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(ordenados: List[float], p: float) -> float:
+    """Percentil p (0-100) con interpolación lineal sobre una lista ya ordenada."""
+    if not ordenados:
+        return 0.0
+    k = (len(ordenados) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(ordenados) - 1)
+    return ordenados[f] + (ordenados[c] - ordenados[f]) * (k - f)
+
+
+def summarize(latencias: List[float], segundos: float, errores: int = 0) -> dict:
+    """Resumen de una serie de latencias (en segundos): p50/p95/p99 en ms y req/s."""
+    ordenadas = sorted(latencias)
+    total = len(ordenadas)
+    return {
+        "requests": total,
+        "errors": errores,
+        "seconds": round(segundos, 4),
+        "rps": round(total / segundos, 2) if segundos else 0.0,
+        "mean_ms": round(sum(ordenadas) / total * 1000, 3) if total else 0.0,
+        "p50_ms": round(percentile(ordenadas, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordenadas, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordenadas, 99) * 1000, 3),
+        "max_ms": round(ordenadas[-1] * 1000, 3) if total else 0.0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        salida = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        return salida.stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args) -> dict:
+    """Entorno de la ejecución, para saber si dos resultados son comparables."""
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def write_results(nombre: str, resultado: dict, output: Optional[str]) -> str:
+    """
+    Escribe el resultado en `output` o, si no se indica, en
+    benchmarks/results/<nombre>-<commit>.json. Devuelve la ruta.
+    """
+    if output == "-":
+        json.dump(resultado, sys.stdout, indent=2)
+        print()
+        return output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{nombre}-{resultado['meta']['commit'] or 'local'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2)
+        f.write("\n")
+    print(f"Resultados escritos en {output}", file=sys.stderr)
+    return output
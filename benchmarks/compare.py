@@ -0,0 +1,49 @@
+# benchmarks/compare.py
+# Compara dos ficheros de resultados de bench_api / bench_micro (ej. de dos
+# commits) y muestra la variación de cada métrica.
+#
+# Uso:
+#   python -m benchmarks.compare benchmarks/results/api-abc123.json benchmarks/results/api-def456.json
+
+import argparse
+import json
+
+# Métricas que se comparan; en las de latencia, bajar es mejorar
+METRICS = ["rps", "ops_per_sec", "p50_ms", "p95_ms", "p99_ms"]
+
+
+def _hojas(resultados: dict, prefijo=()):
+    """Recorre {modo: {escenario: métricas}} o {caso: métricas} hasta las métricas."""
+    for clave, valor in resultados.items():
+        if isinstance(valor, dict) and not any(m in valor for m in METRICS):
+            yield from _hojas(valor, prefijo + (clave,))
+        elif isinstance(valor, dict):
+            yield "/".join(prefijo + (clave,)), valor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dos resultados de benchmarks")
+    parser.add_argument("antes")
+    parser.add_argument("despues")
+    args = parser.parse_args()
+
+    with open(args.antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(args.despues, encoding="utf-8") as f:
+        despues = json.load(f)
+
+    print(f"{antes['meta'].get('commit')} -> {despues['meta'].get('commit')}")
+    previos = dict(_hojas(antes["results"]))
+    for nombre, metricas in _hojas(despues["results"]):
+        if nombre not in previos:
+            continue
+        partes = []
+        for m in METRICS:
+            if m in metricas and previos[nombre].get(m):
+                cambio = (metricas[m] - previos[nombre][m]) / previos[nombre][m] * 100
+                partes.append(f"{m} {previos[nombre][m]:g} -> {metricas[m]:g} ({cambio:+.1f}%)")
+        print(f"{nombre:<36} " + "  ".join(partes))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,24 @@
 # create_db_tables.py (en la raíz del proyecto)
 
-from app.database import engine, Base
+from sqlalchemy import func, select
+
+from app.database import SessionLocal, shard_engines, Base
+from app import crud
 import app.models # Asegúrate de que este import esté presente para que Base.metadata "vea" todos los modelos
 
-print("Creando tablas en la base de datos...")
-Base.metadata.create_all(bind=engine) # Esto creará TODAS las tablas que heredan de Base
-print("Tablas creadas exitosamente.")
\ No newline at end of file
+# Con DATABASE_SHARD_URLS se crean en todos los shards (el 0 es DATABASE_URL)
+for i, shard_engine in enumerate(shard_engines):
+    print(f"Creando tablas en la base de datos (shard {i})...")
+    Base.metadata.create_all(bind=shard_engine) # Esto creará TODAS las tablas que heredan de Base
+print("Tablas creadas exitosamente.")
+
+# Con varios shards los IDs de las tareas salen de la secuencia "tasks" del
+# shard 0 (ver app/sharding.py), que empieza tras el mayor ID de cualquier shard
+if len(shard_engines) > 1:
+    maximo = 0
+    for shard_engine in shard_engines:
+        with SessionLocal(bind=shard_engine) as db:
+            maximo = max(maximo, db.scalar(select(func.max(app.models.Task.id))) or 0)
+    with SessionLocal() as db:
+        if crud.init_id_sequence(db, "tasks", maximo + 1):
+            print(f"Secuencia de IDs de tareas creada (empieza en {maximo + 1}).")
@@ -0,0 +1,30 @@
+# purge_idempotency_keys.py (en la raíz del proyecto)
+# Borra de la tabla idempotency_keys las claves caducadas (más antiguas que
+# IDEMPOTENCY_TTL_SECONDS, ver app/idempotency.py). La API ya ignora las
+# caducadas; esto solo libera espacio. Es seguro ejecutarlo con la API en
+# marcha, por ejemplo desde cron una vez al día.
+#
+# Uso:
+#   python purge_idempotency_keys.py --batch-size 1000
+
+import argparse
+from datetime import timedelta
+
+from app.database import SessionLocal, shard_engines
+from app import crud, idempotency
+
+parser = argparse.ArgumentParser(description="Borra las claves de idempotencia caducadas")
+parser.add_argument("--batch-size", type=int, default=1000, help="Claves por lote (un commit por lote)")
+args = parser.parse_args()
+
+limite = idempotency._utcnow() - timedelta(seconds=idempotency.IDEMPOTENCY_TTL_SECONDS)
+# Con DATABASE_SHARD_URLS se purgan en cada shard (cada uno guarda las claves
+# de sus usuarios, ver app/sharding.py)
+for i, shard_engine in enumerate(shard_engines):
+    print(f"Borrando claves de idempotencia anteriores a {limite:%Y-%m-%d %H:%M:%S} (UTC) (shard {i})...")
+    db = SessionLocal(bind=shard_engine)
+    try:
+        borradas = crud.purge_idempotency_keys(db, before=limite, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"Claves borradas: {borradas}")
@@ -0,0 +1,131 @@
+# rebalance_shards.py (en la raíz del proyecto)
+# Mueve las tareas de un usuario a otro shard (ver app/sharding.py), por lotes.
+#
+# 1. Marca al usuario como "moving" en user_shards (shard 0) y espera a que
+#    todos los workers recarguen el mapa: desde ese momento sus peticiones de
+#    tareas responden 503 con Retry-After y nadie escribe en el origen.
+# 2. Crea la copia mínima del usuario en el destino, borra lo que hubiera dejado
+#    una ejecución interrumpida y copia sus tareas (con sus mismos IDs, únicos
+#    entre shards) y sus claves de idempotencia por lotes (un commit por lote).
+#    La versión (ETag) se conserva: URLs, cursores y ETag siguen valiendo.
+# 3. Apunta al usuario al destino, espera de nuevo a los workers y borra sus
+#    tareas y claves de idempotencia del origen por lotes.
+#
+# Las esperas nunca bajan de SHARD_MAP_REFRESH_SECONDS + WAIT_MARGIN_SECONDS:
+# con menos, un worker que aún no ha recargado el mapa podría escribir en el
+# origen después de copiar (y esa escritura se perdería al borrar el origen).
+# SHARD_MAP_REFRESH_SECONDS debe ser el mismo que el de los workers.
+#
+# Si se interrumpe, el usuario queda en "moving" (503) hasta que se vuelve a
+# ejecutar el mismo comando, que retoma el movimiento desde el principio.
+#
+# Uso:
+#   python rebalance_shards.py --status
+#   python rebalance_shards.py --user-id 42 --to-shard 1 --batch-size 1000
+
+import argparse
+import sys
+import time
+
+from sqlalchemy import func, select
+
+from app import crud, models, sharding
+from app.database import SessionLocal, shard_engines, shard_map
+
+# Margen sobre SHARD_MAP_REFRESH_SECONDS: lo que tarda la recarga del mapa en
+# un worker y una petición ya en curso cuando se recargó
+WAIT_MARGIN_SECONDS = 5.0
+
+parser = argparse.ArgumentParser(description="Mueve las tareas de un usuario a otro shard")
+parser.add_argument("--status", action="store_true", help="Muestra usuarios y tareas de cada shard")
+parser.add_argument("--user-id", type=int, help="Usuario a mover")
+parser.add_argument("--to-shard", type=int, help="Shard de destino (0 = DATABASE_URL)")
+parser.add_argument("--batch-size", type=int, default=1000, help="Tareas por lote (un commit por lote)")
+parser.add_argument(
+    "--wait", type=float, default=2 * sharding.SHARD_MAP_REFRESH_SECONDS,
+    help="Segundos de espera para que los workers recarguen el mapa (por defecto 2 x SHARD_MAP_REFRESH_SECONDS; "
+         "mínimo SHARD_MAP_REFRESH_SECONDS + WAIT_MARGIN_SECONDS)",
+)
+args = parser.parse_args()
+
+
+def sesion(shard: int):
+    return SessionLocal(bind=shard_engines[shard])
+
+
+if args.status:
+    db = sesion(0)
+    try:
+        movidos = crud.get_user_shards(db)
+    finally:
+        db.close()
+    print(f"Shards: {len(shard_engines)} (estrategia {shard_map.strategy})")
+    for i in range(len(shard_engines)):
+        db = sesion(i)
+        try:
+            usuarios, tareas = db.execute(
+                select(func.count(func.distinct(models.Task.owner_id)), func.count()).select_from(models.Task)
+            ).one()
+        finally:
+            db.close()
+        print(f"  shard {i}: {usuarios} usuarios con tareas, {tareas} tareas")
+    print(f"Usuarios movidos: {len(movidos)}; en movimiento: {[m[0] for m in movidos if m[2]]}")
+    sys.exit(0)
+
+if args.user_id is None or args.to_shard is None:
+    parser.error("indica --status o bien --user-id y --to-shard")
+if not 0 <= args.to_shard < len(shard_engines):
+    parser.error(f"--to-shard debe estar entre 0 y {len(shard_engines) - 1}")
+
+owner_id, destino = args.user_id, args.to_shard
+espera_minima = sharding.SHARD_MAP_REFRESH_SECONDS + WAIT_MARGIN_SECONDS
+if args.wait < espera_minima:
+    print(f"--wait {args.wait:g} es menor que el mínimo; se esperan {espera_minima:g} s")
+    args.wait = espera_minima
+
+directorio = sesion(0)
+try:
+    usuario = crud.get_user(directorio, owner_id)
+    if usuario is None:
+        sys.exit(f"El usuario {owner_id} no existe")
+    asignado = directorio.get(models.UserShard, owner_id)
+    # Un movimiento interrumpido conserva su origen en user_shards
+    origen = asignado.shard if asignado is not None else shard_map.default_shard(owner_id)
+    if origen == destino:
+        if asignado is not None and asignado.moving:
+            crud.set_user_shard(directorio, owner_id, origen, moving=False)
+        print(f"El usuario {owner_id} ya está en el shard {destino}")
+        sys.exit(0)
+
+    print(f"Moviendo al usuario {owner_id} ({usuario.username}) del shard {origen} al {destino}...")
+    crud.set_user_shard(directorio, owner_id, origen, moving=True)
+    print(f"  Marcado como en movimiento; esperando {args.wait:g} s a que los workers lo vean...")
+    time.sleep(args.wait)
+
+    fuente, objetivo = sesion(origen), sesion(destino)
+    try:
+        if destino != 0:
+            crud.create_shard_user(objetivo, owner_id, usuario.username)
+        restos = crud.delete_user_tasks(objetivo, owner_id, batch_size=args.batch_size)
+        if restos:
+            print(f"  Borradas {restos} tareas de una ejecución anterior en el destino")
+        copiadas = crud.copy_user_tasks(fuente, objetivo, owner_id, batch_size=args.batch_size)
+        claves = crud.copy_user_idempotency_keys(fuente, objetivo, owner_id, batch_size=args.batch_size)
+        print(f"  Copiadas {copiadas} tareas y {claves} claves de idempotencia")
+
+        # El usuario pasa al destino (sin fila si es el shard de su estrategia)
+        if destino == shard_map.default_shard(owner_id):
+            crud.delete_user_shard(directorio, owner_id)
+        else:
+            crud.set_user_shard(directorio, owner_id, destino, moving=False)
+        print(f"  Usuario apuntado al shard {destino}; esperando {args.wait:g} s antes de borrar el origen...")
+        time.sleep(args.wait)
+
+        borradas = crud.delete_user_tasks(fuente, owner_id, batch_size=args.batch_size)
+        print(f"  Borradas {borradas} tareas del shard {origen}")
+    finally:
+        fuente.close()
+        objetivo.close()
+finally:
+    directorio.close()
+print("Movimiento completado.")
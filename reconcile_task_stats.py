@@ -0,0 +1,41 @@
+# reconcile_task_stats.py (en la raíz del proyecto)
+# Recalcula los contadores de tareas de cada usuario (users.tasks_total y
+# users.tasks_completed, usados por GET /tasks/stats) a partir de la tabla tasks.
+# Es seguro ejecutarlo con la API en marcha; conviene hacerlo tras añadir las
+# columnas a una base de datos existente o tras modificar tareas fuera de la API.
+#
+# Uso:
+#   python reconcile_task_stats.py --batch-size 1000
+
+import argparse
+
+from app.database import SessionLocal, shard_engines, shard_map
+from app import crud, sharding
+
+parser = argparse.ArgumentParser(description="Recalcula los contadores de tareas de los usuarios")
+parser.add_argument("--batch-size", type=int, default=1000, help="Usuarios por lote (un commit por lote)")
+args = parser.parse_args()
+
+# Con DATABASE_SHARD_URLS se recalculan en cada shard los contadores de los
+# usuarios que viven en él según shard_map (ver app/sharding.py); los que se
+# están moviendo (rebalance_shards.py) se saltan.
+shard_map.load()
+
+
+def en_shard(shard: int):
+    def owns(owner_id: int) -> bool:
+        try:
+            return shard_map.shard_for(owner_id) == shard
+        except sharding.ShardMovingError:
+            return False
+    return owns
+
+
+for i, shard_engine in enumerate(shard_engines):
+    print(f"Recalculando contadores de tareas (shard {i})...")
+    db = SessionLocal(bind=shard_engine)
+    try:
+        resultado = crud.reconcile_task_stats(db, batch_size=args.batch_size, owns=en_shard(i))
+    finally:
+        db.close()
+    print(f"Usuarios revisados: {resultado['users_checked']}, corregidos: {resultado['users_fixed']}")
@@ -0,0 +1,389 @@
+# serve.py (en la raíz del proyecto)
+# Arranque en producción con varios workers (modelo prefork).
+#
+# - El proceso maestro abre el socket, importa la aplicación una sola vez
+#   (precarga, por defecto) y crea los workers con fork(): heredan el código ya
+#   importado y no repiten el coste de importar FastAPI, SQLAlchemy, passlib...
+# - Los workers no heredan conexiones: tras el fork se descartan los pools de
+#   los engines (ver database._dispose_after_fork) y cada worker abre las suyas
+#   la primera vez que las usa. El maestro nunca conecta con la base de datos.
+# - SIGHUP: recarga escalonada. Se arranca un worker nuevo, se espera a que
+#   acepte conexiones y solo entonces se para uno antiguo (SIGTERM: deja de
+#   aceptar y termina las peticiones en curso), hasta sustituirlos todos.
+#   Con --no-preload cada worker importa la aplicación, así que los nuevos
+#   cargan el código nuevo. Con precarga, los workers heredarían los módulos
+#   que el maestro importó al arrancar: el maestro comprueba primero que el
+#   código nuevo se importa sin errores (si no, cancela la recarga) y se
+#   re-ejecuta (exec, mismo PID) conservando el socket y los workers antiguos,
+#   que el maestro nuevo sustituye uno a uno como en una recarga normal.
+# - SIGTERM/SIGINT: apagado ordenado de todos los workers.
+# - Si un worker en marcha muere, se arranca otro. Si un worker no llega a
+#   arrancar, el maestro se detiene (o, durante una recarga, se cancela esta y
+#   siguen los workers antiguos).
+#
+# Al arrancar se muestra el desglose del tiempo de arranque de cada worker, y
+# con --profile-imports el del tiempo de importación por paquete.
+#
+# Uso:
+#   python serve.py --workers 4 --port 8000
+#   kill -HUP <pid del maestro>            # recarga escalonada
+#   python serve.py --profile-imports 20   # los 20 paquetes más lentos de importar
+
+import argparse
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from collections import defaultdict
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+# Variables con las que el maestro se pasa a sí mismo el socket y los workers
+# antiguos al re-ejecutarse en una recarga con precarga
+ENV_LISTEN_FD = "SERVE_LISTEN_FD"
+ENV_WORKER_PIDS = "SERVE_WORKER_PIDS"
+
+
+def cpu_cores() -> int:
+    """Núcleos disponibles para este proceso (respeta taskset/cgroups cpuset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def log(msg: str) -> None:
+    print(f"[serve {os.getpid()}] {msg}", flush=True)
+
+
+# --- Perfil de importación ---
+def profile_imports(top: int) -> None:
+    """
+    Importa app.main en un intérprete nuevo con -X importtime y resume el
+    tiempo propio de cada paquete y el acumulado (con sus dependencias) de cada
+    paquete y de cada módulo de la aplicación.
+    """
+    resultado = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=RAIZ, capture_output=True, text=True,
+    )
+    if resultado.returncode != 0:
+        print(resultado.stderr, file=sys.stderr)
+        sys.exit(resultado.returncode)
+    propio = defaultdict(int)
+    acumulados = []
+    for linea in resultado.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        self_us, acumulado_us, nombre = linea[len("import time:"):].split("|")
+        modulo = nombre.strip()
+        propio[modulo.split(".")[0]] += int(self_us)
+        # Coste total (con sus dependencias) de cada paquete y de cada módulo de la aplicación
+        if "." not in modulo or modulo.startswith("app."):
+            acumulados.append((int(acumulado_us), modulo))
+    total = sum(propio.values())
+    print(f"Importar app.main: {total / 1000:.1f} ms (sin contar los módulos ya cargados al arrancar Python)")
+    print(f"\n{'Paquete':<32} {'ms propios':>10} {'%':>6}")
+    for paquete, us in sorted(propio.items(), key=lambda x: -x[1])[:top]:
+        print(f"{paquete:<32} {us / 1000:>10.1f} {us * 100 / total:>6.1f}")
+    print(f"\n{'Paquete o módulo de app':<32} {'ms acumulados':>13}")
+    for us, modulo in sorted(acumulados, reverse=True)[:top]:
+        print(f"{modulo:<32} {us / 1000:>13.1f}")
+
+
+# --- Worker ---
+def _run_worker(args, sock: socket.socket, ready_w: int, app, fork_time: float) -> None:
+    """Cuerpo del proceso hijo: sirve la aplicación con uvicorn sobre el socket heredado."""
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGQUIT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+    tiempos = {"pid": os.getpid(), "fork_ms": round((time.perf_counter() - fork_time) * 1000, 2)}
+
+    if app is None:
+        inicio = time.perf_counter()
+        from app.main import app
+        tiempos["import_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+
+    import uvicorn
+
+    class ReadyServer(uvicorn.Server):
+        """Avisa al maestro cuando el worker ya acepta conexiones."""
+
+        async def startup(self, sockets=None):
+            inicio = time.perf_counter()
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                tiempos["startup_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+                tiempos["ready_ms"] = round((time.perf_counter() - fork_time) * 1000, 2)
+                os.write(ready_w, json.dumps(tiempos).encode() + b"\n")
+                os.close(ready_w)
+
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=args.log_level,
+        access_log=args.access_log,
+        proxy_headers=args.proxy_headers,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    ReadyServer(config).run(sockets=[sock])
+
+
+class Worker:
+    def __init__(self, pid: int, ready_fd: int):
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.retiring = False
+
+
+class Arbiter:
+    """Proceso maestro: crea, vigila, recarga y detiene los workers."""
+
+    def __init__(self, args, sock: socket.socket, app, adopted=()):
+        self.args = args
+        self.sock = sock
+        self.app = app
+        self.workers = {}
+        # Workers del maestro anterior a un exec: se sustituyen al arrancar
+        for pid in adopted:
+            worker = self.workers[pid] = Worker(pid, None)
+            worker.ready = True
+        self.signals = []
+        self.stopping = False
+        self.reloading = False
+        self.exit_code = 0
+
+    # --- Señales ---
+    def _on_signal(self, sig, frame):
+        self.signals.append(sig)
+
+    def _install_signals(self):
+        self._wake_r, wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGQUIT, signal.SIGCHLD):
+            signal.signal(sig, self._on_signal)
+
+    # --- Workers ---
+    def spawn(self) -> Worker:
+        ready_r, ready_w = os.pipe()
+        fork_time = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            try:
+                _run_worker(self.args, self.sock, ready_w, self.app, fork_time)
+                code = 0
+            except SystemExit as exc:
+                code = exc.code if isinstance(exc.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+        os.close(ready_w)
+        worker = self.workers[pid] = Worker(pid, ready_r)
+        return worker
+
+    def _active(self):
+        return [w for w in self.workers.values() if not w.retiring]
+
+    def retire(self, worker: Worker) -> None:
+        """Apagado ordenado de un worker (termina las peticiones en curso)."""
+        worker.retiring = True
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _poll(self, timeout: float) -> None:
+        """Espera señales o avisos de arranque y procesa los avisos y los workers terminados."""
+        pendientes = {w.ready_fd: w for w in self.workers.values() if not w.ready and w.ready_fd is not None}
+        try:
+            listos, _, _ = select.select([self._wake_r, *pendientes], [], [], timeout)
+        except InterruptedError:
+            listos = []
+        for fd in listos:
+            if fd == self._wake_r:
+                try:
+                    while os.read(self._wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            worker = pendientes[fd]
+            datos = os.read(fd, 4096)
+            os.close(fd)
+            worker.ready_fd = None
+            if datos:
+                worker.ready = True
+                tiempos = json.loads(datos)
+                desglose = ", ".join(f"{k}={v}" for k, v in tiempos.items() if k != "pid")
+                log(f"Worker {worker.pid} listo ({desglose})")
+        self._reap()
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, estado = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            if worker.retiring or self.stopping:
+                continue
+            if os.WIFSIGNALED(estado):
+                motivo = f"señal {os.WTERMSIG(estado)}"
+            else:
+                motivo = f"código {os.waitstatus_to_exitcode(estado)}"
+            if worker.ready:
+                log(f"Worker {pid} terminó inesperadamente ({motivo}); se arranca otro")
+            elif self.reloading:
+                log(f"El worker nuevo {pid} no arrancó ({motivo}); se cancela la recarga")
+            else:
+                log(f"El worker {pid} no arrancó ({motivo}); se detiene el servidor")
+                self.exit_code = 1
+                self.signals.append(signal.SIGTERM)
+
+    # --- Recarga y parada ---
+    def reload(self) -> None:
+        """Sustituye los workers uno a uno, sin bajar nunca de --workers atendiendo."""
+        antiguos = list(self._active())
+        log(f"Recarga escalonada de {len(antiguos)} workers")
+        self.reloading = True
+        try:
+            for antiguo in antiguos:
+                nuevo = self.spawn()
+                limite = time.monotonic() + self.args.ready_timeout
+                while not nuevo.ready and nuevo.pid in self.workers and time.monotonic() < limite:
+                    self._poll(0.5)
+                    if any(s in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT) for s in self.signals):
+                        return
+                if not nuevo.ready:
+                    if nuevo.pid in self.workers:
+                        log(f"El worker nuevo {nuevo.pid} no estuvo listo en {self.args.ready_timeout} s; se cancela la recarga")
+                        self.retire(nuevo)
+                    return
+                self.retire(antiguo)
+            log("Recarga completada")
+        finally:
+            self.reloading = False
+
+    def reexec(self) -> None:
+        """Recarga con precarga: re-ejecuta el maestro para importar el código nuevo."""
+        comprobacion = subprocess.run([sys.executable, "-c", "import app.main"], cwd=RAIZ)
+        if comprobacion.returncode != 0:
+            log("El código nuevo no se puede importar; se cancela la recarga")
+            return
+        pids = [w.pid for w in self._active()]
+        log(f"Re-ejecutando el maestro para cargar el código nuevo ({len(pids)} workers antiguos)")
+        os.environ[ENV_LISTEN_FD] = str(self.sock.fileno())
+        os.environ[ENV_WORKER_PIDS] = ",".join(map(str, pids))
+        signal.set_wakeup_fd(-1)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.executable, [sys.executable, *sys.orig_argv[1:]])
+
+    def stop(self) -> None:
+        self.stopping = True
+        log(f"Deteniendo {len(self.workers)} workers")
+        for worker in list(self.workers.values()):
+            self.retire(worker)
+        limite = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < limite:
+            self._poll(0.2)
+        for worker in list(self.workers.values()):
+            log(f"Worker {worker.pid} no terminó a tiempo; se fuerza (SIGKILL)")
+            try:
+                os.kill(worker.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.workers:
+            self._poll(0.2)
+
+    def run(self) -> int:
+        self._install_signals()
+        log(f"Escuchando en http://{self.args.host}:{self.args.port} con {self.args.workers} workers")
+        if self.workers:
+            self.reload()
+        while True:
+            while not self.stopping and len(self._active()) < self.args.workers:
+                self.spawn()
+            self._poll(1.0)
+            while self.signals:
+                sig = self.signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+                    self.stop()
+                    return self.exit_code
+                if sig == signal.SIGHUP:
+                    if self.app is not None:
+                        self.reexec()
+                    else:
+                        self.reload()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción con varios workers (prefork)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or cpu_cores(),
+                        help="Número de workers (por defecto WEB_CONCURRENCY o uno por núcleo)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Cada worker importa la aplicación en vez de heredarla del maestro. "
+                             "Arranque más lento; la recarga con SIGHUP no necesita re-ejecutar el maestro "
+                             "(con precarga, SIGHUP re-ejecuta el maestro para cargar el código nuevo)")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="Segundos para terminar las peticiones en curso al parar un worker")
+    parser.add_argument("--ready-timeout", type=float, default=60,
+                        help="Segundos máximos para que un worker nuevo esté listo durante una recarga")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true",
+                        help="Log de acceso de uvicorn (la aplicación ya registra una muestra de las peticiones)")
+    parser.add_argument("--proxy-headers", action="store_true", help="Usar X-Forwarded-For/Proto (detrás de un proxy)")
+    parser.add_argument("--forwarded-allow-ips", default="127.0.0.1")
+    parser.add_argument("--profile-imports", type=int, nargs="?", const=25, default=None, metavar="N",
+                        help="Muestra los N paquetes más lentos de importar y termina")
+    args = parser.parse_args()
+
+    if args.profile_imports is not None:
+        profile_imports(args.profile_imports)
+        return
+
+    # Los procesos de bcrypt de todos los workers se reparten los núcleos
+    os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(cpu_cores() // args.workers, 1)))
+
+    adopted = []
+    if ENV_LISTEN_FD in os.environ:
+        # Re-ejecución tras SIGHUP (ver Arbiter.reexec): socket y workers heredados
+        sock = socket.socket(fileno=int(os.environ.pop(ENV_LISTEN_FD)))
+        adopted = [int(pid) for pid in os.environ.pop(ENV_WORKER_PIDS, "").split(",") if pid]
+    else:
+        sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((args.host, args.port))
+        sock.listen(2048)
+    sock.set_inheritable(True)
+
+    app = None
+    if args.preload:
+        inicio = time.perf_counter()
+        from app.main import app
+        log(f"Aplicación precargada en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    sys.exit(Arbiter(args, sock, app, adopted).run())
+
+
+if __name__ == "__main__":
+    main()
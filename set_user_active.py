@@ -0,0 +1,36 @@
+# set_user_active.py (en la raíz del proyecto)
+# Desactiva (o reactiva) un usuario. Al desactivarlo, el refresh deja de
+# funcionar, los tokens nuevos llevan act=false (las rutas responden 400) y
+# sus access tokens ya emitidos se rechazan en todos los workers como mucho
+# REVOCATION_REFRESH_SECONDS después (tabla token_revocations, ver
+# app/security.py). Es seguro ejecutarlo con la API en marcha.
+#
+# Uso:
+#   python set_user_active.py --username alice --deactivate
+#   python set_user_active.py --username alice --activate
+
+import argparse
+import sys
+
+from app.database import SessionLocal
+from app import crud
+
+parser = argparse.ArgumentParser(description="Activa o desactiva un usuario y revoca sus tokens")
+parser.add_argument("--username", required=True, help="Usuario a modificar")
+accion = parser.add_mutually_exclusive_group(required=True)
+accion.add_argument("--deactivate", action="store_true", help="Desactiva al usuario y revoca sus tokens")
+accion.add_argument("--activate", action="store_true", help="Reactiva al usuario")
+args = parser.parse_args()
+
+db = SessionLocal()
+try:
+    usuario = crud.get_user_by_username(db, args.username)
+    if usuario is None:
+        sys.exit(f"El usuario {args.username} no existe")
+    crud.update_user_active(db, usuario, is_active=args.activate)
+finally:
+    db.close()
+if args.activate:
+    print(f"Usuario {args.username} reactivado.")
+else:
+    print(f"Usuario {args.username} desactivado; sus tokens se rechazan en todos los workers.")